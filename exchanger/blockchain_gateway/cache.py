@@ -0,0 +1,60 @@
+import time
+import typing
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from prometheus_client import Counter
+
+CACHE_REQUESTS = Counter(
+    'exchanger_address_cache_requests_total',
+    'Address validation cache lookups by result',
+    ['result'])
+
+
+class AddressCache:
+    """
+    Bounded in process LRU cache of validation results with TTL, keyed by
+    (currency_slug, address).
+    """
+
+    def __init__(self,
+                 maxsize: typing.Optional[int] = None,
+                 ttl: typing.Optional[float] = None):
+        self.maxsize = maxsize or settings.BGW_ADDRESS_CACHE_SIZE
+        self.ttl = settings.BGW_ADDRESS_CACHE_TTL if ttl is None else ttl
+        self._data: typing.OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__} class'
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key: typing.Tuple[str, str]) -> typing.Optional[typing.Dict]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                CACHE_REQUESTS.labels('miss').inc()
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                CACHE_REQUESTS.labels('expired').inc()
+                return None
+            self._data.move_to_end(key)
+        CACHE_REQUESTS.labels('hit').inc()
+        return value
+
+    def set(self, key: typing.Tuple[str, str], value: typing.Dict
+            ) -> typing.NoReturn:
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> typing.NoReturn:
+        with self._lock:
+            self._data.clear()
@@ -1,11 +1,15 @@
-import grpc
 import typing
+import threading
+from concurrent import futures
 from django.conf import settings
+from exchanger import deadline
 from exchanger.gateway.base import BaseGateway
+from exchanger.gateway.pool import ChannelPool
 from exchanger.models import InputTransaction
 from exchanger.rpc.blockchain_gateway_pb2_grpc import \
     blockchain__gateway__pb2 as blockchain_gateway_pb2
 from exchanger.rpc import blockchain_gateway_pb2_grpc
+from .cache import AddressCache
 from .exceptions import BlockchainBadResponseException
 from .serializers import BGWTransactionSerializer
 
@@ -19,9 +23,64 @@ class BlockChainServiceGateway(BaseGateway):
     ServiceStub = blockchain_gateway_pb2_grpc.BlockchainGatewayServiceStub
     ALLOWED_STATUTES = (blockchain_gateway_pb2.SUCCESS,)
     EXC_CLASS = BlockchainBadResponseException
+    IDEMPOTENT_METHODS = frozenset({'CheckAddress', 'GetTransaction'})
     BAD_RESPONSE_MSG = 'Bad response from blockchain gateway.'
     response_attr: str = 'status'
 
+    def __init__(self, pool: typing.Optional[ChannelPool] = None):
+        super().__init__(pool)
+        self.address_cache = AddressCache()
+        self._executor: typing.Optional[futures.ThreadPoolExecutor] = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def executor(self) -> futures.ThreadPoolExecutor:
+        """Threads for concurrent checks, started on first use in worker."""
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = futures.ThreadPoolExecutor(
+                        settings.BGW_CHECK_ADDRESS_WORKERS,
+                        thread_name_prefix=self.NAME)
+        return self._executor
+
+    def check_addresses(
+            self,
+            pairs: typing.Iterable[typing.Tuple[str, str]]
+    ) -> typing.Dict[typing.Tuple[str, str], typing.Dict]:
+        """
+        Validate several addresses at once. Recently validated addresses
+        are served from cache, the rest are checked concurrently.
+
+        :param pairs: (address, currency_slug) pairs
+        :return: check_address response by (address, currency_slug)
+        """
+        results = {}
+        missing = []
+        for address, currency_slug in dict.fromkeys(pairs):
+            cached = self.address_cache.get((currency_slug, address))
+            if cached is not None:
+                results[(address, currency_slug)] = cached
+            else:
+                missing.append((address, currency_slug))
+
+        if len(missing) == 1:
+            checked = [self.check_address(*missing[0])]
+        else:
+            active = deadline.current()
+
+            def check(pair):
+                with deadline.bind(active):
+                    return self.check_address(*pair)
+
+            checked = list(self.executor.map(check, missing))
+
+        for (address, currency_slug), response in zip(missing, checked):
+            if response.get('isinstance'):
+                self.address_cache.set((currency_slug, address), response)
+            results[(address, currency_slug)] = response
+        return results
+
     def check_address(
             self,
             address: str = None,
@@ -38,11 +97,8 @@ class BlockChainServiceGateway(BaseGateway):
             address=address,
             currencySlug=currency_slug)
 
-        with grpc.insecure_channel(self.GW_ADDRESS) as channel:
-            client = self.ServiceStub(channel)
-            response_data = self._base_request(request_message,
-                                               client.CheckAddress)
-            response_data['isinstance'] = response_data.get('isinstance', False)
+        response_data = self._base_request(request_message, 'CheckAddress')
+        response_data['isinstance'] = response_data.get('isinstance', False)
         return response_data
 
     def get_transaction(
@@ -63,16 +119,17 @@ class BlockChainServiceGateway(BaseGateway):
         request_message = self.MODULE.GetTransactionRequest(
             hash=_hash, currencySlug=currency_slug, to=to_address
         )
-        with grpc.insecure_channel(self.GW_ADDRESS) as channel:
-            client = self.ServiceStub(channel)
-            response_data = self._base_request(
-                request_message, client.GetTransaction,
-                extend_statutes=(blockchain_gateway_pb2.PENDING,
-                                 blockchain_gateway_pb2.NOT_FOUND))
+        policy = self.policy(
+            'GetTransaction',
+            allowed_statuses=self.ALLOWED_STATUTES + (
+                blockchain_gateway_pb2.PENDING,
+                blockchain_gateway_pb2.NOT_FOUND))
+        response_data = self._base_request(
+            request_message, 'GetTransaction', policy=policy)
 
-            data = response_data['transaction']
-            data['status'] = response_data[self.response_attr]['status']
+        data = response_data['transaction']
+        data['status'] = response_data[self.response_attr]['status']
 
-            serializer = BGWTransactionSerializer(data=data, instance=instance)
+        serializer = BGWTransactionSerializer(data=data, instance=instance)
 
         return serializer
@@ -0,0 +1,173 @@
+import json
+import time
+import typing
+import logging
+import threading
+
+from django.conf import settings
+from prometheus_client import Counter
+from prometheus_client import Gauge
+
+from exchanger.locks import connect_redis
+from exchanger.locks import request_key
+
+logger = logging.getLogger('exchanger')
+
+CACHE_REQUESTS = Counter(
+    'exchanger_rates_cache_requests_total',
+    'Rate cache lookups by tier and result',
+    ['tier', 'result'])
+CACHE_AGE = Gauge(
+    'exchanger_rates_cache_age_seconds',
+    'Age of the last served rate table')
+
+
+class CacheEntry:
+    """Raw value as stored in redis and object built from it once."""
+
+    __slots__ = ('value', 'fetched_at', 'obj')
+
+    def __init__(self, value: typing.Any, fetched_at: float, obj: typing.Any):
+        self.value = value
+        self.fetched_at = fetched_at
+        self.obj = obj
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.fetched_at
+
+    def dumps(self) -> str:
+        return json.dumps({'value': self.value, 'fetched_at': self.fetched_at})
+
+
+class RatesCache:
+    """
+    Two tier TTL cache with stale-while-revalidate semantics.
+
+    Entry younger than ttl is served as is. Entry older than ttl but younger
+    than ttl + stale_ttl is served too while a single background refresh is
+    started. Older entries are fetched synchronously. Callers on money
+    critical paths pass max_age to put an explicit bound on staleness.
+
+    Local tier lives in process memory, shared tier lives in redis so one
+    remote fetch serves all uwsgi workers.
+    """
+
+    def __init__(self,
+                 name: str,
+                 fetch: typing.Callable[[], typing.Any],
+                 ttl: typing.Optional[float] = None,
+                 stale_ttl: typing.Optional[float] = None,
+                 build: typing.Optional[typing.Callable] = None):
+        """
+        :param fetch: callable returning json serializable value
+        :param build: callable(value, fetched_at) building object served
+        to callers, it runs once per fetched or loaded value
+        """
+        self.key = request_key('cache', name)
+        self.fetch = fetch
+        self.build = build
+        self.ttl = settings.RATES_CACHE_TTL if ttl is None else ttl
+        self.stale_ttl = (settings.RATES_CACHE_STALE_TTL
+                          if stale_ttl is None else stale_ttl)
+        self._local: typing.Optional[CacheEntry] = None
+        self._refresh_lock = threading.Lock()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__} class'
+
+    def get(self, max_age: typing.Optional[float] = None) -> typing.Any:
+        """
+        :param max_age: max acceptable age of value in seconds, default is
+        ttl + stale_ttl
+        """
+        max_stale = self.ttl + self.stale_ttl if max_age is None else max_age
+        entry = self._lookup()
+        if entry is not None and entry.age <= max_stale:
+            if entry.age > self.ttl:
+                self._refresh_async()
+            CACHE_AGE.set(entry.age)
+            return entry.obj
+        CACHE_REQUESTS.labels('remote', 'miss').inc()
+        return self.refresh().obj
+
+    def refresh(self) -> CacheEntry:
+        entry = self._make_entry(self.fetch(), time.time())
+        self._local = entry
+        self._shared_set(entry)
+        CACHE_AGE.set(0)
+        return entry
+
+    def invalidate(self) -> typing.NoReturn:
+        self._local = None
+        try:
+            connect_redis().delete(self.key)
+        except Exception as e:
+            logger.warning(f'{self.__class__.__name__} invalidate failed {e}')
+
+    def _make_entry(self, value: typing.Any, fetched_at: float) -> CacheEntry:
+        obj = self.build(value, fetched_at) if self.build else value
+        return CacheEntry(value, fetched_at, obj)
+
+    def _lookup(self) -> typing.Optional[CacheEntry]:
+        local = self._local
+        if local is not None and local.age <= self.ttl:
+            CACHE_REQUESTS.labels('local', 'hit').inc()
+            return local
+
+        shared = self._shared_get()
+        if shared is not None and (local is None or
+                                   shared.fetched_at > local.fetched_at):
+            self._local = shared
+            CACHE_REQUESTS.labels(
+                'redis', 'hit' if shared.age <= self.ttl else 'stale').inc()
+            return shared
+
+        if local is not None:
+            CACHE_REQUESTS.labels('local', 'stale').inc()
+        return local
+
+    def _shared_get(self) -> typing.Optional[CacheEntry]:
+        try:
+            raw = connect_redis().get(self.key)
+            if not raw:
+                return None
+            data = json.loads(raw)
+            local = self._local
+            if local is not None and local.fetched_at == data['fetched_at']:
+                return local
+            return self._make_entry(data['value'], data['fetched_at'])
+        except Exception as e:
+            logger.warning(f'{self.__class__.__name__} redis get failed {e}')
+            return None
+
+    def _shared_set(self, entry: CacheEntry) -> typing.NoReturn:
+        try:
+            connect_redis().set(self.key, entry.dumps(),
+                                ex=int(self.ttl + self.stale_ttl) or 1)
+        except Exception as e:
+            logger.warning(f'{self.__class__.__name__} redis set failed {e}')
+
+    def _claim_refresh(self) -> bool:
+        """Let only one worker across the fleet revalidate the entry."""
+        try:
+            return bool(connect_redis().set(
+                f'{self.key}refresh', 1, nx=True, ex=int(self.ttl) or 1))
+        except Exception:
+            return True
+
+    def _refresh_async(self) -> typing.NoReturn:
+        if not self._refresh_lock.acquire(blocking=False):
+            return
+
+        def _run():
+            try:
+                if self._claim_refresh():
+                    self.refresh()
+            except Exception as e:
+                logger.error(f'{self.__class__.__name__} background '
+                             f'refresh failed {e}')
+            finally:
+                self._refresh_lock.release()
+
+        threading.Thread(target=_run, daemon=True).start()
@@ -1,12 +1,13 @@
-import grpc
 import typing
-from collections import OrderedDict
 from django.conf import settings
 from exchanger.gateway.base import BaseGateway
+from exchanger.gateway.pool import ChannelPool
 from exchanger.rpc.currencies_pb2_grpc import currencies__pb2 as currencies_pb2
 from exchanger.rpc import currencies_pb2_grpc
-from .serializers import CurrencySerializer
 from .exceptions import CurrenciesBadResponseException
+from .cache import RatesCache
+from .rates import RateTable
+from .types import Currency
 
 
 class CurrenciesServiceGateway(BaseGateway):
@@ -17,17 +18,31 @@ class CurrenciesServiceGateway(BaseGateway):
     TIMEOUT = settings.GRPC_TIMEOUT
     ServiceStub = currencies_pb2_grpc.CurrenciesServiceStub
     EXC_CLASS = CurrenciesBadResponseException
+    IDEMPOTENT_METHODS = frozenset({'Get'})
     NAME = 'currencies'
     ALLOWED_STATUTES = (currencies_pb2.SUCCESS, )
     BAD_RESPONSE_MSG = 'Bad response from currencies service'
 
-    def get_currencies(self) -> typing.List[OrderedDict]:
-        request_message = self.MODULE.CurrenciesRequest()
-        with grpc.insecure_channel(self.GW_ADDRESS) as channel:
-            stub = self.ServiceStub(channel)
+    def __init__(self, pool: typing.Optional[ChannelPool] = None):
+        super().__init__(pool)
+        self.cache = RatesCache(self.NAME, self._fetch_currencies,
+                                build=RateTable.from_currencies)
+
+    def get_rates(self, max_age: typing.Optional[float] = None) -> RateTable:
+        """
+        Rate table served from cache
+        :param max_age: max acceptable age of rates in seconds, money
+        critical paths should pass settings.RATES_MAX_STALENESS
+        """
+        return self.cache.get(max_age=max_age)
 
-            response = self._base_request(request_message, stub.Get)
+    def get_currencies(
+            self,
+            max_age: typing.Optional[float] = None
+    ) -> typing.List[typing.Dict]:
+        return [dict(_) for _ in self.get_rates(max_age).currencies]
 
-        serializer = CurrencySerializer(data=response['currencies'], many=True)
-        serializer.is_valid(raise_exception=True)
-        return serializer.data
+    def _fetch_currencies(self) -> typing.List[typing.Dict]:
+        request_message = self.MODULE.CurrenciesRequest()
+        response = self._base_request(request_message, 'Get', raw=True)
+        return [Currency.from_message(c).as_dict() for c in response.currencies]
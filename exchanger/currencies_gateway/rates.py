@@ -0,0 +1,70 @@
+import time
+import typing
+import hashlib
+from decimal import Decimal
+from types import MappingProxyType
+
+
+class RateTable:
+    """
+    Immutable slug indexed table of usd rates.
+    Rates are parsed to Decimal once, when table is built from currencies
+    service response.
+    """
+
+    __slots__ = ('_rates', 'currencies', 'version', 'fetched_at')
+
+    def __init__(self,
+                 currencies: typing.Iterable[typing.Dict],
+                 fetched_at: typing.Optional[float] = None):
+        currencies = tuple(MappingProxyType(dict(c)) for c in currencies)
+        rates = {c['slug']: Decimal(c['rate']) for c in currencies}
+        version = hashlib.sha1(
+            repr(sorted(rates.items())).encode()).hexdigest()[:12]
+        setattr_ = super().__setattr__
+        setattr_('_rates', MappingProxyType(rates))
+        setattr_('currencies', currencies)
+        setattr_('version', version)
+        setattr_('fetched_at', time.time() if fetched_at is None
+                 else fetched_at)
+
+    @classmethod
+    def from_currencies(cls,
+                        currencies: typing.Iterable[typing.Dict],
+                        fetched_at: typing.Optional[float] = None
+                        ) -> 'RateTable':
+        return cls(currencies, fetched_at)
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f'{self.__class__.__name__} is immutable')
+
+    def __repr__(self):
+        return f'{self.__class__.__name__} {self.version}'
+
+    def __getitem__(self, slug: str) -> Decimal:
+        return self._rates[slug]
+
+    def __contains__(self, slug: str) -> bool:
+        return slug in self._rates
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return iter(self._rates)
+
+    def __len__(self) -> int:
+        return len(self._rates)
+
+    def get(self,
+            slug: str,
+            default: typing.Optional[Decimal] = None
+            ) -> typing.Optional[Decimal]:
+        return self._rates.get(slug, default)
+
+    def to_usd(self, amount: Decimal, slug: str) -> Decimal:
+        return amount * self._rates[slug]
+
+    def from_usd(self, amount: Decimal, slug: str) -> Decimal:
+        return amount / self._rates[slug]
+
+    def convert(self, amount: Decimal, from_slug: str, to_slug: str) -> Decimal:
+        """Convert amount of from_slug currency to to_slug currency."""
+        return amount * self._rates[from_slug] / self._rates[to_slug]
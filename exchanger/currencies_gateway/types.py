@@ -0,0 +1,83 @@
+import typing
+
+from .exceptions import CurrenciesBadResponseException
+
+
+class Coefficient:
+    """Coefficient of currency read straight from protobuf message."""
+
+    __slots__ = ('days', 'collateral_coefficient', 'mandatory_coefficient',
+                 'warning_coefficient')
+
+    def __init__(self, days: int, collateral_coefficient: float,
+                 mandatory_coefficient: float, warning_coefficient: float):
+        self.days = days
+        self.collateral_coefficient = collateral_coefficient
+        self.mandatory_coefficient = mandatory_coefficient
+        self.warning_coefficient = warning_coefficient
+
+    def __repr__(self):
+        return f'{self.__class__.__name__} {self.days}'
+
+    @classmethod
+    def from_message(cls, message) -> 'Coefficient':
+        return cls(
+            message.days,
+            float(message.collateral_coefficient or 0),
+            float(message.mandatory_coefficient or 0),
+            float(message.warning_coefficient or 0),
+        )
+
+    def as_dict(self) -> typing.Dict[str, typing.Any]:
+        return {
+            'days': self.days,
+            'collateral_coefficient': self.collateral_coefficient,
+            'mandatory_coefficient': self.mandatory_coefficient,
+            'warning_coefficient': self.warning_coefficient,
+        }
+
+
+class Currency:
+    """
+    Currency read straight from protobuf message of trusted currencies
+    service, without MessageToDict and serializer round trip.
+    """
+
+    __slots__ = ('id', 'name', 'fullname', 'slug', 'rate', 'coefficients')
+
+    def __init__(self, id: int, name: str, fullname: str, slug: str,
+                 rate: str, coefficients: typing.Tuple[Coefficient, ...]):
+        self.id = id
+        self.name = name
+        self.fullname = fullname
+        self.slug = slug
+        self.rate = rate
+        self.coefficients = coefficients
+
+    def __repr__(self):
+        return f'{self.__class__.__name__} {self.slug}'
+
+    @classmethod
+    def from_message(cls, message) -> 'Currency':
+        if not message.slug or not message.rate:
+            raise CurrenciesBadResponseException(
+                f'Currency {message.slug or message.id} has no slug or rate')
+        return cls(
+            message.id,
+            message.name,
+            message.fullname,
+            message.slug,
+            message.rate,
+            tuple(Coefficient.from_message(c) for c in message.coefficients),
+        )
+
+    def as_dict(self) -> typing.Dict[str, typing.Any]:
+        """Json serializable form, the one kept in rates cache."""
+        return {
+            'id': self.id,
+            'name': self.name,
+            'fullname': self.fullname,
+            'slug': self.slug,
+            'rate': self.rate,
+            'coefficients': [c.as_dict() for c in self.coefficients],
+        }
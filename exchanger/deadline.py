@@ -0,0 +1,66 @@
+import time
+import typing
+import threading
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+class DeadlineExceeded(TimeoutError):
+    """Time budget of current request is spent."""
+
+
+class Deadline:
+    """Point in monotonic time after which remote calls are not started."""
+
+    __slots__ = ('expires_at',)
+
+    def __init__(self, seconds: float):
+        self.expires_at = time.monotonic() + seconds
+
+    def __repr__(self):
+        return f'{self.__class__.__name__} {self.remaining():.3f}s'
+
+    def remaining(self) -> float:
+        return max(self.expires_at - time.monotonic(), 0)
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at <= time.monotonic()
+
+
+def current() -> typing.Optional[Deadline]:
+    """Deadline of the code running in this thread, None if unbounded."""
+    return getattr(_local, 'deadline', None)
+
+
+def remaining(default: typing.Optional[float] = None
+              ) -> typing.Optional[float]:
+    """Remaining budget in seconds, default if there is no deadline."""
+    active = current()
+    return default if active is None else active.remaining()
+
+
+@contextmanager
+def bind(active: typing.Optional[Deadline]):
+    """Run block under given deadline, used to carry it to other threads."""
+    previous = current()
+    _local.deadline = active
+    try:
+        yield active
+    finally:
+        _local.deadline = previous
+
+
+@contextmanager
+def deadline(seconds: float):
+    """
+    Run block with time budget of seconds. Nested budget never outlives
+    the enclosing one.
+    """
+    active = Deadline(seconds)
+    outer = current()
+    if outer is not None and outer.expires_at < active.expires_at:
+        active = outer
+    with bind(active):
+        yield active
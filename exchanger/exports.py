@@ -0,0 +1,131 @@
+import csv
+import json
+import typing
+from datetime import datetime
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import QuerySet
+
+from .models import ExchangeHistory
+from .models import InputTransaction
+from .models import OutPutTransaction
+
+TRANSACTION_FIELDS = (
+    'uuid',
+    'created_at',
+    'updated_at',
+    'status',
+    'currency__slug',
+    'value',
+    'from_address',
+    'to_address',
+    'trx_hash',
+    'confirmed_at',
+)
+
+EXPORTS = {
+    'exchanges': (ExchangeHistory, (
+        'uuid',
+        'created_at',
+        'updated_at',
+        'status',
+        'user_email',
+        'from_currency__slug',
+        'to_currency__slug',
+        'ingoing_amount',
+        'outgoing_amount',
+        'fee',
+        'issue_rate_from',
+        'issue_rate_to',
+        'from_address',
+        'to_address',
+        'transaction_input__trx_hash',
+        'transaction_output__trx_hash',
+    )),
+    'input_transactions': (InputTransaction, TRANSACTION_FIELDS),
+    'output_transactions': (OutPutTransaction, TRANSACTION_FIELDS),
+}
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+class _Echo:
+    """File like object returning written line instead of buffering it."""
+
+    @staticmethod
+    def write(value: str) -> str:
+        return value
+
+
+class Exporter:
+    """
+    Constant memory export of one model as csv or ndjson lines.
+
+    Rows are read as tuples by server side cursor in chunks of
+    EXPORT_CHUNK_SIZE and every line is produced just before it is written,
+    so memory does not depend on the number of exported rows.
+    """
+
+    def __init__(self,
+                 name: str,
+                 fmt: str = 'csv',
+                 status: typing.Optional[int] = None,
+                 created_from: typing.Optional[datetime] = None,
+                 created_to: typing.Optional[datetime] = None,
+                 chunk_size: typing.Optional[int] = None):
+        if name not in EXPORTS:
+            raise ValueError(f'Unknown export {name}')
+        if fmt not in FORMATS:
+            raise ValueError(f'Unknown export format {fmt}')
+        self.model, self.fields = EXPORTS[name]
+        self.name = name
+        self.fmt = fmt
+        self.status = status
+        self.created_from = created_from
+        self.created_to = created_to
+        self.chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+
+    def __repr__(self):
+        return f'{self.__class__.__name__} class'
+
+    @property
+    def content_type(self) -> str:
+        return FORMATS[self.fmt]
+
+    @property
+    def filename(self) -> str:
+        return f'{self.name}.{self.fmt}'
+
+    def queryset(self) -> QuerySet:
+        query = self.model.objects.all()
+        if self.status is not None:
+            query = query.filter(status=self.status)
+        if self.created_from is not None:
+            query = query.filter(created_at__gte=self.created_from)
+        if self.created_to is not None:
+            query = query.filter(created_at__lt=self.created_to)
+        return query.order_by('created_at', 'id')
+
+    def rows(self) -> typing.Iterator[tuple]:
+        return self.queryset().values_list(*self.fields).iterator(
+            chunk_size=self.chunk_size)
+
+    def lines(self) -> typing.Iterator[str]:
+        if self.fmt == 'csv':
+            return self._csv_lines()
+        return self._ndjson_lines()
+
+    def _csv_lines(self) -> typing.Iterator[str]:
+        writer = csv.writer(_Echo())
+        yield writer.writerow(self.fields)
+        for row in self.rows():
+            yield writer.writerow(row)
+
+    def _ndjson_lines(self) -> typing.Iterator[str]:
+        for row in self.rows():
+            yield json.dumps(dict(zip(self.fields, row)),
+                             cls=DjangoJSONEncoder) + '\n'
@@ -0,0 +1,73 @@
+import time
+import typing
+import logging
+import threading
+from concurrent import futures
+
+from django.conf import settings
+from prometheus_client import Histogram
+
+from exchanger import deadline
+
+logger = logging.getLogger('exchanger')
+
+CALL_SECONDS = Histogram(
+    'exchanger_fan_out_call_seconds',
+    'Duration of independent remote calls run concurrently by fan_out',
+    ['call'])
+
+_executor: typing.Optional[futures.ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def executor() -> futures.ThreadPoolExecutor:
+    """Process wide pool, started on first use in worker."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = futures.ThreadPoolExecutor(
+                    settings.FAN_OUT_WORKERS, thread_name_prefix='fan_out')
+    return _executor
+
+
+def fan_out(calls: typing.Dict[str, typing.Callable[[], typing.Any]],
+            timeout: float) -> typing.Dict[str, typing.Any]:
+    """
+    Run independent calls concurrently and return their results by name.
+
+    All calls share one deadline of timeout seconds, bounded by deadline
+    of current request, which is also carried to the calls. First failure
+    is raised as soon as it happens and calls that have not started yet are
+    cancelled; calls already running are left to finish in background.
+    """
+    timings = {}
+    active = deadline.current()
+    if active is not None:
+        timeout = min(timeout, active.remaining())
+
+    def timed(name, call):
+        started = time.perf_counter()
+        try:
+            with deadline.bind(active):
+                return call()
+        finally:
+            timings[name] = time.perf_counter() - started
+            CALL_SECONDS.labels(name).observe(timings[name])
+
+    pending = {executor().submit(timed, name, call): name
+               for name, call in calls.items()}
+    done, not_done = futures.wait(pending, timeout=timeout,
+                                  return_when=futures.FIRST_EXCEPTION)
+    for future in not_done:
+        future.cancel()
+    logger.info(f'fan_out timings {timings}')
+
+    for future in done:
+        if future.exception() is not None:
+            raise future.exception()
+    if not_done:
+        raise TimeoutError(
+            f'{", ".join(pending[f] for f in not_done)} '
+            f'did not finish in {timeout}s')
+    return {pending[future]: future.result() for future in done}
@@ -1,3 +1,4 @@
+channel_pool = None
 wallets_service_gw = None
 trx_service_gw = None
 currency_service_gw = None
@@ -8,14 +9,18 @@ def start_remote_gateways():
     """Create remote services gateway instances with clients."""
     from exchanger import wallets_gateway, transactions_gateway, \
         currencies_gateway, blockchain_gateway
+    from exchanger.gateway.pool import ChannelPool
 
     global wallets_service_gw, trx_service_gw, currency_service_gw, \
-        bgw_service_gw
+        bgw_service_gw, channel_pool
 
-    wallets_service_gw = wallets_gateway.WalletsServiceGateway()
-    trx_service_gw = transactions_gateway.TransactionsServiceGateway()
-    currency_service_gw = currencies_gateway.CurrenciesServiceGateway()
-    bgw_service_gw = blockchain_gateway.BlockChainServiceGateway()
+    channel_pool = ChannelPool()
+    wallets_service_gw = wallets_gateway.WalletsServiceGateway(channel_pool)
+    trx_service_gw = transactions_gateway.TransactionsServiceGateway(
+        channel_pool)
+    currency_service_gw = currencies_gateway.CurrenciesServiceGateway(
+        channel_pool)
+    bgw_service_gw = blockchain_gateway.BlockChainServiceGateway(channel_pool)
 
     return wallets_service_gw, trx_service_gw, currency_service_gw, \
            bgw_service_gw
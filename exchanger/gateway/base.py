@@ -1,11 +1,18 @@
+import time
 import typing
 import logging
 from abc import ABC
-from django.conf import settings
 
-from retrying import retry
+import grpc
+from django.conf import settings
 from google.protobuf.json_format import MessageToDict
 
+from exchanger import deadline
+from exchanger.deadline import DeadlineExceeded
+from .breaker import circuit_breaker
+from .policy import RequestPolicy
+from .pool import ChannelPool
+
 logger = logging.getLogger('exchanger')
 
 
@@ -21,6 +28,13 @@ class BaseGateway(BaseRepr, ABC):
 
     GW_ADDRESS: str
     TIMEOUT: int = settings.GRPC_TIMEOUT
+    METHOD_TIMEOUTS: typing.Dict[str, float] = settings.GRPC_METHOD_TIMEOUTS
+    IDEMPOTENT_METHODS: typing.FrozenSet[str] = frozenset()
+    RETRYABLE_CODES: typing.Tuple[grpc.StatusCode] = (
+        grpc.StatusCode.UNAVAILABLE,
+        grpc.StatusCode.DEADLINE_EXCEEDED,
+        grpc.StatusCode.RESOURCE_EXHAUSTED,
+    )
     BAD_RESPONSE_MSG: str
     ALLOWED_STATUTES: typing.Tuple[int]
     NAME: str
@@ -30,46 +44,133 @@ class BaseGateway(BaseRepr, ABC):
     EXC_CLASS: typing.Callable
     response_attr: str = 'header'
 
-    @retry(stop_max_attempt_number=settings.REMOTE_OPERATION_ATTEMPT_NUMBER)
-    def _base_request(self, request_message, request_method,
-                      bad_response_msg: str = "",
-                      extend_statutes: typing.Optional = None) -> \
-            typing.Optional[typing.Dict[str, typing.Any]]:
+    def __init__(self, pool: typing.Optional[ChannelPool] = None):
+        self.pool = pool or ChannelPool()
+        self.breaker = circuit_breaker(self.NAME)
+
+    @property
+    def client(self):
+        """Service stub bound to the pooled channel of GW_ADDRESS."""
+        return self.pool.get_stub(self.GW_ADDRESS, self.ServiceStub)
+
+    def attempt_timeout(self, method: str) -> float:
+        """
+        Timeout of one attempt of method, bounded by remaining deadline of
+        current request.
+        """
+        timeout = self.METHOD_TIMEOUTS.get(method, self.TIMEOUT)
+        budget = deadline.remaining()
+        if budget is None:
+            return timeout
+        if budget <= 0:
+            raise DeadlineExceeded(f'{self.NAME} {method} is abandoned, '
+                                   f'request deadline is exceeded')
+        return min(timeout, budget)
+
+    def policy(self, method: str, **changes) -> RequestPolicy:
         """
+        Policy of method built from class attributes, changes override
+        fields of this call only.
+        """
+        fields = dict(
+            allowed_statuses=self.ALLOWED_STATUTES,
+            retryable_codes=self.RETRYABLE_CODES,
+            idempotent=method in self.IDEMPOTENT_METHODS,
+            attempts=settings.REMOTE_OPERATION_ATTEMPT_NUMBER,
+            backoff=settings.GRPC_RETRY_BACKOFF,
+            max_backoff=settings.GRPC_RETRY_MAX_BACKOFF,
+            bad_response_msg=self.BAD_RESPONSE_MSG,
+        )
+        fields.update(changes)
+        return RequestPolicy(**fields)
+
+    def backoff(self, method: str, attempt: int,
+                policy: RequestPolicy) -> typing.NoReturn:
+        """Sleep before next attempt unless deadline comes earlier."""
+        delay = policy.delay(attempt)
+        budget = deadline.remaining()
+        if budget is not None and delay >= budget:
+            raise DeadlineExceeded(f'{self.NAME} {method} is abandoned, '
+                                   f'no time left for retry')
+        time.sleep(delay)
+
+    def _base_request(self, request_message, method: str,
+                      policy: typing.Optional[RequestPolicy] = None,
+                      raw: bool = False) -> typing.Any:
+        """
+        Call method of remote service following policy, default one is
+        self.policy(method). Only idempotent calls are retried and only on
+        retryable grpc codes, bad response status is never retried. While
+        circuit breaker of the service is open, CircuitOpenError is raised
+        without calling it.
+
         :param request_message: protobuf message request object
-        :param request_method: client request method
+        :param method: name of service stub method
+        :param policy: RequestPolicy of this call
+        :param raw: return response message itself instead of dict, for
+        trusted responses read by typed gateway code
         """
-        if bad_response_msg:
-            self.BAD_RESPONSE_MSG = bad_response_msg
+        policy = policy or self.policy(method)
+        request_method = getattr(self.client, method)
+        for attempt in range(1, policy.attempts + 1):
+            timeout = self.attempt_timeout(method)
+            self.breaker.before_call()
+            started = time.monotonic()
+            try:
+                response = self._request(request_message, request_method,
+                                         timeout, policy, raw)
+            except grpc.RpcError as exc:
+                self.breaker.record(False, time.monotonic() - started)
+                if not policy.should_retry(attempt, exc.code()):
+                    raise
+                self.backoff(method, attempt, policy)
+            except Exception:
+                # bad response status, service itself is up
+                self.breaker.record(True, time.monotonic() - started)
+                raise
+            else:
+                self.breaker.record(True, time.monotonic() - started)
+                return response
 
-        if extend_statutes:
-            self.ALLOWED_STATUTES += extend_statutes
+    def _request(self, request_message, request_method, timeout: float,
+                 policy: RequestPolicy, raw: bool = False) -> typing.Any:
         try:
-            response = request_method(request_message, timeout=self.TIMEOUT)
-            header = getattr(response, self.response_attr)
-            status = header.status
-            if status in self.ALLOWED_STATUTES:
-                if status != self.MODULE.SUCCESS:
-                    self.LOGGER.warning(
-                        f"{self.NAME} error",
-                        {
-                            'status': self.MODULE.ResponseStatus.Name(status),
-                            'request': request_message,
-                            'from': self.__class__.__name__,
-                        }
-                    )
-                return MessageToDict(response, preserving_proto_field_name=True)
-            raise self.EXC_CLASS(str(
-                self.BAD_RESPONSE_MSG +
-                f" Got status "
-                f"{self.MODULE.ResponseStatus.Name(status)}: "
-                f"{header.description}.").replace("\n", " "))
+            response = request_method(request_message, timeout=timeout)
+            return self._parse_response(request_message, response, policy,
+                                        raw)
         except Exception as exc:
-            self.LOGGER.error(f"{self.NAME} error",
-                           {
-                               "from": self.__class__.__name__,
-                               "exc": exc,
-                               "exc_class": exc.__class__,
-                               "request": request_message.__class__.__name__,
-                           })
+            self._log_error(request_message, exc)
             raise exc
+
+    def _parse_response(self, request_message, response,
+                        policy: RequestPolicy, raw: bool = False) -> typing.Any:
+        """Check response status against policy and convert response."""
+        header = getattr(response, self.response_attr)
+        status = header.status
+        if status in policy.allowed_statuses:
+            if status != self.MODULE.SUCCESS:
+                self.LOGGER.warning(
+                    f"{self.NAME} error",
+                    {
+                        'status': self.MODULE.ResponseStatus.Name(status),
+                        'request': request_message,
+                        'from': self.__class__.__name__,
+                    }
+                )
+            if raw:
+                return response
+            return MessageToDict(response, preserving_proto_field_name=True)
+        raise self.EXC_CLASS(str(
+            policy.bad_response_msg +
+            f" Got status "
+            f"{self.MODULE.ResponseStatus.Name(status)}: "
+            f"{header.description}.").replace("\n", " "))
+
+    def _log_error(self, request_message, exc: Exception) -> typing.NoReturn:
+        self.LOGGER.error(f"{self.NAME} error",
+                          {
+                              "from": self.__class__.__name__,
+                              "exc": exc,
+                              "exc_class": exc.__class__,
+                              "request": request_message.__class__.__name__,
+                          })
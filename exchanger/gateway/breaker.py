@@ -0,0 +1,190 @@
+import time
+import typing
+import logging
+import threading
+from collections import deque
+
+from django.conf import settings
+from prometheus_client import Counter
+from prometheus_client import Gauge
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from exchanger.locks import connect_redis
+from exchanger.locks import request_key
+
+logger = logging.getLogger('exchanger')
+
+BREAKER_STATE = Gauge(
+    'exchanger_circuit_breaker_state',
+    'State of circuit breaker of remote service, 0 closed, 1 half open, '
+    '2 open',
+    ['name'])
+BREAKER_TRANSITIONS = Counter(
+    'exchanger_circuit_breaker_transitions_total',
+    'Circuit breaker state changes',
+    ['name', 'state'])
+BREAKER_REJECTED = Counter(
+    'exchanger_circuit_breaker_rejected_total',
+    'Calls failed fast by open circuit breaker',
+    ['name'])
+
+
+class CircuitOpenError(APIException):
+    """Remote service is considered down, call was not made."""
+
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Service temporarily unavailable, try again later.'
+    default_code = 'service_unavailable'
+
+
+class CircuitBreaker:
+    """
+    Closed / open / half open breaker of one remote service.
+
+    Outcomes of calls made in the last `window` seconds are kept. Once
+    there are at least `min_calls` of them and the share of failed or
+    slower than `slow_call_seconds` ones reaches `failure_rate`, breaker
+    opens and calls fail fast with CircuitOpenError for `open_seconds`.
+    Then one probe call is let through: its success closes the breaker,
+    its failure opens it again.
+
+    With `shared` the opening is published to redis, so all workers stop
+    calling the service, not only the one that noticed the outage.
+    """
+
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+    STATE_NAMES = {CLOSED: 'closed', HALF_OPEN: 'half_open', OPEN: 'open'}
+
+    def __init__(self,
+                 name: str,
+                 window: float,
+                 min_calls: int,
+                 failure_rate: float,
+                 slow_call_seconds: float,
+                 open_seconds: float,
+                 shared: bool = False,
+                 sync_interval: float = 1):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.shared = shared
+        self.sync_interval = sync_interval
+        self.key = request_key('breaker', name)
+        self.state = self.CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self._synced_at = 0.0
+        self._calls: typing.Deque[typing.Tuple[float, bool]] = deque()
+        self._lock = threading.Lock()
+        BREAKER_STATE.labels(name).set(self.CLOSED)
+
+    def __repr__(self):
+        return f'{self.__class__.__name__} {self.name}'
+
+    def _set_state(self, state: int) -> typing.NoReturn:
+        if state == self.state:
+            return
+        self.state = state
+        BREAKER_STATE.labels(self.name).set(state)
+        BREAKER_TRANSITIONS.labels(self.name, self.STATE_NAMES[state]).inc()
+        logger.warning(f'{self} is {self.STATE_NAMES[state]}')
+
+    def _open(self, opened_at: float, publish: bool) -> typing.NoReturn:
+        self._opened_at = opened_at
+        self._probing = False
+        self._calls.clear()
+        self._set_state(self.OPEN)
+        if publish and self.shared:
+            try:
+                connect_redis().set(self.key, time.time(),
+                                    ex=int(self.open_seconds) or 1)
+            except Exception as e:
+                logger.warning(f'{self} redis publish failed {e}')
+
+    def _sync(self, now: float) -> typing.NoReturn:
+        """Adopt opening published by another worker."""
+        if not self.shared or now - self._synced_at < self.sync_interval:
+            return
+        self._synced_at = now
+        try:
+            opened = connect_redis().get(self.key)
+        except Exception as e:
+            logger.warning(f'{self} redis sync failed {e}')
+            return
+        if opened is not None:
+            age = time.time() - float(opened)
+            self._open(now - max(age, 0), publish=False)
+
+    def before_call(self) -> bool:
+        """
+        Raise CircuitOpenError if call should not be made. Return True if
+        the call is the single probe of half open breaker.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self.state == self.CLOSED:
+                self._sync(now)
+            if self.state == self.OPEN and \
+                    now - self._opened_at >= self.open_seconds:
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            if self.state != self.CLOSED:
+                BREAKER_REJECTED.labels(self.name).inc()
+                raise CircuitOpenError(f'{self.name} service is unavailable')
+            return False
+
+    def record(self, success: bool, duration: float) -> typing.NoReturn:
+        now = time.monotonic()
+        failed = not success or duration > self.slow_call_seconds
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                if failed:
+                    self._open(now, publish=True)
+                else:
+                    self._probing = False
+                    self._set_state(self.CLOSED)
+                return
+            if self.state == self.OPEN:
+                return
+            self._calls.append((now, failed))
+            while self._calls and self._calls[0][0] < now - self.window:
+                self._calls.popleft()
+            if len(self._calls) < self.min_calls:
+                return
+            failures = sum(1 for _, f in self._calls if f)
+            if failures / len(self._calls) >= self.failure_rate:
+                self._open(now, publish=True)
+
+    def reset(self) -> typing.NoReturn:
+        with self._lock:
+            self._calls.clear()
+            self._probing = False
+            self._set_state(self.CLOSED)
+            if self.shared:
+                try:
+                    connect_redis().delete(self.key)
+                except Exception as e:
+                    logger.warning(f'{self} redis reset failed {e}')
+
+
+_breakers: typing.Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def circuit_breaker(name: str) -> CircuitBreaker:
+    """
+    Process wide breaker of remote service name, configured by
+    CIRCUIT_BREAKER merged with CIRCUIT_BREAKERS[name].
+    """
+    with _breakers_lock:
+        if name not in _breakers:
+            config = dict(settings.CIRCUIT_BREAKER)
+            config.update(settings.CIRCUIT_BREAKERS.get(name, {}))
+            _breakers[name] = CircuitBreaker(name, **config)
+        return _breakers[name]
@@ -0,0 +1,254 @@
+import os
+import time
+import queue
+import typing
+import logging
+import threading
+from concurrent import futures
+from concurrent.futures import Future
+
+import grpc
+from prometheus_client import Histogram
+
+from exchanger import deadline
+from exchanger.deadline import DeadlineExceeded
+from .policy import RequestPolicy
+
+logger = logging.getLogger('exchanger')
+
+COALESCED_BATCH = Histogram(
+    'exchanger_coalesced_batch_size',
+    'Calls sent together by coalescing caller',
+    ['method'],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+
+
+class _Call:
+
+    __slots__ = ('request_message', 'future', 'deadline')
+
+    def __init__(self, request_message):
+        self.request_message = request_message
+        self.future = Future()
+        # deadline of calling thread, sender thread has none of its own
+        self.deadline = deadline.current()
+
+    def remaining(self) -> typing.Optional[float]:
+        return None if self.deadline is None else self.deadline.remaining()
+
+    def resolve(self, result) -> typing.NoReturn:
+        if not self.future.done():
+            self.future.set_result(result)
+
+    def fail(self, exc: BaseException) -> typing.NoReturn:
+        if not self.future.done():
+            self.future.set_exception(exc)
+
+
+class CoalescingCaller:
+    """
+    Buffer calls of one unary method of gateway for up to max_delay seconds
+    or max_batch calls and send them together.
+
+    Remote services have no batch methods, so buffered calls are pipelined
+    over one channel: all requests of batch are started as grpc futures and
+    only then awaited. Every caller gets own future resolved with own
+    response or error. Every call is bounded by deadline of its caller and
+    calls of idempotent methods are retried following gateway policy.
+    Batch passes circuit breaker once, half open breaker lets only the
+    first call through as its probe and the rest follows the outcome.
+
+    Collecting thread hands batches to a pool of sender threads, so batch
+    waiting for slow responses or retry backoff does not hold calls of
+    other batches. While all senders are busy calls keep buffering and go
+    in the next, bigger batch. Threads are started lazily and restarted
+    after fork, so every uwsgi worker owns its ones.
+    """
+
+    def __init__(self, gateway, method: str, max_batch: int, max_delay: float,
+                 senders: int = 4):
+        self.gateway = gateway
+        self.method = method
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.senders = senders
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: typing.Optional[threading.Thread] = None
+        self._pool: typing.Optional[futures.ThreadPoolExecutor] = None
+        self._slots = threading.BoundedSemaphore(senders)
+        self._pid: typing.Optional[int] = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__} {self.gateway.NAME} {self.method}'
+
+    def submit(self, request_message) -> Future:
+        """Enqueue request, return future of its parsed response."""
+        self._ensure_thread()
+        call = _Call(request_message)
+        self._queue.put(call)
+        return call.future
+
+    def call(self, request_message) -> typing.Any:
+        """
+        Send request with concurrent calls and wait for own response, at
+        most until deadline of calling thread.
+        """
+        future = self.submit(request_message)
+        try:
+            return future.result(self.wait_timeout())
+        except futures.TimeoutError:
+            future.cancel()
+            raise DeadlineExceeded(f'{self} is abandoned, '
+                                   f'request deadline is exceeded')
+
+    def wait_timeout(self) -> float:
+        """Time caller waits for response, all attempts without deadline."""
+        budget = deadline.remaining()
+        if budget is None:
+            gw = self.gateway
+            policy = gw.policy(self.method)
+            budget = (
+                policy.attempts * gw.METHOD_TIMEOUTS.get(self.method, gw.TIMEOUT)
+                + (policy.attempts - 1) * policy.max_backoff)
+        return budget + self.max_delay
+
+    def call_many(self, request_messages: typing.Iterable) -> \
+            typing.List[Future]:
+        """
+        Pipeline requests in calling thread, for callers that already
+        hold a batch. Returned futures are done.
+        """
+        batch = [_Call(request_message) for request_message in request_messages]
+        if batch:
+            self.send(batch)
+        return [call.future for call in batch]
+
+    def _ensure_thread(self) -> typing.NoReturn:
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                if self._pid != os.getpid():
+                    # calls buffered by parent process are not ours, its
+                    # senders are not running here
+                    self._queue = queue.Queue()
+                    self._pool = futures.ThreadPoolExecutor(
+                        self.senders, thread_name_prefix=repr(self))
+                    self._slots = threading.BoundedSemaphore(self.senders)
+                self._thread = threading.Thread(
+                    target=self._run, name=repr(self), daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def collect(self) -> typing.List[_Call]:
+        """Wait for first call, then up to max_delay for more of them."""
+        batch = [self._queue.get()]
+        flush_at = time.monotonic() + self.max_delay
+        while len(batch) < self.max_batch:
+            remaining = flush_at - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self) -> typing.NoReturn:
+        while True:
+            self._slots.acquire()
+            batch = self.collect()
+            self._pool.submit(self._send, batch).add_done_callback(
+                lambda _: self._slots.release())
+
+    def _send(self, batch: typing.List[_Call]) -> typing.NoReturn:
+        try:
+            self.send(batch)
+        except Exception as e:
+            logger.error(f'{self} batch failed {e}')
+            for call in batch:
+                call.fail(e)
+
+    def send(self, batch: typing.List[_Call]) -> typing.NoReturn:
+        """Send batch, retry calls failed with retryable codes by policy."""
+        COALESCED_BATCH.labels(self.method).observe(len(batch))
+        policy = self.gateway.policy(self.method)
+        attempt = 1
+        while batch:
+            retry = self.send_once(batch, attempt, policy)
+            if not retry:
+                return
+            delay = policy.delay(attempt)
+            batch = []
+            for call in retry:
+                remaining = call.remaining()
+                if remaining is not None and delay >= remaining:
+                    call.fail(DeadlineExceeded(
+                        f'{self} is abandoned, no time left for retry'))
+                else:
+                    batch.append(call)
+            if batch:
+                time.sleep(delay)
+            attempt += 1
+
+    def send_once(self, batch: typing.List[_Call], attempt: int,
+                  policy: RequestPolicy) -> typing.List[_Call]:
+        """Make one attempt of batch, return calls worth another one."""
+        live = []
+        for call in batch:
+            if call.future.done():
+                # abandoned by caller
+                continue
+            if call.remaining() == 0:
+                call.fail(DeadlineExceeded(
+                    f'{self} is abandoned, request deadline is exceeded'))
+                continue
+            live.append(call)
+        if not live:
+            return []
+        try:
+            probe = self.gateway.breaker.before_call()
+        except Exception as e:
+            for call in live:
+                call.fail(e)
+            return []
+        if not probe:
+            return self.pipeline(live, attempt, policy)
+        # half open breaker lets one call through, the rest follows it
+        retry = self.pipeline(live[:1], attempt, policy)
+        return retry + self.send_once(live[1:], attempt, policy)
+
+    def pipeline(self, batch: typing.List[_Call], attempt: int,
+                 policy: RequestPolicy) -> typing.List[_Call]:
+        gw = self.gateway
+        request_method = getattr(gw.client, self.method)
+        timeout = gw.METHOD_TIMEOUTS.get(self.method, gw.TIMEOUT)
+        started = time.monotonic()
+        pending = []
+        for call in batch:
+            remaining = call.remaining()
+            pending.append((call, request_method.future(
+                call.request_message,
+                timeout=timeout if remaining is None else min(timeout,
+                                                              remaining))))
+        retry = []
+        for call, rpc in pending:
+            try:
+                response = rpc.result()
+            except grpc.RpcError as exc:
+                gw.breaker.record(False, time.monotonic() - started)
+                gw._log_error(call.request_message, exc)
+                if policy.should_retry(attempt, exc.code()):
+                    retry.append(call)
+                else:
+                    call.fail(exc)
+                continue
+            gw.breaker.record(True, time.monotonic() - started)
+            try:
+                call.resolve(gw._parse_response(
+                    call.request_message, response, policy))
+            except Exception as exc:
+                gw._log_error(call.request_message, exc)
+                call.fail(exc)
+        return retry
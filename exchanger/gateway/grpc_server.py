@@ -1,5 +1,9 @@
 import grpc
+import uuid
+import asyncio
+import typing
 import logging
+from decimal import Decimal
 from datetime import datetime
 from concurrent import futures
 from contextlib import contextmanager
@@ -8,7 +12,9 @@ from google.api import context_pb2
 from google.protobuf.json_format import MessageToDict
 from .base import BaseRepr
 from .serializers import TransactionDataSerializer
+from exchanger.deadline import deadline
 from exchanger.utils import nested_commit_on_success
+from exchanger.queues import advance_queue
 from exchanger.models import OutPutTransaction
 from exchanger.models import InputTransaction
 from exchanger.rpc import exchanger_pb2_grpc
@@ -21,25 +27,39 @@ class UpdateMixin:
 
     input_model = InputTransaction
     output_model = OutPutTransaction
-    message = exchanger_pb2.UpdateResponse()
     serializer = TransactionDataSerializer
 
+    update_fields = ('trx_hash', 'value', 'confirmed_at', 'status',
+                     'updated_at')
+
     @nested_commit_on_success
     def action(self, data, ingoing=False):
+        """
+        Resolve active transactions of request with one query and confirm
+        them with one bulk update. Rows are locked until commit, so
+        concurrent callback for the same uuid waits and then finds it
+        confirmed.
+        Return updated transactions and their number.
+        """
         model = self.input_model if ingoing else self.output_model
-        counter = 0
-        for trx in data:
-            counter += model.objects.filter(uuid=trx['uuid'],
-                                            status__in=model.ACTIVE_STATUTES
-                                            ).update(
-                trx_hash=trx['trx_hash'],
-                value=trx['value'],
-                confirmed_at=datetime.now(),
-                status=model.CONFIRMED
-            )
-        self.message.header.status = exchanger_pb2.SUCCESS
-        self.message.header.description = f'Updated  {counter} ' \
-                                          f'of {model.__name__} objects'
+        by_uuid = {uuid.UUID(trx['uuid']): trx for trx in data}
+        transactions = list(
+            model.objects.filter(uuid__in=list(by_uuid),
+                                 status__in=model.ACTIVE_STATUTES)
+                         .select_related('exchange_history')
+                         .select_for_update(of=('self',))
+                         .order_by('id'))
+        now = datetime.now()
+        for obj in transactions:
+            trx = by_uuid[obj.uuid]
+            obj.trx_hash = trx['trx_hash']
+            obj.value = Decimal(trx['value'])
+            obj.confirmed_at = now
+            obj.updated_at = now
+            obj.status = model.CONFIRMED
+        if transactions:
+            model.objects.bulk_update(transactions, self.update_fields)
+        return transactions, len(transactions)
 
     def validate_request(self, request):
         return self._validate(request)
@@ -50,27 +70,61 @@ class UpdateMixin:
         serializer.is_valid(raise_exception=True)
         return serializer.data['transactions']
 
-    def process(self, request, ingoing=False):
+    @staticmethod
+    def time_remaining(context) -> typing.Optional[float]:
+        """Seconds left until deadline of rpc, None if caller set none."""
+        time_remaining = getattr(context, 'time_remaining', None)
+        return time_remaining() if callable(time_remaining) else None
+
+    def process(self,
+                request,
+                ingoing=False,
+                time_remaining: typing.Optional[float] = None):
+        """
+        Build response for request, servicer keeps no per request state.
+        :param time_remaining: budget of rpc, REQUEST_DEADLINE if None
+        """
+        message = exchanger_pb2.UpdateResponse()
+        model = self.input_model if ingoing else self.output_model
+        if time_remaining is None:
+            time_remaining = settings.REQUEST_DEADLINE
         try:
-            self._execute(request, ingoing=ingoing)
+            with deadline(time_remaining):
+                counter = self._execute(request, ingoing=ingoing)
+            message.header.status = exchanger_pb2.SUCCESS
+            message.header.description = f'Updated  {counter} ' \
+                                         f'of {model.__name__} objects'
         except Exception as e:
             logger.error(f'{self.__class__.__name__} got exception {e}')
-            self.message.header.status = exchanger_pb2.ERROR
-            self.message.header.description = f'{e}'
-        return self.message
+            message.header.status = exchanger_pb2.ERROR
+            message.header.description = f'{e}'
+        return message
 
-    def _execute(self, request, ingoing=False):
+    def _execute(self, request, ingoing=False) -> int:
         data = self.validate_request(request)
-        self.action(data, ingoing=ingoing)
+        transactions, counter = self.action(data, ingoing=ingoing)
         if not settings.TEST_MODE:
-            self.update_exchanger_objects(data, ingoing=ingoing)
-
-    def update_exchanger_objects(self, data, ingoing=False):
-        model = self.input_model if ingoing else self.output_model
-        for trx in data:
-            t = model.objects.filter(uuid=trx['uuid']).first()
-            if t and t.exchange_history:
-                t.exchange_history.request_update()
+            self.update_exchanger_objects(transactions)
+        return counter
+
+    def update_exchanger_objects(self, transactions):
+        """
+        Schedule advancement of every exchange bound with transactions.
+        State transitions run in advance_exchanges worker, so callback
+        returns as soon as update is committed. Failed push does not fail
+        committed update, scheduler sweep advances the exchanges later.
+        """
+        ids = []
+        for trx in transactions:
+            exchange = getattr(trx, 'exchange_history', None)
+            if exchange is not None and exchange.id not in ids:
+                ids.append(exchange.id)
+        if ids:
+            try:
+                advance_queue().push(*ids)
+            except Exception as e:
+                logger.error(f'{self.__class__.__name__} failed to schedule '
+                             f'advancement of exchanges {ids}: {e}')
 
 
 class ExchangerService(exchanger_pb2_grpc.ExchangerServiceServicer,
@@ -83,19 +137,86 @@ class ExchangerService(exchanger_pb2_grpc.ExchangerServiceServicer,
         return message
 
     def UpdateInputTransaction(self, request, context: context_pb2.Context):
-        return self.process(request, ingoing=True)
+        return self.process(request, ingoing=True,
+                            time_remaining=self.time_remaining(context))
 
     def UpdateOutputTransaction(self, request, context: context_pb2.Context):
-        return self.process(request)
+        return self.process(request,
+                            time_remaining=self.time_remaining(context))
+
+
+class AsyncExchangerService(ExchangerService):
+    """
+    ExchangerService for grpc.aio server. Blocking DB work of callbacks
+    runs on bounded executor, so in-flight rpcs do not need a thread each.
+    """
+
+    def __init__(self, executor: futures.Executor):
+        self.executor = executor
+
+    async def _run_blocking(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    async def Healthz(self, request, context):
+        return super().Healthz(request, context)
+
+    async def UpdateInputTransaction(self, request, context):
+        return await self._run_blocking(
+            self.process, request, True, self.time_remaining(context))
+
+    async def UpdateOutputTransaction(self, request, context):
+        return await self._run_blocking(
+            self.process, request, False, self.time_remaining(context))
 
 
 @contextmanager
-def serve_forever():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+def serve_forever(max_workers: typing.Optional[int] = None,
+                  maximum_concurrent_rpcs: typing.Optional[int] = None):
+    """
+    :param max_workers: size of thread pool handling rpcs
+    :param maximum_concurrent_rpcs: rpcs over this limit are rejected with
+    RESOURCE_EXHAUSTED, None means no limit
+    """
+    max_workers = max_workers or settings.GRPC_SERVER_MAX_WORKERS
+    if maximum_concurrent_rpcs is None:
+        maximum_concurrent_rpcs = settings.GRPC_SERVER_MAX_CONCURRENT_RPCS
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=max_workers),
+        maximum_concurrent_rpcs=maximum_concurrent_rpcs)
     exchanger_pb2_grpc.add_ExchangerServiceServicer_to_server(
         ExchangerService(), server)
     server.add_insecure_port(f'[::]:{settings.GRPC_SERVER_PORT}')
     server.start()
-    logger.info(f'started GRPC server on port :{settings.GRPC_SERVER_PORT}')
+    logger.info(f'started GRPC server on port :{settings.GRPC_SERVER_PORT} '
+                f'with {max_workers} workers')
     yield
     server.stop(0)
+
+
+async def serve_async(max_workers: typing.Optional[int] = None,
+                      maximum_concurrent_rpcs: typing.Optional[int] = None):
+    """
+    Run ExchangerService on grpc.aio server until termination.
+    :param max_workers: size of executor running blocking DB work
+    :param maximum_concurrent_rpcs: rpcs over this limit are rejected with
+    RESOURCE_EXHAUSTED, None means no limit
+    """
+    from grpc import aio
+
+    max_workers = max_workers or settings.GRPC_SERVER_MAX_WORKERS
+    if maximum_concurrent_rpcs is None:
+        maximum_concurrent_rpcs = settings.GRPC_SERVER_MAX_CONCURRENT_RPCS
+    executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+    server = aio.server(maximum_concurrent_rpcs=maximum_concurrent_rpcs)
+    exchanger_pb2_grpc.add_ExchangerServiceServicer_to_server(
+        AsyncExchangerService(executor), server)
+    server.add_insecure_port(f'[::]:{settings.GRPC_SERVER_PORT}')
+    await server.start()
+    logger.info(f'started async GRPC server on port '
+                f':{settings.GRPC_SERVER_PORT} with {max_workers} DB workers')
+    try:
+        await server.wait_for_termination()
+    finally:
+        await server.stop(0)
+        executor.shutdown(wait=False)
@@ -0,0 +1,55 @@
+import random
+import typing
+
+import grpc
+
+
+class RequestPolicy:
+    """
+    Immutable rules of one remote call: statuses accepted in response
+    header, grpc codes worth another attempt and backoff between attempts.
+    Gateways keep no per call state, so concurrent calls with different
+    policies do not affect each other.
+    """
+
+    __slots__ = ('allowed_statuses', 'retryable_codes', 'idempotent',
+                 'attempts', 'backoff', 'max_backoff', 'bad_response_msg')
+
+    def __init__(self,
+                 allowed_statuses: typing.Tuple[int, ...],
+                 retryable_codes: typing.Tuple[grpc.StatusCode, ...],
+                 idempotent: bool,
+                 attempts: int,
+                 backoff: float,
+                 max_backoff: float,
+                 bad_response_msg: str = ''):
+        setattr_ = super().__setattr__
+        setattr_('allowed_statuses', tuple(allowed_statuses))
+        setattr_('retryable_codes', tuple(retryable_codes))
+        setattr_('idempotent', idempotent)
+        # only idempotent calls may be sent again
+        setattr_('attempts', attempts if idempotent else 1)
+        setattr_('backoff', backoff)
+        setattr_('max_backoff', max_backoff)
+        setattr_('bad_response_msg', bad_response_msg)
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f'{self.__class__.__name__} is immutable')
+
+    def __repr__(self):
+        return (f'{self.__class__.__name__} attempts={self.attempts} '
+                f'statuses={self.allowed_statuses}')
+
+    def replace(self, **changes) -> 'RequestPolicy':
+        """Copy of policy with changed fields."""
+        fields = {name: getattr(self, name) for name in self.__slots__}
+        fields.update(changes)
+        return self.__class__(**fields)
+
+    def should_retry(self, attempt: int, code: grpc.StatusCode) -> bool:
+        return attempt < self.attempts and code in self.retryable_codes
+
+    def delay(self, attempt: int) -> float:
+        """Pause after failed attempt, exponential with full jitter."""
+        return random.uniform(
+            0, min(self.backoff * 2 ** (attempt - 1), self.max_backoff))
@@ -0,0 +1,230 @@
+import os
+import typing
+import logging
+import threading
+from functools import partial
+
+import grpc
+from django.conf import settings
+from prometheus_client import Counter
+from prometheus_client import Gauge
+
+logger = logging.getLogger('exchanger')
+
+CHANNELS_CREATED = Counter(
+    'exchanger_grpc_channels_created_total',
+    'gRPC channels created by the channel pool',
+    ['address'])
+CHANNELS_OPEN = Gauge(
+    'exchanger_grpc_channels_open',
+    'gRPC channels currently held by the channel pool')
+CHANNEL_READY = Gauge(
+    'exchanger_grpc_channel_ready',
+    '1 if pooled channel is in READY connectivity state',
+    ['address'])
+STUB_LOOKUPS = Counter(
+    'exchanger_grpc_stub_lookups_total',
+    'Stub lookups served by the channel pool',
+    ['address', 'reused'])
+HEALTH_CHECK_FAILURES = Counter(
+    'exchanger_grpc_health_check_failures_total',
+    'Pooled channels that were not ready in time and were recreated',
+    ['address'])
+
+
+def channel_options() -> typing.List[typing.Tuple[str, int]]:
+    """Keepalive and reconnect options for long lived channels."""
+    return [
+        ('grpc.keepalive_time_ms', settings.GRPC_KEEPALIVE_TIME_MS),
+        ('grpc.keepalive_timeout_ms', settings.GRPC_KEEPALIVE_TIMEOUT_MS),
+        ('grpc.keepalive_permit_without_calls', 1),
+        ('grpc.http2.max_pings_without_data', 0),
+        ('grpc.initial_reconnect_backoff_ms',
+         settings.GRPC_INITIAL_RECONNECT_BACKOFF_MS),
+        ('grpc.max_reconnect_backoff_ms',
+         settings.GRPC_MAX_RECONNECT_BACKOFF_MS),
+    ]
+
+
+class ChannelPool:
+    """
+    Process wide holder of long lived grpc channels and stubs keyed by
+    remote address.
+
+    Channels are created lazily on first use, so nothing is opened in the
+    uwsgi master. grpc channels can not be shared across fork, so the pool
+    remembers the pid it was filled in and drops everything it holds
+    when it is used from a forked child.
+
+    Every process that opened a channel runs a daemon thread checking
+    all pooled channels each health_check_interval seconds. Channel that
+    is not ready is replaced, the old one keeps serving calls started on
+    it and is closed after close_grace seconds.
+    """
+
+    def __init__(self,
+                 options: typing.Optional[typing.List] = None,
+                 health_check_timeout: typing.Optional[float] = None,
+                 health_check_interval: typing.Optional[float] = None,
+                 close_grace: typing.Optional[float] = None):
+        self.options = channel_options() if options is None else options
+        self.health_check_timeout = (
+            health_check_timeout or settings.GRPC_HEALTH_CHECK_TIMEOUT)
+        self.health_check_interval = (
+            settings.GRPC_HEALTH_CHECK_INTERVAL
+            if health_check_interval is None else health_check_interval)
+        self.close_grace = (settings.GRPC_CHANNEL_CLOSE_GRACE
+                            if close_grace is None else close_grace)
+        self._checker: typing.Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.RLock()
+        self._pid = os.getpid()
+        self._channels: typing.Dict[str, grpc.Channel] = {}
+        self._callbacks: typing.Dict[str, typing.Callable] = {}
+        self._stubs: typing.Dict[typing.Tuple[str, type], typing.Any] = {}
+        self._states: typing.Dict[str, grpc.ChannelConnectivity] = {}
+
+    def __repr__(self):
+        return f'{self.__class__.__name__} class'
+
+    def _check_pid(self) -> typing.NoReturn:
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # channels inherited from the parent process are unusable,
+                # forget them without closing
+                self._channels = {}
+                self._callbacks = {}
+                self._stubs = {}
+                self._states = {}
+                self._checker = None
+                self._pid = os.getpid()
+                CHANNELS_OPEN.set(0)
+
+    def _ensure_checker(self) -> typing.NoReturn:
+        """Start health checks in this process, unless they are off."""
+        if not self.health_check_interval or self._checker is not None:
+            return
+        self._stop.clear()
+        self._checker = threading.Thread(
+            target=self._check_periodically, daemon=True,
+            name=f'{self.__class__.__name__} health check')
+        self._checker.start()
+
+    def _check_periodically(self) -> typing.NoReturn:
+        while not self._stop.wait(self.health_check_interval):
+            try:
+                self.check_all()
+            except Exception as e:
+                logger.error(f'{self.__class__.__name__} health check '
+                             f'failed {e}')
+
+    def _create_channel(self, address: str) -> grpc.Channel:
+        channel = grpc.insecure_channel(address, options=self.options)
+        callback = self._callbacks[address] = partial(
+            self._on_state_change, address)
+        channel.subscribe(callback)
+        CHANNELS_CREATED.labels(address).inc()
+        logger.info(f'{self.__class__.__name__} opened channel to {address}')
+        return channel
+
+    def _on_state_change(self,
+                         address: str,
+                         state: grpc.ChannelConnectivity) -> typing.NoReturn:
+        self._states[address] = state
+        CHANNEL_READY.labels(address).set(
+            int(state == grpc.ChannelConnectivity.READY))
+
+    def get_channel(self, address: str) -> grpc.Channel:
+        self._check_pid()
+        channel = self._channels.get(address)
+        if channel is not None:
+            return channel
+        with self._lock:
+            channel = self._channels.get(address)
+            if channel is None:
+                channel = self._create_channel(address)
+                self._channels[address] = channel
+                CHANNELS_OPEN.set(len(self._channels))
+                self._ensure_checker()
+        return channel
+
+    def get_stub(self, address: str, stub_class: type):
+        """Return stub of stub_class bound to the pooled channel."""
+        self._check_pid()
+        key = (address, stub_class)
+        stub = self._stubs.get(key)
+        if stub is not None:
+            STUB_LOOKUPS.labels(address, 'true').inc()
+            return stub
+        with self._lock:
+            stub = self._stubs.get(key)
+            if stub is None:
+                stub = stub_class(self.get_channel(address))
+                self._stubs[key] = stub
+        STUB_LOOKUPS.labels(address, 'false').inc()
+        return stub
+
+    def health_check(self, address: str) -> bool:
+        """
+        Wait until channel to address is ready. Channel that does not get
+        ready in health_check_timeout is closed and will be recreated on
+        next use.
+        """
+        channel = self.get_channel(address)
+        ready = grpc.channel_ready_future(channel)
+        try:
+            ready.result(timeout=self.health_check_timeout)
+            return True
+        except grpc.FutureTimeoutError:
+            # stop polling connectivity of the channel before it is closed
+            ready.cancel()
+            HEALTH_CHECK_FAILURES.labels(address).inc()
+            logger.warning(f'{self.__class__.__name__} channel to {address} '
+                           f'is not ready, recreating')
+            self.reset(address, grace=self.close_grace)
+            return False
+
+    def check_all(self) -> typing.Dict[str, bool]:
+        return {address: self.health_check(address)
+                for address in list(self._channels)}
+
+    def reset(self, address: str, grace: float = 0) -> typing.NoReturn:
+        """
+        Forget channel to address, next use opens a new one. Old channel
+        stops reporting connectivity at once and is closed after grace
+        seconds, so calls started on it and stubs held by callers finish.
+        """
+        with self._lock:
+            channel = self._channels.pop(address, None)
+            callback = self._callbacks.pop(address, None)
+            self._states.pop(address, None)
+            for key in [k for k in self._stubs if k[0] == address]:
+                del self._stubs[key]
+            CHANNELS_OPEN.set(len(self._channels))
+        if channel is None:
+            return
+        if callback is not None:
+            channel.unsubscribe(callback)
+        if grace:
+            closer = threading.Timer(grace, channel.close)
+            closer.daemon = True
+            closer.start()
+        else:
+            channel.close()
+
+    def close(self) -> typing.NoReturn:
+        self._stop.set()
+        self._checker = None
+        for address in list(self._channels):
+            self.reset(address)
+
+    def stats(self) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+        return {
+            address: {
+                'state': getattr(self._states.get(address), 'name', 'IDLE'),
+                'stubs': len([k for k in self._stubs if k[0] == address]),
+            }
+            for address in self._channels
+        }
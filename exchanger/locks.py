@@ -1,23 +1,126 @@
 import os
+import time
+import typing
+import logging
+import threading
+import redis
 import redis_lock
 import redis_namespace
 from contextlib import contextmanager
 
 from django.conf import settings
+from prometheus_client import Counter
+from prometheus_client import Gauge
 
+logger = logging.getLogger('exchanger')
 
 REDIS_HOST = os.environ.get('REDIS_HOST', settings.REDIS_HOST)
 REDIS_PASSWORD = os.environ.get('REDIS_PASSWORD', settings.REDIS_PASSWORD)
 
+POOL_CONNECTIONS = Gauge(
+    'exchanger_redis_pool_connections',
+    'Redis connections by state in the shared pool',
+    ['state'])
+HEALTH_CHECK_FAILURES = Counter(
+    'exchanger_redis_health_check_failures_total',
+    'Failed health checks of the shared redis pool')
 
-def connect_redis() -> redis_namespace.StrictRedis:
-    return redis_namespace.StrictRedis(
+_lock = threading.Lock()
+_client: typing.Optional[redis_namespace.StrictRedis] = None
+_lock_client: typing.Optional[redis_namespace.StrictRedis] = None
+_last_health_check = 0.0
+
+
+def connection_pool(socket_timeout: typing.Optional[float] = None) -> \
+        redis.BlockingConnectionPool:
+    """
+    Shared pool of redis connections. It waits up to REDIS_POOL_TIMEOUT
+    for free connection when saturated. redis-py pools reset themselves
+    after fork, so the pool is safe under uwsgi prefork.
+    :param socket_timeout: read timeout of connections, REDIS_SOCKET_TIMEOUT
+    by default
+    """
+    if socket_timeout is None:
+        socket_timeout = settings.REDIS_SOCKET_TIMEOUT
+    return redis.BlockingConnectionPool(
         host=REDIS_HOST,
         password=REDIS_PASSWORD,
-        namespace=settings.REDIS_NAMESPACE
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        timeout=settings.REDIS_POOL_TIMEOUT,
+        socket_timeout=socket_timeout,
+        socket_connect_timeout=settings.REDIS_SOCKET_CONNECT_TIMEOUT,
+        socket_keepalive=True,
+        retry_on_timeout=True,
     )
 
 
+def pool_stats(pool: redis.BlockingConnectionPool) -> typing.Dict[str, int]:
+    idle = sum(1 for c in list(pool.pool.queue) if c is not None)
+    created = len(pool._connections)
+    return {
+        'max': pool.max_connections,
+        'created': created,
+        'idle': idle,
+        'in_use': created - idle,
+    }
+
+
+def _export_metrics(pool: redis.BlockingConnectionPool) -> typing.NoReturn:
+    for state in ('max', 'created', 'idle', 'in_use'):
+        POOL_CONNECTIONS.labels(state).set_function(
+            lambda s=state: pool_stats(pool)[s])
+
+
+def _health_check(client: redis_namespace.StrictRedis) -> typing.NoReturn:
+    """Ping redis once per interval, drop pooled sockets if it fails."""
+    global _last_health_check
+    now = time.time()
+    if now - _last_health_check < settings.REDIS_HEALTH_CHECK_INTERVAL:
+        return
+    _last_health_check = now
+    try:
+        client.ping()
+    except redis.RedisError as e:
+        HEALTH_CHECK_FAILURES.inc()
+        logger.warning(f'redis health check failed {e}, reconnecting')
+        client.connection_pool.disconnect()
+
+
+def connect_redis() -> redis_namespace.StrictRedis:
+    """Process wide redis client, all callers share one connection pool."""
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                pool = connection_pool()
+                _export_metrics(pool)
+                _client = redis_namespace.StrictRedis(
+                    connection_pool=pool,
+                    namespace=settings.REDIS_NAMESPACE
+                )
+    _health_check(_client)
+    return _client
+
+
+def connect_lock_redis() -> redis_namespace.StrictRedis:
+    """
+    Process wide redis client for locks. Blocking acquisition waits in
+    BLPOP up to lock expiration, so its connections have read timeout
+    REDIS_LOCK_SOCKET_TIMEOUT, longer than any lock wait, instead of the
+    short one of shared pool.
+    """
+    global _lock_client
+    if _lock_client is None:
+        with _lock:
+            if _lock_client is None:
+                _lock_client = redis_namespace.StrictRedis(
+                    connection_pool=connection_pool(
+                        settings.REDIS_LOCK_SOCKET_TIMEOUT),
+                    namespace=settings.REDIS_NAMESPACE
+                )
+    return _lock_client
+
+
 def request_key(*req):
     """
         format key for caching
@@ -26,23 +129,75 @@ def request_key(*req):
         ('exchanger_service',) + tuple(str(v) for v in req)) + '::'
 
 
+class LockPolicy:
+    """
+    Behaviour of lock acquisition when lock is held by another worker.
+
+    blocking: wait for lock to be released
+    timeout: max seconds to wait, None means wait up to lock expiration
+    defer: caller that did not get lock schedules its work for later
+    """
+
+    __slots__ = ('blocking', 'timeout', 'defer')
+
+    def __init__(self,
+                 blocking: bool = True,
+                 timeout: typing.Optional[int] = None,
+                 defer: bool = False):
+        self.blocking = blocking
+        self.timeout = timeout
+        self.defer = defer
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}(blocking={self.blocking}, ' \
+               f'timeout={self.timeout}, defer={self.defer})'
+
+
+BLOCKING = LockPolicy()
+TRY_LOCK = LockPolicy(blocking=False)
+DEFER = LockPolicy(blocking=False, defer=True)
+
+
+def bounded(timeout: int, defer: bool = False) -> LockPolicy:
+    """Wait for lock at most timeout seconds."""
+    return LockPolicy(blocking=True, timeout=timeout, defer=defer)
+
+
 class ManualLockGateway:
-    """Set db lock with lock|unlock methods (instead context manager)"""
+    """
+    Set db lock with lock|unlock methods (instead context manager).
+    Use connection of connect_lock_redis, blocking lock waits longer than
+    read timeout of shared pool.
+    """
     max_timeout = 120
 
     def __init__(self, red: redis_namespace.StrictRedis):
         self.redis = red
         self._lock = None
 
-    def lock(self, name: str, blocking: bool = False):
+    def lock(self,
+             name: str,
+             blocking: bool = False,
+             policy: typing.Optional[LockPolicy] = None) -> bool:
+        """
+        Return True if lock is acquired
+        :param policy: lock policy, overrides blocking
+        """
         if self._lock is not None:
             raise Exception(
                 f'{self.__class__.__name__}: can not lock. '
                 f'Manual lock is already locked by '
                 f'{self._lock}, unlock at first.')
-        self._lock = redis_lock.Lock(self.redis, request_key(name),
-                                     expire=self.max_timeout)
-        return self._lock.acquire(blocking=blocking)
+        timeout = None
+        if policy is not None:
+            blocking, timeout = policy.blocking, policy.timeout
+        lock = redis_lock.Lock(self.redis, request_key(name),
+                               expire=self.max_timeout)
+        acquired = lock.acquire(blocking=blocking,
+                                timeout=timeout if blocking else None)
+        if acquired:
+            self._lock = lock
+        return acquired
 
     def unlock(self, strict: bool = True):
         if self._lock is None:
@@ -61,4 +216,4 @@ def nowait_lock(connection) -> ManualLockGateway:
     try:
         yield locker
     finally:
-        locker.unlock()
+        locker.unlock(strict=False)
@@ -0,0 +1,191 @@
+import json
+import random
+import typing
+import logging
+import threading
+from datetime import datetime
+from datetime import timedelta
+
+from django import db
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives
+from django.core.mail import get_connection
+from django.db import transaction
+from django.template.backends.django import Template
+from django.template.loader import get_template
+from prometheus_client import Counter
+
+from .models import ExchangeHistory
+from .models import MailOutbox
+
+logger = logging.getLogger('exchanger')
+
+NEW_EXCHANGE_SUBJECT = 'New exchange operation is created'
+
+MAILS_DELIVERED = Counter(
+    'exchanger_mail_outbox_deliveries_total',
+    'Delivery attempts of outbox mails by kind and result',
+    ['kind', 'result'])
+
+
+def enqueue_new_exchange(exchange: ExchangeHistory) -> typing.NoReturn:
+    """Add notifications about new exchange to outbox."""
+    use_https = settings.DEFAULT_HOST == 'app.bonumchain.com'
+    MailOutbox.enqueue(
+        exchange,
+        MailOutbox.NEW_EXCHANGE_USER,
+        [exchange.user_email],
+        context={
+            'default_host': settings.DEFAULT_HOST,
+            'uuid': exchange.uuid,
+            'protocol': 'https' if use_https else 'http',
+            'email': exchange.user_email,
+        })
+    if settings.SEND_MAIL_TO_OWNERS:
+        MailOutbox.enqueue(
+            exchange,
+            MailOutbox.NEW_EXCHANGE_OWNERS,
+            settings.RECIPIENTS,
+            context={'uuid': exchange.uuid, 'email': exchange.user_email})
+
+
+class MailRenderer:
+    """
+    Html and plain text templates of one mail, loaded and compiled once per
+    process on first render.
+    """
+
+    def __init__(self, html_template: str, text_template: str):
+        self.html_template = html_template
+        self.text_template = text_template
+        self._templates = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__} class'
+
+    @property
+    def templates(self) -> typing.Tuple[Template, Template]:
+        if self._templates is None:
+            with self._lock:
+                if self._templates is None:
+                    self._templates = (get_template(self.html_template),
+                                       get_template(self.text_template))
+        return self._templates
+
+    def render(self, context: typing.Dict) -> typing.Tuple[str, str]:
+        """Return html and text parts of mail."""
+        html, text = self.templates
+        return html.render(context), text.render(context)
+
+
+new_exchange_renderer = MailRenderer('exchanger_mail.html',
+                                     'exchanger_mail.txt')
+
+
+def build_message(mail: MailOutbox, connection=None) -> EmailMultiAlternatives:
+    context = json.loads(mail.context)
+    if mail.kind == MailOutbox.NEW_EXCHANGE_USER:
+        html, text = new_exchange_renderer.render(context)
+        message = EmailMultiAlternatives(
+            NEW_EXCHANGE_SUBJECT, text, settings.DEFAULT_FROM_EMAIL,
+            mail.recipient_list, connection=connection)
+        message.attach_alternative(html, 'text/html')
+        return message
+    return EmailMultiAlternatives(
+        NEW_EXCHANGE_SUBJECT,
+        f'New exchange operation is created '
+        f':{context["uuid"]} and user {context["email"]}',
+        settings.DEFAULT_FROM_EMAIL,
+        mail.recipient_list,
+        connection=connection)
+
+
+class MailOutboxSender:
+    """
+    Deliver due outbox mails in batches over one mail backend connection.
+
+    Batch is claimed in short transaction: rows are selected with SKIP
+    LOCKED and postponed by MAIL_OUTBOX_CLAIM_TIMEOUT, so several senders
+    can run together. Mails are sent outside of transaction and result of
+    every one is saved on its own. Mails of sender that died are sent
+    again once the claim expires. Failed mail is retried with jittered
+    exponential backoff and marked FAILED after MAIL_OUTBOX_MAX_ATTEMPTS.
+    """
+
+    def __init__(self, batch_size: typing.Optional[int] = None):
+        self.batch_size = batch_size or settings.MAIL_OUTBOX_BATCH_SIZE
+        self._stop = threading.Event()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__} class'
+
+    def stop(self) -> typing.NoReturn:
+        self._stop.set()
+
+    def due(self):
+        return MailOutbox.objects.filter(
+            status=MailOutbox.PENDING,
+            next_attempt_at__lte=datetime.now(),
+        ).order_by('next_attempt_at')
+
+    def claim(self) -> typing.List[MailOutbox]:
+        """Take batch of due mails, other senders skip it until claim expires."""
+        with transaction.atomic():
+            batch = list(self.due().select_for_update(
+                skip_locked=True)[:self.batch_size])
+            if batch:
+                MailOutbox.objects.filter(
+                    id__in=[mail.id for mail in batch],
+                ).update(next_attempt_at=datetime.now() + timedelta(
+                    seconds=settings.MAIL_OUTBOX_CLAIM_TIMEOUT))
+        return batch
+
+    def send_batch(self) -> int:
+        """Deliver one batch, return number of processed mails."""
+        batch = self.claim()
+        if not batch:
+            return 0
+        with get_connection() as connection:
+            for mail in batch:
+                self.deliver(mail, connection)
+        return len(batch)
+
+    def deliver(self, mail: MailOutbox, connection) -> bool:
+        now = datetime.now()
+        mail.attempts += 1
+        try:
+            build_message(mail, connection).send()
+        except Exception as e:
+            mail.last_error = f'{e}'
+            if mail.attempts >= settings.MAIL_OUTBOX_MAX_ATTEMPTS:
+                mail.status = MailOutbox.FAILED
+                logger.error(f'{self.__class__.__name__} gave up {mail} '
+                             f'to {mail.recipients}: {e}')
+            else:
+                delay = min(
+                    settings.MAIL_OUTBOX_BACKOFF * 2 ** (mail.attempts - 1),
+                    settings.MAIL_OUTBOX_MAX_BACKOFF)
+                mail.next_attempt_at = now + timedelta(
+                    seconds=delay * random.uniform(1, 1.2))
+            result = 'error'
+        else:
+            mail.status = MailOutbox.SENT
+            mail.sent_at = now
+            result = 'sent'
+        mail.save(update_fields=['status', 'attempts', 'next_attempt_at',
+                                 'sent_at', 'last_error', 'updated_at'])
+        MAILS_DELIVERED.labels(mail.get_kind_display(), result).inc()
+        return result == 'sent'
+
+    def run(self) -> typing.NoReturn:
+        while not self._stop.is_set():
+            try:
+                processed = self.send_batch()
+            except Exception as e:
+                logger.error(f'{self.__class__.__name__} batch failed {e}')
+                processed = 0
+            finally:
+                db.close_old_connections()
+            if processed < self.batch_size:
+                self._stop.wait(settings.MAIL_OUTBOX_POLL_INTERVAL)
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from exchanger.queues import AdvanceWorker
+
+
+class Command(BaseCommand):
+    help = 'advance exchanges from the advancement queue'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int,
+                            default=settings.ADVANCE_WORKERS)
+
+    def handle(self, *args, **options):
+        worker = AdvanceWorker(concurrency=options['concurrency'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully started advance worker '
+            f'with concurrency {worker.concurrency}'))
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            worker.stop()
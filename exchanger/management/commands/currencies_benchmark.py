@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand
+from google.protobuf.json_format import MessageToDict
+
+from exchanger.currencies_gateway.rates import RateTable
+from exchanger.currencies_gateway.serializers import CurrencySerializer
+from exchanger.currencies_gateway.types import Currency
+from exchanger.rpc.currencies_pb2_grpc import currencies__pb2 as currencies_pb2
+
+
+class Command(BaseCommand):
+    help = 'measure cpu time of building rate table from currencies ' \
+           'response through MessageToDict and CurrencySerializer and ' \
+           'through typed Currency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--responses', type=int, default=1000)
+        parser.add_argument('--currencies', type=int, default=50)
+
+    @staticmethod
+    def response(currencies):
+        response = currencies_pb2.CurrenciesResponse(
+            header=currencies_pb2.ResponseHeader(
+                status=currencies_pb2.SUCCESS))
+        for i in range(currencies):
+            currency = response.currencies.add(
+                id=i, name=f'coin{i}', fullname=f'Coin {i}',
+                slug=f'coin{i}', rate=f'{i + 1}.123456789')
+            currency.coefficients.add(
+                days=30, collateral_coefficient='1.5',
+                mandatory_coefficient='1.2', warning_coefficient='1.3')
+        return response
+
+    @staticmethod
+    def parse_dict(response):
+        data = MessageToDict(response, preserving_proto_field_name=True)
+        serializer = CurrencySerializer(data=data['currencies'], many=True)
+        serializer.is_valid(raise_exception=True)
+        return RateTable.from_currencies(serializer.data)
+
+    @staticmethod
+    def parse_typed(response):
+        return RateTable.from_currencies(
+            [Currency.from_message(c).as_dict() for c in response.currencies])
+
+    def measure(self, name, parse, response, total):
+        started = time.process_time()
+        for _ in range(total):
+            parse(response)
+        elapsed = time.process_time() - started
+        self.stdout.write(f'{name}: {elapsed / total * 1e6:.0f} us/response')
+
+    def handle(self, *args, **options):
+        total = options['responses']
+        response = self.response(options['currencies'])
+        self.measure('MessageToDict and CurrencySerializer', self.parse_dict,
+                     response, total)
+        self.measure('typed Currency', self.parse_typed, response, total)
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from exchanger.scheduler import ExchangeScheduler
+
+
+class Command(BaseCommand):
+    help = 'periodically advance non final exchanges'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int,
+                            default=settings.SCHEDULER_WORKERS)
+        parser.add_argument('--batch-size', type=int,
+                            default=settings.SCHEDULER_BATCH_SIZE)
+        parser.add_argument('--interval', type=float,
+                            default=settings.SCHEDULER_INTERVAL)
+
+    def handle(self, *args, **options):
+        scheduler = ExchangeScheduler(concurrency=options['concurrency'],
+                                      batch_size=options['batch_size'],
+                                      interval=options['interval'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully started exchange scheduler '
+            f'with concurrency {scheduler.concurrency}'))
+        try:
+            scheduler.run()
+        except KeyboardInterrupt:
+            scheduler.stop()
@@ -0,0 +1,31 @@
+import sys
+from dateutil.parser import parse
+from django.core.management.base import BaseCommand
+from exchanger.exports import EXPORTS
+from exchanger.exports import FORMATS
+from exchanger.exports import Exporter
+
+
+class Command(BaseCommand):
+    help = 'stream exchange history or transactions to csv or ndjson'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', choices=list(EXPORTS),
+                            default='exchanges')
+        parser.add_argument('--format', choices=list(FORMATS), default='csv')
+        parser.add_argument('--status', type=int)
+        parser.add_argument('--from', dest='created_from', type=parse)
+        parser.add_argument('--to', dest='created_to', type=parse)
+        parser.add_argument('--output', help='file path, stdout by default')
+
+    def handle(self, *args, **options):
+        exporter = Exporter(options['model'],
+                            fmt=options['format'],
+                            status=options['status'],
+                            created_from=options['created_from'],
+                            created_to=options['created_to'])
+        if options['output']:
+            with open(options['output'], 'w', newline='') as output:
+                output.writelines(exporter.lines())
+        else:
+            sys.stdout.writelines(exporter.lines())
@@ -0,0 +1,78 @@
+import time
+import threading
+from uuid import uuid4
+
+import grpc
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from exchanger.rpc import exchanger_pb2_grpc
+from exchanger.rpc.exchanger_pb2_grpc import exchanger__pb2 as exchanger_pb2
+
+
+class Command(BaseCommand):
+    help = 'load benchmark of running exchanger grpc server, run it against ' \
+           '"grpcserver" and "grpcserver --async" to compare both modes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--address',
+                            default=f'localhost:{settings.GRPC_SERVER_PORT}')
+        parser.add_argument('--requests', type=int, default=10000)
+        parser.add_argument('--concurrency', type=int, default=1000,
+                            help='max number of in-flight rpcs')
+        parser.add_argument('--size', type=int, default=5,
+                            help='transactions per request')
+
+    @staticmethod
+    def build_request(size: int):
+        return exchanger_pb2.UpdateRequest(
+            transactions=[exchanger_pb2.TransactionData(
+                uuid=str(uuid4()), trx_hash=str(uuid4()), value='1')
+                for _ in range(size)]
+        )
+
+    def handle(self, *args, **options):
+        slots = threading.BoundedSemaphore(options['concurrency'])
+        done = threading.Event()
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+        total = options['requests']
+
+        def on_done(started, future):
+            with lock:
+                latencies.append(time.perf_counter() - started)
+                if future.exception() is not None or \
+                        future.result().header.status != exchanger_pb2.SUCCESS:
+                    errors.append(future)
+                if len(latencies) == total:
+                    done.set()
+            slots.release()
+
+        with grpc.insecure_channel(options['address']) as channel:
+            stub = exchanger_pb2_grpc.ExchangerServiceStub(channel)
+            grpc.channel_ready_future(channel).result(
+                timeout=settings.GRPC_TIMEOUT)
+            started_at = time.perf_counter()
+            for _ in range(total):
+                slots.acquire()
+                started = time.perf_counter()
+                future = stub.UpdateInputTransaction.future(
+                    self.build_request(options['size']),
+                    timeout=settings.GRPC_TIMEOUT)
+                future.add_done_callback(
+                    lambda f, s=started: on_done(s, f))
+            done.wait()
+            elapsed = time.perf_counter() - started_at
+
+        latencies.sort()
+
+        def percentile(p):
+            return latencies[min(len(latencies) - 1,
+                                 int(len(latencies) * p))] * 1000
+
+        self.stdout.write(
+            f'requests: {total} errors: {len(errors)} '
+            f'concurrency: {options["concurrency"]}\n'
+            f'throughput: {total / elapsed:.1f} rps\n'
+            f'latency ms p50: {percentile(0.5):.1f} '
+            f'p95: {percentile(0.95):.1f} p99: {percentile(0.99):.1f}')
@@ -1,19 +1,48 @@
 import sys
 import time
+import asyncio
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
 from exchanger.gateway.grpc_server import serve_forever
+from exchanger.gateway.grpc_server import serve_async
 
 
 class Command(BaseCommand):
     help = 'api server'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int,
+                            default=settings.GRPC_SERVER_MAX_WORKERS)
+        parser.add_argument('--max-concurrent-rpcs', type=int,
+                            default=settings.GRPC_SERVER_MAX_CONCURRENT_RPCS)
+        parser.add_argument('--async', action='store_true', dest='use_async',
+                            help='run server on grpc.aio, --workers is the '
+                                 'size of executor for DB work')
+
     def handle(self, *args, **options):
-        with serve_forever():
+        if options['use_async']:
+            return self.handle_async(options)
+        with serve_forever(
+                max_workers=options['workers'],
+                maximum_concurrent_rpcs=options['max_concurrent_rpcs']):
             self.stdout.write(self.style.SUCCESS('Successfully started grpc server '))
             try:
                 while True:
                     time.sleep(settings.ONE_DAY_IN_SECONDS)
             except KeyboardInterrupt:
                 pass
+
+    def handle_async(self, options):
+        self.stdout.write(self.style.SUCCESS(
+            'Successfully started async grpc server '))
+        loop = asyncio.get_event_loop()
+        task = loop.create_task(serve_async(
+            max_workers=options['workers'],
+            maximum_concurrent_rpcs=options['max_concurrent_rpcs']))
+        try:
+            loop.run_until_complete(task)
+        except KeyboardInterrupt:
+            task.cancel()
+            loop.run_until_complete(
+                asyncio.gather(task, return_exceptions=True))
@@ -0,0 +1,39 @@
+import time
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.template.loader import render_to_string
+from exchanger.mail import MailRenderer
+
+
+class Command(BaseCommand):
+    help = 'measure renders per second of new exchange mail, compiled once ' \
+           'by MailRenderer and looked up by render_to_string every time'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--renders', type=int, default=10000)
+
+    @staticmethod
+    def context():
+        return {
+            'default_host': settings.DEFAULT_HOST,
+            'uuid': str(uuid4()),
+            'protocol': 'https',
+            'email': 'user@mail.com',
+        }
+
+    def measure(self, name, render, total):
+        started = time.perf_counter()
+        for _ in range(total):
+            render(self.context())
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'{name}: {total / elapsed:.0f} renders/s')
+
+    def handle(self, *args, **options):
+        total = options['renders']
+        renderer = MailRenderer('exchanger_mail.html', 'exchanger_mail.txt')
+        self.measure('render_to_string html',
+                     lambda c: render_to_string('exchanger_mail.html', c),
+                     total)
+        self.measure('MailRenderer html and text', renderer.render, total)
@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from exchanger.mail import MailOutboxSender
+
+
+class Command(BaseCommand):
+    help = 'deliver mails from the outbox'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=settings.MAIL_OUTBOX_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        sender = MailOutboxSender(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully started mail outbox sender '
+            f'with batch size {sender.batch_size}'))
+        try:
+            sender.run()
+        except KeyboardInterrupt:
+            sender.stop()
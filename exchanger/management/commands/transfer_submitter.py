@@ -0,0 +1,21 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from exchanger.transfers import TransferSubmitter
+
+
+class Command(BaseCommand):
+    help = 'submit pending outgoing transfers to transactions service'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=settings.TRANSFER_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        submitter = TransferSubmitter(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Successfully started transfer submitter '
+            f'with batch size {submitter.batch_size}'))
+        try:
+            submitter.run()
+        except KeyboardInterrupt:
+            submitter.stop()
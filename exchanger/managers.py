@@ -26,3 +26,31 @@ class CurrencyManager(BaseManager):
     def get_queryset(self):
         query = super().get_queryset()
         return query.filter(active=True)
+
+
+class ExchangeHistoryQuerySet(BaseQuerySet):
+
+    # relations dereferenced by state transitions and serializers
+    TRANSITION_RELATED = (
+        'from_currency',
+        'to_currency',
+        'ingoing_wallet',
+        'outgoing_wallet',
+        'transaction_input__currency',
+        'transaction_output__currency',
+    )
+
+    def for_transition(self):
+        """
+        Fetch exchange with everything its state chain touches in one query.
+        """
+        return self.select_related(*self.TRANSITION_RELATED)
+
+
+class ExchangeHistoryManager(BaseManager):
+    def get_queryset(self):
+        return ExchangeHistoryQuerySet(
+            self.model, using=self._db).filter(is_deleted=False)
+
+    def for_transition(self):
+        return self.get_queryset().for_transition()
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exchanger', '0011_auto_20200220_0911'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='exchangehistory',
+            index=models.Index(fields=['status', 'updated_at'], name='exchange_status_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exchanger', '0012_exchangehistory_status_updated_idx'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='exchangehistory',
+            name='exchange_status_updated_idx',
+        ),
+        migrations.AddIndex(
+            model_name='exchangehistory',
+            index=models.Index(condition=models.Q(('is_deleted', False), models.Q(('status__in', [7, 8, 10]), _negated=True)), fields=['status', 'updated_at'], name='exchange_active_status_idx'),
+        ),
+    ]
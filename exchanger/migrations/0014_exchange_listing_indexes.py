@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exchanger', '0013_partial_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='exchangehistory',
+            index=models.Index(condition=models.Q(is_deleted=False), fields=['created_at', 'id'], name='exchange_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exchangehistory',
+            index=models.Index(fields=['user_email', 'created_at'], name='exchange_email_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='exchangehistory',
+            index=models.Index(fields=['status', 'created_at'], name='exchange_status_created_idx'),
+        ),
+    ]
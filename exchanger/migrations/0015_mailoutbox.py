@@ -0,0 +1,40 @@
+import datetime
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exchanger', '0014_exchange_listing_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MailOutbox',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(db_index=True, default=datetime.datetime.now, verbose_name='Time of created')),
+                ('updated_at', models.DateTimeField(blank=True, null=True, verbose_name='Time of last update')),
+                ('deleted_at', models.DateTimeField(blank=True, null=True, verbose_name='Time then row was deleted')),
+                ('is_deleted', models.BooleanField(db_index=True, default=False, verbose_name='Is deleted row')),
+                ('exchange_uuid', models.UUIDField(verbose_name='Uuid of reported exchange')),
+                ('kind', models.SmallIntegerField(choices=[(1, 'NEW EXCHANGE TO USER'), (2, 'NEW EXCHANGE TO OWNERS')], verbose_name='Kind of mail')),
+                ('recipients', models.TextField(verbose_name='Comma separated recipients')),
+                ('context', models.TextField(default='{}', verbose_name='Json context of template')),
+                ('status', models.SmallIntegerField(choices=[(1, 'PENDING'), (2, 'SENT'), (3, 'FAILED')], default=1, verbose_name='Delivery status')),
+                ('attempts', models.SmallIntegerField(default=0, verbose_name='Delivery attempts')),
+                ('next_attempt_at', models.DateTimeField(default=datetime.datetime.now, verbose_name='Time of next delivery attempt')),
+                ('sent_at', models.DateTimeField(blank=True, null=True, verbose_name='Time mail was delivered')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='Last delivery error')),
+            ],
+            options={
+                'verbose_name': 'Mail Outbox',
+                'verbose_name_plural': 'Mail Outbox',
+                'unique_together': {('exchange_uuid', 'kind')},
+            },
+        ),
+        migrations.AddIndex(
+            model_name='mailoutbox',
+            index=models.Index(condition=models.Q(status=1), fields=['next_attempt_at'], name='mail_outbox_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,43 @@
+import datetime
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exchanger', '0015_mailoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransferIntent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(db_index=True, default=datetime.datetime.now, verbose_name='Time of created')),
+                ('updated_at', models.DateTimeField(blank=True, null=True, verbose_name='Time of last update')),
+                ('deleted_at', models.DateTimeField(blank=True, null=True, verbose_name='Time then row was deleted')),
+                ('is_deleted', models.BooleanField(db_index=True, default=False, verbose_name='Is deleted row')),
+                ('uuid', models.UUIDField(unique=True, verbose_name='Uuid of output transaction')),
+                ('wallet_id', models.IntegerField(verbose_name='Id of paying wallet')),
+                ('address_from', models.CharField(max_length=100, verbose_name='Address from which transfer is sent')),
+                ('address_to', models.CharField(max_length=100, verbose_name='Address to which transfer is sent')),
+                ('currency_slug', models.CharField(max_length=100, verbose_name='Currency slug')),
+                ('value', models.DecimalField(decimal_places=8, max_digits=16, verbose_name='Transfer amount')),
+                ('status', models.SmallIntegerField(choices=[(1, 'PENDING'), (2, 'SUBMITTED'), (3, 'FAILED')], default=1, verbose_name='Submission status')),
+                ('attempts', models.SmallIntegerField(default=0, verbose_name='Submission attempts')),
+                ('next_attempt_at', models.DateTimeField(default=datetime.datetime.now, verbose_name='Time of next submission attempt')),
+                ('submitted_at', models.DateTimeField(blank=True, null=True, verbose_name='Time transfer was accepted')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='Last submission error')),
+                ('exchange', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='transfer_intents', to='exchanger.ExchangeHistory', verbose_name='Paid out exchange')),
+            ],
+            options={
+                'verbose_name': 'Transfer Intent',
+                'verbose_name_plural': 'Transfer Intents',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='transferintent',
+            index=models.Index(condition=models.Q(status=1), fields=['next_attempt_at'], name='transfer_intent_pending_idx'),
+        ),
+    ]
@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('exchanger', '0016_transferintent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exchangehistory',
+            name='sweep_attempts',
+            field=models.PositiveIntegerField(default=0, verbose_name='Scheduler sweeps without progress'),
+        ),
+        migrations.AddField(
+            model_name='exchangehistory',
+            name='next_sweep_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True, verbose_name='Time scheduler may sweep exchange again'),
+        ),
+    ]
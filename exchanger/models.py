@@ -1,14 +1,26 @@
+import json
 import uuid
 import typing
 from datetime import datetime
+from decimal import Decimal
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db import transaction
 from django_prometheus.models import ExportModelOperationsMixin
 from .managers import BaseManager
 from .managers import CurrencyManager
+from .managers import ExchangeHistoryManager
 from .utils import nested_commit_on_success
 from .utils import all_kwargs_required
 from .locks import nowait_lock
-from .locks import connect_redis
+from .locks import connect_lock_redis
+from .locks import LockPolicy
+from .locks import BLOCKING
+from .queues import advance_queue
+
+# CLOSED, FAILED and DEPOSIT_RETURNED statuses of ExchangeHistory, kept out
+# of its class to be seen from Meta
+FINAL_STATUTES = (7, 8, 10)
 
 
 class Base(models.Model):
@@ -279,6 +291,10 @@ class ExchangeHistory(ExportModelOperationsMixin('ExchangeHistory'), Base):
         (CREATE_RETURN_TRANSFER, 'CREATING RETURN TRANSACTION'),
     )
 
+    FINAL_STATUTES = FINAL_STATUTES
+
+    SCHEDULER_FIELDS = ('sweep_attempts', 'next_sweep_at')
+
     READ_ONLY_FIELDS = ('fee',
                         'issue_rate_from',
                         'issue_rate_to',
@@ -366,6 +382,18 @@ class ExchangeHistory(ExportModelOperationsMixin('ExchangeHistory'), Base):
                             unique=True,
                             editable=False)
 
+    sweep_attempts = models.PositiveIntegerField(
+        verbose_name='Scheduler sweeps without progress',
+        default=0)
+
+    next_sweep_at = models.DateTimeField(
+        verbose_name='Time scheduler may sweep exchange again',
+        null=True,
+        blank=True,
+        db_index=True)
+
+    objects = ExchangeHistoryManager()
+
     @property
     def state(self):
         from exchanger import states
@@ -375,31 +403,75 @@ class ExchangeHistory(ExportModelOperationsMixin('ExchangeHistory'), Base):
         return states.state_by_status(self.status)
 
     @nested_commit_on_success
-    def request_update(self, stop_status: int = None):
+    def request_update(self,
+                       stop_status: int = None,
+                       policy: LockPolicy = BLOCKING) -> bool:
         """Update  state with state inner transition. Commit.
         Should use for initiative update without params.
         :param stop_status status u want to stop, if None forward if possible.
+        :param policy lock policy, with deferring policy exchange that is
+        locked by another worker is pushed to advancement queue.
+        Return True if exchange was updated.
         """
-        redis = connect_redis()
+        redis = connect_lock_redis()
         with nowait_lock(redis) as locker:
             key = ExchangeHistory.lock_name_by_id(self.id)
-            if locker.lock(key, blocking=True):
-                self.state.make_inner_transition(self, stop_status=stop_status)
+            if locker.lock(key, policy=policy):
+                exchange = self.load_for_transition()
+                exchange.state.make_inner_transition(exchange,
+                                                     stop_status=stop_status)
+                self.copy_from(exchange)
+                return True
+        self.defer_update(policy)
+        return False
 
     @nested_commit_on_success
-    def outer_update(self, stop_status: int = None, **params):
+    def outer_update(self,
+                     stop_status: int = None,
+                     policy: LockPolicy = BLOCKING,
+                     **params) -> bool:
         """Update loan state with state outer transition. Commit.
         Should use for update state with some result from asynchronous task.
         Update parameters are passing using params.
         :param stop_status status u want to stop, if None forward if possible.
+        :param policy lock policy, with deferring policy exchange that is
+        locked by another worker is pushed to advancement queue, params are
+        not kept and the exchange is advanced there by inner transition.
+        Return True if exchange was updated.
         """
-        redis = connect_redis()
+        redis = connect_lock_redis()
         with nowait_lock(redis) as locker:
             key = ExchangeHistory.lock_name_by_id(self.id)
-            if locker.lock(key, blocking=True):
-                self.state.make_outer_transition(self,
-                                                 stop_status=stop_status,
-                                                 **params)
+            if locker.lock(key, policy=policy):
+                exchange = self.load_for_transition()
+                exchange.state.make_outer_transition(exchange,
+                                                     stop_status=stop_status,
+                                                     **params)
+                self.copy_from(exchange)
+                return True
+        self.defer_update(policy)
+        return False
+
+    def load_for_transition(self) -> 'ExchangeHistory':
+        """
+        Load fresh copy of exchange together with all relations used by
+        state transitions, so the state chain makes no lazy queries.
+        Transition runs on the copy, unsaved changes of this instance are
+        never written by it. Row is not locked: transitions are serialized
+        by exchange lock, and row lock would be held across remote calls
+        of the state chain.
+        """
+        return ExchangeHistory.objects.for_transition().get(id=self.id)
+
+    def copy_from(self, other: 'ExchangeHistory') -> typing.NoReturn:
+        """Take fields and loaded relations of other copy of exchange."""
+        for field in self._meta.concrete_fields:
+            setattr(self, field.attname, getattr(other, field.attname))
+        self._state.fields_cache = other._state.fields_cache
+
+    def defer_update(self, policy: LockPolicy) -> typing.NoReturn:
+        if policy.defer:
+            transaction.on_commit(lambda: advance_queue().push(self.id))
 
     def __str__(self):
         return f'Exchange history id: {self.uuid} bound with user' \
@@ -435,3 +507,208 @@ class ExchangeHistory(ExportModelOperationsMixin('ExchangeHistory'), Base):
     class Meta:
         verbose_name = 'Exchange History'
         verbose_name_plural = 'Exchange Histories'
+        indexes = [
+            # scheduler sweeps of active exchanges
+            models.Index(fields=['status', 'updated_at'],
+                         name='exchange_active_status_idx',
+                         condition=models.Q(is_deleted=False) & ~models.Q(
+                             status__in=list(FINAL_STATUTES))),
+            # created_at range filters of history listing
+            models.Index(fields=['created_at', 'id'],
+                         name='exchange_created_idx',
+                         condition=models.Q(is_deleted=False)),
+            models.Index(fields=['user_email', 'created_at'],
+                         name='exchange_email_created_idx'),
+            models.Index(fields=['status', 'created_at'],
+                         name='exchange_status_created_idx'),
+        ]
+
+
+class MailOutbox(ExportModelOperationsMixin('MailOutbox'), Base):
+    """
+    Mail intent written in the same transaction as the change it reports.
+    Delivered later by mail_outbox worker, see exchanger.mail.
+    """
+
+    NEW_EXCHANGE_USER, NEW_EXCHANGE_OWNERS = 1, 2
+
+    KINDS = (
+        (NEW_EXCHANGE_USER, 'NEW EXCHANGE TO USER'),
+        (NEW_EXCHANGE_OWNERS, 'NEW EXCHANGE TO OWNERS'),
+    )
+
+    PENDING, SENT, FAILED = 1, 2, 3
+
+    STATUTES = (
+        (PENDING, 'PENDING'),
+        (SENT, 'SENT'),
+        (FAILED, 'FAILED'),
+    )
+
+    exchange_uuid = models.UUIDField(verbose_name='Uuid of reported exchange')
+
+    kind = models.SmallIntegerField(verbose_name='Kind of mail',
+                                    choices=KINDS)
+
+    recipients = models.TextField(verbose_name='Comma separated recipients')
+
+    context = models.TextField(verbose_name='Json context of template',
+                               default='{}')
+
+    status = models.SmallIntegerField(verbose_name='Delivery status',
+                                      choices=STATUTES,
+                                      default=PENDING)
+
+    attempts = models.SmallIntegerField(verbose_name='Delivery attempts',
+                                        default=0)
+
+    next_attempt_at = models.DateTimeField(verbose_name='Time of next '
+                                                        'delivery attempt',
+                                           default=datetime.now)
+
+    sent_at = models.DateTimeField(verbose_name='Time mail was delivered',
+                                   null=True,
+                                   blank=True)
+
+    last_error = models.TextField(verbose_name='Last delivery error',
+                                  blank=True,
+                                  default='')
+
+    @classmethod
+    def enqueue(cls,
+                exchange: ExchangeHistory,
+                kind: int,
+                recipients: typing.List[str],
+                context: typing.Optional[typing.Dict] = None
+                ) -> 'MailOutbox':
+        """Add mail of kind about exchange once, repeated calls are no-op."""
+        obj, _ = cls.objects.get_or_create(
+            exchange_uuid=exchange.uuid,
+            kind=kind,
+            defaults={
+                'recipients': ','.join(recipients),
+                'context': json.dumps(context or {}, cls=DjangoJSONEncoder),
+            })
+        return obj
+
+    @property
+    def recipient_list(self) -> typing.List[str]:
+        return [r for r in self.recipients.split(',') if r]
+
+    def __str__(self):
+        return f'MailOutbox ({self.kind}, {self.exchange_uuid})'
+
+    class Meta:
+        verbose_name = 'Mail Outbox'
+        verbose_name_plural = 'Mail Outbox'
+        unique_together = ('exchange_uuid', 'kind')
+        indexes = [
+            models.Index(fields=['next_attempt_at'],
+                         name='mail_outbox_pending_idx',
+                         condition=models.Q(status=1)),  # PENDING
+        ]
+
+
+class TransferIntent(ExportModelOperationsMixin('TransferIntent'), Base):
+    """
+    Outgoing transfer written in the transition that decides to pay out.
+    Submitted later by transfer_submitter worker with uuid of output
+    transaction as idempotency key, see exchanger.transfers.
+    """
+
+    PENDING, SUBMITTED, FAILED = 1, 2, 3
+
+    STATUTES = (
+        (PENDING, 'PENDING'),
+        (SUBMITTED, 'SUBMITTED'),
+        (FAILED, 'FAILED'),
+    )
+
+    exchange = models.ForeignKey(ExchangeHistory,
+                                 verbose_name='Paid out exchange',
+                                 on_delete=models.CASCADE,
+                                 related_name='transfer_intents')
+
+    uuid = models.UUIDField(verbose_name='Uuid of output transaction',
+                            unique=True)
+
+    wallet_id = models.IntegerField(verbose_name='Id of paying wallet')
+
+    address_from = models.CharField(verbose_name='Address from which '
+                                                 'transfer is sent',
+                                    max_length=100)
+
+    address_to = models.CharField(verbose_name='Address to which '
+                                               'transfer is sent',
+                                  max_length=100)
+
+    currency_slug = models.CharField(verbose_name='Currency slug',
+                                     max_length=100)
+
+    value = models.DecimalField(verbose_name='Transfer amount',
+                                max_digits=16,
+                                decimal_places=8)
+
+    status = models.SmallIntegerField(verbose_name='Submission status',
+                                      choices=STATUTES,
+                                      default=PENDING)
+
+    attempts = models.SmallIntegerField(verbose_name='Submission attempts',
+                                        default=0)
+
+    next_attempt_at = models.DateTimeField(verbose_name='Time of next '
+                                                        'submission attempt',
+                                           default=datetime.now)
+
+    submitted_at = models.DateTimeField(verbose_name='Time transfer was '
+                                                     'accepted',
+                                        null=True,
+                                        blank=True)
+
+    last_error = models.TextField(verbose_name='Last submission error',
+                                  blank=True,
+                                  default='')
+
+    @classmethod
+    def enqueue(cls,
+                exchange: ExchangeHistory,
+                wallet_id: int,
+                transfer: typing.Dict) -> 'TransferIntent':
+        """
+        Add transfer of output transaction once, repeated calls return
+        existing intent.
+        :param transfer: OutPutTransaction.transfer_dict()
+        """
+        obj, _ = cls.objects.get_or_create(
+            uuid=transfer['uuid'],
+            defaults={
+                'exchange': exchange,
+                'wallet_id': wallet_id,
+                'address_from': transfer['address_from'],
+                'address_to': transfer['address_to'],
+                'currency_slug': transfer['currency_slug'],
+                'value': Decimal(transfer['value']),
+            })
+        return obj
+
+    def transfer_dict(self) -> typing.Dict:
+        return {
+            'address_from': self.address_from,
+            'address_to': self.address_to,
+            'currency_slug': self.currency_slug,
+            'value': str(self.value),
+            'wallet_id': self.wallet_id,
+            'uuid': str(self.uuid),
+        }
+
+    def __str__(self):
+        return f'TransferIntent ({self.uuid}, {self.get_status_display()})'
+
+    class Meta:
+        verbose_name = 'Transfer Intent'
+        verbose_name_plural = 'Transfer Intents'
+        indexes = [
+            models.Index(fields=['next_attempt_at'],
+                         name='transfer_intent_pending_idx',
+                         condition=models.Q(status=1)),  # PENDING
+        ]
@@ -0,0 +1,264 @@
+import os
+import uuid
+import queue
+import socket
+import typing
+import logging
+import threading
+from concurrent import futures
+
+from django import db
+from django.conf import settings
+
+from .locks import bounded
+from .locks import connect_redis
+from .locks import request_key
+
+logger = logging.getLogger('exchanger')
+
+
+PUSH_SCRIPT = """
+local pushed = 0
+for _, id in ipairs(ARGV) do
+    if redis.call('SADD', KEYS[2], id) == 1 then
+        redis.call('LPUSH', KEYS[1], id)
+        pushed = pushed + 1
+    end
+end
+return pushed
+"""
+
+# ids of dead worker may be queued twice, advancing exchange is idempotent
+REQUEUE_SCRIPT = """
+local moved = 0
+local id = redis.call('RPOP', KEYS[1])
+while id do
+    redis.call('SADD', KEYS[3], id)
+    redis.call('LPUSH', KEYS[2], id)
+    moved = moved + 1
+    id = redis.call('RPOP', KEYS[1])
+end
+redis.call('SREM', KEYS[4], ARGV[1])
+return moved
+"""
+
+
+class RedisAdvanceQueue:
+    """
+    Durable queue of exchange ids waiting for state machine advancement.
+
+    Ids are kept in a redis list, a set of pending ids deduplicates
+    pushes of an exchange that is already waiting, both are changed by one
+    script. Popped ids are moved atomically to processing list of the
+    popping worker and removed from it by ack. Worker holds a lease
+    renewed by heartbeat, ids of worker whose lease expired are returned
+    to the queue by requeue_processing.
+    """
+
+    def __init__(self, name: str = 'advance',
+                 worker_id: typing.Optional[str] = None):
+        self.key = request_key('queue', name)
+        self.pending_key = request_key('queue', name, 'pending')
+        self.workers_key = request_key('queue', name, 'workers')
+        self.name = name
+        self.worker_id = worker_id or \
+            f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.processing_key = self.processing_key_of(self.worker_id)
+        self._scripts = {}
+
+    def __repr__(self):
+        return f'{self.__class__.__name__} class'
+
+    def __len__(self):
+        return connect_redis().llen(self.key)
+
+    def processing_key_of(self, worker_id: str) -> str:
+        return request_key('queue', self.name, 'processing', worker_id)
+
+    def lease_key_of(self, worker_id: str) -> str:
+        return request_key('queue', self.name, 'lease', worker_id)
+
+    def _script(self, source: str):
+        redis = connect_redis()
+        script = self._scripts.get(source)
+        if script is None or script.registered_client is not redis:
+            script = self._scripts[source] = redis.register_script(source)
+        return script
+
+    def push(self, *ids: int) -> int:
+        if not ids:
+            return 0
+        return self._script(PUSH_SCRIPT)(
+            keys=[self.key, self.pending_key], args=list(ids))
+
+    def pop(self, timeout: int = 1) -> typing.Optional[int]:
+        redis = connect_redis()
+        raw = redis.brpoplpush(self.key, self.processing_key, timeout)
+        if raw is None:
+            return None
+        redis.srem(self.pending_key, raw)
+        return int(raw)
+
+    def ack(self, _id: int) -> typing.NoReturn:
+        connect_redis().lrem(self.processing_key, 1, _id)
+
+    def heartbeat(self) -> typing.NoReturn:
+        """Renew lease of this worker on its processing list."""
+        redis = connect_redis()
+        redis.sadd(self.workers_key, self.worker_id)
+        redis.set(self.lease_key_of(self.worker_id), 1,
+                  ex=settings.ADVANCE_QUEUE_LEASE)
+
+    def requeue_processing(self) -> int:
+        """Return ids held by workers with expired lease to the queue."""
+        redis = connect_redis()
+        moved = 0
+        for raw in redis.smembers(self.workers_key):
+            worker_id = raw.decode() if isinstance(raw, bytes) else raw
+            if worker_id == self.worker_id or \
+                    redis.exists(self.lease_key_of(worker_id)):
+                continue
+            moved += self._script(REQUEUE_SCRIPT)(
+                keys=[self.processing_key_of(worker_id), self.key,
+                      self.pending_key, self.workers_key],
+                args=[worker_id])
+        return moved
+
+
+class LocalAdvanceQueue:
+    """In process stand-in of RedisAdvanceQueue for tests and development."""
+
+    def __init__(self, name: str = 'advance'):
+        self.name = name
+        self._queue = queue.Queue()
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__} class'
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def push(self, *ids: int) -> int:
+        pushed = 0
+        with self._lock:
+            for _id in ids:
+                if _id not in self._pending:
+                    self._pending.add(_id)
+                    self._queue.put(_id)
+                    pushed += 1
+        return pushed
+
+    def pop(self, timeout: int = 1) -> typing.Optional[int]:
+        try:
+            _id = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        with self._lock:
+            self._pending.discard(_id)
+        return _id
+
+    def ack(self, _id: int) -> typing.NoReturn:
+        pass
+
+    def heartbeat(self) -> typing.NoReturn:
+        pass
+
+    def requeue_processing(self) -> int:
+        return 0
+
+
+_advance_queue = None
+_advance_queue_pid = None
+_advance_queue_lock = threading.Lock()
+
+
+def advance_queue() -> typing.Union[RedisAdvanceQueue, LocalAdvanceQueue]:
+    """
+    Process wide advancement queue configured by ADVANCE_QUEUE_BACKEND.
+    Nothing outside the process can drain local queue, so it comes with
+    AdvanceWorker running in a daemon thread of the process.
+    """
+    global _advance_queue, _advance_queue_pid
+    local = None
+    if _advance_queue is None or _advance_queue_pid != os.getpid():
+        with _advance_queue_lock:
+            if _advance_queue is None or _advance_queue_pid != os.getpid():
+                if settings.ADVANCE_QUEUE_BACKEND == 'local':
+                    _advance_queue = local = LocalAdvanceQueue()
+                else:
+                    _advance_queue = RedisAdvanceQueue()
+                _advance_queue_pid = os.getpid()
+    if local is not None:
+        # worker is started outside of the lock, pushes made before it
+        # starts wait in the queue
+        threading.Thread(target=AdvanceWorker(source=local).run,
+                         name='local advance worker', daemon=True).start()
+    return _advance_queue
+
+
+class AdvanceWorker:
+    """
+    Drain advancement queue running request_update in a thread pool.
+    Exchange locked by another worker for longer than ADVANCE_LOCK_TIMEOUT
+    is pushed back to the queue.
+    """
+
+    def __init__(self, concurrency: typing.Optional[int] = None,
+                 source=None):
+        self.concurrency = concurrency or settings.ADVANCE_WORKERS
+        self.queue = source if source is not None else advance_queue()
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._stop = threading.Event()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__} class'
+
+    def stop(self) -> typing.NoReturn:
+        self._stop.set()
+
+    def advance(self, _id: int) -> typing.NoReturn:
+        from exchanger.models import ExchangeHistory
+
+        try:
+            exchange = ExchangeHistory.objects.filter(id=_id).first()
+            if exchange is not None:
+                exchange.request_update(policy=bounded(
+                    settings.ADVANCE_LOCK_TIMEOUT, defer=True))
+        except Exception as e:
+            logger.error(f'{self.__class__.__name__} failed to advance '
+                         f'exchange {_id}: {e}')
+        finally:
+            self.queue.ack(_id)
+            db.close_old_connections()
+
+    def requeue(self) -> typing.NoReturn:
+        requeued = self.queue.requeue_processing()
+        if requeued:
+            logger.info(f'{self.__class__.__name__} requeued {requeued} '
+                        f'unfinished exchanges of stopped workers')
+
+    def _keep_lease(self) -> typing.NoReturn:
+        """Renew lease and pick up ids of dead workers, while running."""
+        while True:
+            try:
+                self.queue.heartbeat()
+                self.requeue()
+            except Exception as e:
+                logger.error(f'{self.__class__.__name__} heartbeat '
+                             f'failed {e}')
+            if self._stop.wait(settings.ADVANCE_QUEUE_LEASE / 3):
+                return
+
+    def run(self) -> typing.NoReturn:
+        threading.Thread(target=self._keep_lease, daemon=True).start()
+        with futures.ThreadPoolExecutor(self.concurrency) as pool:
+            while not self._stop.is_set():
+                self._slots.acquire()
+                _id = self.queue.pop(timeout=settings.ADVANCE_QUEUE_POP_TIMEOUT)
+                if _id is None:
+                    self._slots.release()
+                    continue
+                pool.submit(self.advance, _id).add_done_callback(
+                    lambda _: self._slots.release())
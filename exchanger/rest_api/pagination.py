@@ -0,0 +1,16 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination
+
+
+class ExchangeHistoryCursorPagination(CursorPagination):
+    """
+    Keyset pagination over id. CursorPagination keeps position of the
+    first ordering field only, so it is the unique and growing primary
+    key, newest exchanges come first as with creation time. Every page is
+    one index range scan, so listing time does not grow with table size.
+    """
+
+    ordering = '-id'
+    page_size = settings.EXCHANGE_LIST_PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.EXCHANGE_LIST_MAX_PAGE_SIZE
@@ -2,11 +2,16 @@ import typing
 from decimal import Decimal
 from django.conf import settings
 from django.db.models import ObjectDoesNotExist
+from django.db.models import Q
 from rest_framework import serializers
 
+from exchanger.exports import FORMATS
+from exchanger.fanout import fan_out
+from exchanger.gateway.breaker import CircuitOpenError
 from exchanger.utils import quantize
 from exchanger.utils import calculate_fee
 from exchanger.currencies_gateway import CurrenciesServiceGateway
+from exchanger.currencies_gateway.rates import RateTable
 from exchanger.blockchain_gateway import BlockChainServiceGateway
 
 from exchanger.models import (
@@ -27,43 +32,59 @@ class ExternalServicesValidatorMixin:
     currencies: CurrenciesServiceGateway = currency_service_gw
 
     @staticmethod
-    def get_attrs(data: dict, address: str, currency: str) -> dict:
-        return {
-                'address': data[address],
-                'currency_slug': data[currency].slug
-            }
-
-    def bgw_validate_addresses(self, data: dict) -> dict:
-        for attr in ['from', 'to']:
-            resp = self.b_gw.check_address(**self.get_attrs(
-                data, f'{attr}_address', f'{attr}_currency'))
-
-            if not resp.get('isinstance'):
+    def address_pairs(data: dict) -> typing.List[typing.Tuple[str, str]]:
+        return [
+            (data[f'{attr}_address'], data[f'{attr}_currency'].slug)
+            for attr in ['from', 'to']
+        ]
+
+    def bgw_validate_addresses(
+            self,
+            data: dict,
+            responses: typing.Optional[typing.Dict] = None
+    ) -> dict:
+        """
+        :param responses: result of check_addresses if it already ran
+        """
+        pairs = self.address_pairs(data)
+        if responses is None:
+            responses = self.b_gw.check_addresses(pairs)
+        for attr, pair in zip(['from', 'to'], pairs):
+            if not responses[pair].get('isinstance'):
                 raise serializers.ValidationError(
                     f'You address {data[f"{attr}_address"]} is not valid'
                 )
         return data
 
     def external_svc_validate(self, data: dict):
-        rates = {_['slug']: _['rate'] for _ in self.currencies.get_currencies()}
-        self.bgw_validate_addresses(data)
-        self.update_rates(data, rates)
+        """
+        Rates and both addresses are fetched concurrently, so validation
+        takes as long as the slowest remote call.
+        """
+        results = fan_out({
+            'rates': lambda: self.currencies.get_rates(
+                max_age=settings.RATES_MAX_STALENESS),
+            'addresses': lambda: self.b_gw.check_addresses(
+                self.address_pairs(data)),
+        }, timeout=settings.EXTERNAL_VALIDATION_TIMEOUT)
+        self.bgw_validate_addresses(data, results['addresses'])
+        self.update_rates(data, results['rates'])
         return data
 
     @staticmethod
     def update_rates(
             data: dict,
-            data_rates: dict,
+            data_rates: RateTable,
     ) -> dict:
 
         input_slug = data['from_currency'].slug
-        current_rate_from = Decimal(data_rates.get(input_slug))
+        current_rate_from = data_rates[input_slug]
 
         output_slug = data['to_currency'].slug
-        current_rate_to = Decimal(data_rates.get(output_slug))
+        current_rate_to = data_rates[output_slug]
 
         usd_value_from = quantize(
-            Decimal(current_rate_from * Decimal(data['ingoing_amount'])))
+            data_rates.to_usd(Decimal(data['ingoing_amount']), input_slug))
 
         if usd_value_from > settings.MAX_SUM:
             raise serializers.ValidationError(
@@ -75,12 +96,12 @@ class ExternalServicesValidatorMixin:
             raise serializers.ValidationError(
                 f'{output_slug} : "{usd_value_from}" is to low for exchanger ')
 
-        data['fee'] = quantize(Decimal(usd_fee / current_rate_from))
+        data['fee'] = quantize(data_rates.from_usd(usd_fee, input_slug))
 
         data['issue_rate_from'] = current_rate_from
         data['issue_rate_to'] = current_rate_to
         data['outgoing_amount'] = quantize(
-            Decimal((usd_value_from - usd_fee) / current_rate_to))
+            data_rates.from_usd(usd_value_from - usd_fee, output_slug))
         return data
 
 
@@ -106,13 +127,16 @@ class ExchangeHistorySerializer(serializers.ModelSerializer,
 
     class Meta:
         model = ExchangeHistory
-        exclude = ExchangeHistory.BASE_FIELDS + ('id', )
+        exclude = ExchangeHistory.BASE_FIELDS + \
+            ExchangeHistory.SCHEDULER_FIELDS + ('id', )
 
     def validate(self, attrs):
         data = super().validate(attrs)
         if not settings.TEST_MODE:
             try:
                 return self.external_svc_validate(data)
+            except CircuitOpenError:
+                raise
             except Exception as exc:
                 raise serializers.ValidationError(exc)
         data['to_address'] = data['to_address'].lower()
@@ -173,6 +197,47 @@ class SettingsSerializer(serializers.Serializer):
     delta = serializers.IntegerField()
 
 
+class ExchangeHistoryFilterSerializer(serializers.Serializer):
+    """Query parameters of exchange history listing."""
+
+    status = serializers.ChoiceField(
+        choices=ExchangeHistory.EXCHANGE_STATUTES, required=False)
+    currency = serializers.CharField(required=False)
+    email = serializers.EmailField(required=False)
+    created_from = serializers.DateTimeField(required=False)
+    created_to = serializers.DateTimeField(required=False)
+    stream = serializers.BooleanField(required=False, default=False)
+
+    def filter(self, queryset):
+        data = self.validated_data
+        if 'status' in data:
+            queryset = queryset.filter(status=data['status'])
+        if 'currency' in data:
+            currency = Currency.all_objects.filter(
+                slug=data['currency']).values('id')
+            queryset = queryset.filter(Q(from_currency__in=currency) |
+                                       Q(to_currency__in=currency))
+        if 'email' in data:
+            queryset = queryset.filter(user_email=data['email'])
+        if 'created_from' in data:
+            queryset = queryset.filter(created_at__gte=data['created_from'])
+        if 'created_to' in data:
+            queryset = queryset.filter(created_at__lt=data['created_to'])
+        return queryset
+
+
+class ExportSerializer(serializers.Serializer):
+    """
+    Query parameters of streaming export. Format is passed as fmt, format
+    is reserved by DRF for renderer negotiation.
+    """
+
+    fmt = serializers.ChoiceField(choices=list(FORMATS), default='csv')
+    status = serializers.IntegerField(required=False)
+    created_from = serializers.DateTimeField(required=False)
+    created_to = serializers.DateTimeField(required=False)
+
+
 class TrxHashSerializer(serializers.Serializer):
 
     trx_hash = serializers.CharField()
@@ -1,12 +1,20 @@
+import json
 import typing
 from django.conf import settings
+from django.db import transaction
+from django.http import StreamingHttpResponse
 from rest_framework import viewsets
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.decorators import action
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.utils.encoders import JSONEncoder
 from drf_yasg.utils import swagger_auto_schema
 from exchanger import states
+from exchanger.locks import DEFER
+from exchanger.exports import EXPORTS
+from exchanger.exports import Exporter
 from exchanger.currencies_gateway.serializers import CurrencySerializer
 from exchanger.gateway import currency_service_gw
 from exchanger.gateway import bgw_service_gw
@@ -15,8 +23,11 @@ from exchanger.models import (
     Currency
 )
 
+from .pagination import ExchangeHistoryCursorPagination
 from .serializers import (
     ExchangeHistorySerializer,
+    ExchangeHistoryFilterSerializer,
+    ExportSerializer,
     SettingsSerializer,
     TrxHashSerializer
 )
@@ -38,7 +49,7 @@ class UpdateTrxMixin:
         trx_hash = self.get_trx_hash(request)
         self.validate_hash(instance, trx_hash)
         instance.set_input_transaction_hash(trx_hash=trx_hash)
-        instance.request_update()
+        instance.request_update(policy=DEFER)
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
@@ -70,16 +81,20 @@ class UpdateTrxMixin:
 class ExchangeHistoryViewSet(viewsets.ModelViewSet,
                              UpdateTrxMixin):
 
-    queryset = ExchangeHistory.objects.all()
+    queryset = ExchangeHistory.objects.for_transition()
     serializer_class = ExchangeHistorySerializer
+    filter_serializer = ExchangeHistoryFilterSerializer
+    pagination_class = ExchangeHistoryCursorPagination
     lookup_field = 'uuid'
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        exchange_object = self.perform_create(serializer)
+        with transaction.atomic():
+            # exchange and its outbox mails are committed together
+            exchange_object = self.perform_create(serializer)
+            states.NewState.set(exchange_object)
         headers = self.get_success_headers(serializer.data)
-        states.NewState.set(exchange_object)
 
         exchange_object.request_update(
             stop_status=ExchangeHistory.WAITING_DEPOSIT)
@@ -108,30 +123,80 @@ class ExchangeHistoryViewSet(viewsets.ModelViewSet,
     @action(methods=['get'], detail=True)
     def refresh(self, request, *args, **kwargs):
         instance = self.get_object()
-        instance.request_update()
+        instance.request_update(policy=DEFER)
         serializer = self.get_serializer(instance)
         return Response(serializer.data)
 
     @swagger_auto_schema(
-        deprecated=True
+        query_serializer=ExchangeHistoryFilterSerializer
     )
     def list(self, request, *args, **kwargs):
-        if request.user.is_authenticated:
-            return super().list(request, *args, **kwargs)
-        return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
+        if not request.user.is_authenticated:
+            return Response(status=status.HTTP_405_METHOD_NOT_ALLOWED)
+        params = self.filter_serializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        queryset = params.filter(self.get_queryset())
+        if params.validated_data['stream']:
+            return self.stream(queryset)
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    def stream(self, queryset) -> StreamingHttpResponse:
+        """
+        Stream whole filtered history as one json array. Rows are fetched
+        by server side cursor in chunks, so memory does not grow with result.
+        """
+        serializer = self.get_serializer()
+
+        def content():
+            yield '['
+            rows = queryset.iterator(
+                chunk_size=settings.EXCHANGE_STREAM_CHUNK_SIZE)
+            for i, obj in enumerate(rows):
+                yield (',' if i else '') + json.dumps(
+                    serializer.to_representation(obj), cls=JSONEncoder)
+            yield ']'
+
+        return StreamingHttpResponse(content(),
+                                     content_type='application/json')
 
 
 class CurrencyServiceView(APIView):
 
     @swagger_auto_schema(responses={200: CurrencySerializer})
     def get(self, request, format=None):
+        slugs = set(Currency.objects.values_list('slug', flat=True))
         data = [
             elem for elem in currency_service_gw.get_currencies()
-            if elem['slug'] in Currency.objects.values_list('slug', flat=True)
+            if elem['slug'] in slugs
         ]
         return Response(data)
 
 
+class ExportView(APIView):
+    permission_classes = (IsAuthenticated,)
+    serializer = ExportSerializer
+
+    @swagger_auto_schema(query_serializer=ExportSerializer)
+    def get(self, request, name):
+        params = self.serializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        data = params.validated_data
+        if name not in EXPORTS:
+            return Response(status=status.HTTP_404_NOT_FOUND)
+        exporter = Exporter(name,
+                            fmt=data['fmt'],
+                            status=data.get('status'),
+                            created_from=data.get('created_from'),
+                            created_to=data.get('created_to'))
+        response = StreamingHttpResponse(exporter.lines(),
+                                         content_type=exporter.content_type)
+        response['Content-Disposition'] = \
+            f'attachment; filename="{exporter.filename}"'
+        return response
+
+
 class SettingsView(APIView):
     serializer = SettingsSerializer
 
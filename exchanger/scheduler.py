@@ -0,0 +1,179 @@
+import time
+import random
+import typing
+import logging
+import threading
+from datetime import datetime
+from datetime import timedelta
+from concurrent import futures
+
+from django import db
+from django.conf import settings
+from django.db.models import Q
+from prometheus_client import Counter
+from prometheus_client import Gauge
+
+from .locks import TRY_LOCK
+from .models import ExchangeHistory
+
+logger = logging.getLogger('exchanger')
+
+DUE_EXCHANGES = Gauge(
+    'exchanger_scheduler_due_exchanges',
+    'Non final exchanges waiting for the scheduler by status',
+    ['status'])
+OLDEST_DUE = Gauge(
+    'exchanger_scheduler_oldest_due_seconds',
+    'Time since last update of the oldest due exchange by status',
+    ['status'])
+BACKED_OFF = Gauge(
+    'exchanger_scheduler_backed_off_exchanges',
+    'Exchanges skipped by the scheduler until their backoff expires')
+SWEPT = Counter(
+    'exchanger_scheduler_swept_total',
+    'Exchanges swept by the scheduler by status and result',
+    ['status', 'result'])
+
+
+class ExchangeScheduler:
+    """
+    Periodically advance non final exchanges that were not updated for a
+    while, so exchanges move on without client polling refresh endpoint.
+
+    Every status waits its own interval from SCHEDULER_BACKOFF since the
+    last update. Exchange that was swept but kept its status waits
+    exponentially longer, up to SCHEDULER_MAX_BACKOFF, its backoff is kept
+    in next_sweep_at column and reset by every state change. All intervals
+    are jittered, so exchanges created together do not poll remote
+    services together. Exchange locked by another worker is skipped.
+    """
+
+    def __init__(self,
+                 concurrency: typing.Optional[int] = None,
+                 batch_size: typing.Optional[int] = None,
+                 interval: typing.Optional[float] = None):
+        self.concurrency = concurrency or settings.SCHEDULER_WORKERS
+        self.batch_size = batch_size or settings.SCHEDULER_BATCH_SIZE
+        self.interval = interval or settings.SCHEDULER_INTERVAL
+        # exchange stays UNKNOWN only until its creation is finished
+        self.statuses = [status for status, _ in ExchangeHistory.EXCHANGE_STATUTES
+                         if status not in ExchangeHistory.FINAL_STATUTES
+                         and status != ExchangeHistory.UNKNOWN]
+        self.intervals = {
+            getattr(ExchangeHistory, name): delay
+            for name, delay in settings.SCHEDULER_BACKOFF.items()
+        }
+        self._stop = threading.Event()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__} class'
+
+    def stop(self) -> typing.NoReturn:
+        self._stop.set()
+
+    def base_interval(self, status: int) -> float:
+        return self.intervals.get(status, settings.SCHEDULER_DEFAULT_BACKOFF)
+
+    @staticmethod
+    def jitter(delay: float) -> float:
+        spread = settings.SCHEDULER_JITTER
+        return delay * random.uniform(1 - spread, 1 + spread)
+
+    def due(self) -> typing.List[ExchangeHistory]:
+        """
+        Return at most batch_size oldest due exchanges of every non final
+        status and export depth and age of every status.
+        """
+        now = datetime.now()
+        BACKED_OFF.set(ExchangeHistory.objects.filter(
+            next_sweep_at__gt=now,
+        ).exclude(status__in=ExchangeHistory.FINAL_STATUTES).count())
+        exchanges = []
+        for status in self.statuses:
+            border = now - timedelta(
+                seconds=self.jitter(self.base_interval(status)))
+            query = ExchangeHistory.objects.filter(
+                status=status,
+                updated_at__lte=border,
+            ).exclude(
+                # repeat index predicate, so planner can use partial index
+                status__in=ExchangeHistory.FINAL_STATUTES,
+            ).filter(
+                Q(next_sweep_at__isnull=True) | Q(next_sweep_at__lte=now),
+            ).order_by('updated_at')
+            batch = list(query[:self.batch_size])
+            label = ExchangeHistory(status=status).state.__name__
+            DUE_EXCHANGES.labels(label).set(
+                query.count() if len(batch) == self.batch_size else len(batch))
+            OLDEST_DUE.labels(label).set(
+                (now - batch[0].updated_at).total_seconds() if batch else 0)
+            exchanges.extend(batch)
+        return exchanges
+
+    def advance(self, exchange: ExchangeHistory) -> str:
+        """Advance exchange and return sweep result."""
+        status = exchange.status
+        label = exchange.state.__name__
+        try:
+            updated = exchange.request_update(policy=TRY_LOCK)
+        except Exception as e:
+            logger.error(f'{self.__class__.__name__} failed to advance '
+                         f'exchange {exchange.uuid}: {e}')
+            result = 'error'
+        else:
+            if not updated:
+                result = 'locked'
+            elif exchange.status != status:
+                result = 'advanced'
+            else:
+                result = 'idle'
+
+        if result in ('idle', 'error'):
+            self.back_off(exchange, status)
+        SWEPT.labels(label, result).inc()
+        return result
+
+    def back_off(self, exchange: ExchangeHistory, status: int) -> \
+            typing.NoReturn:
+        """
+        Postpone next sweep of exchange that kept its status. Advanced
+        exchange had its backoff reset by state change, so the update is
+        limited to the swept status.
+        """
+        attempts = exchange.sweep_attempts + 1
+        delay = min(self.base_interval(status) * 2 ** attempts,
+                    settings.SCHEDULER_MAX_BACKOFF)
+        ExchangeHistory.objects.filter(id=exchange.id, status=status).update(
+            sweep_attempts=attempts,
+            next_sweep_at=datetime.now() + timedelta(
+                seconds=self.jitter(delay)))
+
+    def _advance_job(self, exchange: ExchangeHistory) -> str:
+        try:
+            return self.advance(exchange)
+        finally:
+            db.close_old_connections()
+
+    def sweep(self) -> typing.Dict[str, int]:
+        """Advance one batch of due exchanges, return counts by result."""
+        exchanges = self.due()
+        results = {}
+        if not exchanges:
+            return results
+        with futures.ThreadPoolExecutor(self.concurrency) as pool:
+            for result in pool.map(self._advance_job, exchanges):
+                results[result] = results.get(result, 0) + 1
+        logger.info(f'{self.__class__.__name__} swept {len(exchanges)} '
+                    f'exchanges: {results}')
+        return results
+
+    def run(self) -> typing.NoReturn:
+        while not self._stop.is_set():
+            started = time.monotonic()
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f'{self.__class__.__name__} sweep failed {e}')
+            finally:
+                db.close_old_connections()
+            self._stop.wait(max(0, self.interval - (time.monotonic() - started)))
@@ -6,18 +6,78 @@ from decimal import ROUND_HALF_UP
 
 from django.conf import settings
 
+from exchanger import mail
 from exchanger import models
 from exchanger import utils
 from exchanger.gateway import wallets_service_gw
 from exchanger.gateway import currency_service_gw
 from exchanger.gateway import trx_service_gw
 from exchanger.currencies_gateway import CurrenciesServiceGateway
+from exchanger.currencies_gateway.rates import RateTable
 from exchanger.transactions_gateway import TransactionsServiceGateway
 from exchanger.gateway.base import BaseRepr
 
 logger = logging.getLogger('exchanger.log')
 
 
+class StateRegistry:
+    """
+    Registry of states by id and of allowed transitions between them.
+    States are registered once at import by State.__init_subclass__.
+    """
+
+    def __init__(self):
+        self._states: typing.Dict[int, typing.Type['State']] = {}
+        self._transitions: typing.Dict[typing.Type['State'],
+                                       typing.FrozenSet] = {}
+
+    def register(self, state: typing.Type['State']) -> typing.NoReturn:
+        if state.id in self._states:
+            raise ValueError(
+                f'State id {state.id} of {state.__name__} is already used '
+                f'by {self._states[state.id].__name__}')
+        self._states[state.id] = state
+
+    def get(self, _id: int) -> typing.Type['State']:
+        return self._states[_id]
+
+    def __contains__(self, _id: int) -> bool:
+        return _id in self._states
+
+    def set_transitions(
+            self,
+            transitions: typing.Dict[typing.Type['State'],
+                                     typing.Iterable[typing.Type['State']]]
+    ) -> typing.NoReturn:
+        self._transitions = {k: frozenset(v) for k, v in transitions.items()}
+
+    def allowed(self, state: typing.Type['State']) -> typing.FrozenSet:
+        return self._transitions.get(state, frozenset())
+
+    def validate(self, initial: typing.Type['State']) -> typing.NoReturn:
+        """Raise if transitions refer unknown states or some are unreachable."""
+        known = set(self._states.values())
+        for source, targets in self._transitions.items():
+            unknown = ({source} | targets) - known
+            if unknown:
+                raise ValueError(f'Transitions of {source.__name__} refer '
+                                 f'unregistered states {unknown}')
+        reachable = {initial}
+        stack = [initial]
+        while stack:
+            for target in self.allowed(stack.pop()):
+                if target not in reachable:
+                    reachable.add(target)
+                    stack.append(target)
+        unreachable = known - reachable
+        if unreachable:
+            raise ValueError(f'States {sorted(s.__name__ for s in unreachable)}'
+                             f' are unreachable from {initial.__name__}')
+
+
+registry = StateRegistry()
+
+
 class State(BaseRepr, ABC):
     """
     Abstract class for exchange_object states.
@@ -27,6 +87,11 @@ class State(BaseRepr, ABC):
 
     id: typing.Optional[int] = None
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.__dict__.get('id') is not None:
+            registry.register(cls)
+
     @classmethod
     def validate(
             cls,
@@ -55,6 +120,9 @@ class State(BaseRepr, ABC):
         """
         cls.validate(exchange_object)
         exchange_object.status = cls.id
+        # exchange moved on, scheduler sweeps it with base interval again
+        exchange_object.sweep_attempts = 0
+        exchange_object.next_sweep_at = None
         exchange_object.save()
         # for seek error
         logger.info(f'{cls.__name__} Exchange object {exchange_object.uuid} has'
@@ -133,7 +201,7 @@ class State(BaseRepr, ABC):
 
         if same is True and from_state == to_state:
             return True
-        return to_state in __STATES_TRANSACTIONS__[from_state]
+        return to_state in registry.allowed(from_state)
 
 
 class SetWalletMixin:
@@ -212,19 +280,16 @@ class ValidateInputTransactionMixin:
 
         if not input_transaction.value == exchange_object.ingoing_amount:
             slug = input_transaction.currency.slug
-            rates = {_['slug']: _['rate'] for _ in cls.gw.get_currencies()}
-            usd_value = (Decimal(rates.get(slug)) * input_transaction.value
-                         ).quantize(Decimal('0.001'), rounding=ROUND_HALF_UP)
+            rates = cls.gw.get_rates(max_age=settings.RATES_MAX_STALENESS)
+            usd_value = rates.to_usd(input_transaction.value, slug
+                                     ).quantize(Decimal('0.001'),
+                                                rounding=ROUND_HALF_UP)
             fee = utils.calculate_fee(usd_value, rates, slug)
 
-            current_rate_to = Decimal(
-                rates.get(exchange_object.to_currency.slug)
-            )
-            exchange_object.fee = utils.quantize(
-                Decimal(fee / Decimal(rates.get(slug)))
-            )
-            exchange_object.issue_rate_to = current_rate_to
-            exchange_object.issue_rate_from = Decimal(rates.get(slug))
+            exchange_object.fee = utils.quantize(rates.from_usd(fee, slug))
+            exchange_object.issue_rate_to = rates[
+                exchange_object.to_currency.slug]
+            exchange_object.issue_rate_from = rates[slug]
 
             exchange_object.outgoing_amount = cls.calc_outgoing_amount(
                 usd_value, rates, fee, exchange_object.to_currency.slug)
@@ -234,11 +299,11 @@ class ValidateInputTransactionMixin:
     def calc_outgoing_amount(
             cls,
             usd_amount: Decimal,
-            rates: typing.Dict,
+            rates: RateTable,
             fee: Decimal,
             slug: str
     ) -> Decimal:
-        return Decimal((usd_amount - fee) / Decimal(rates.get(slug)))
+        return rates.from_usd(usd_amount - fee, slug)
 
 
 class CreateTransferMixin:
@@ -246,7 +311,13 @@ class CreateTransferMixin:
     Mixin class to create payment by external service
     Connecting with service transactions by class trx_service_gw
 
+    Transition only writes TransferIntent of output transaction, it is
+    submitted by transfer_submitter worker outside of exchange lock and
+    exchange moves to next_state once the transfer is accepted, or to
+    failed_state for manual review once submitter gives up.
+
     next_state: state to which following exchange object
+    failed_state: state of exchange whose transfer failed
     wallet_type: one two types of wallet associated with the exchange object
     There are two cases here:
 
@@ -259,6 +330,7 @@ class CreateTransferMixin:
     """
 
     next_state: typing.Type['State']
+    failed_state: typing.Type['State']
     wallet_type: str
     set_fee: bool
     gw: TransactionsServiceGateway()
@@ -272,18 +344,18 @@ class CreateTransferMixin:
         wallet_id = getattr(exchange_object, cls.wallet_type)
         transfer = exchange_object.transaction_output.transfer_dict()
 
-        resp = cls.gw.create_transfer(
-            wallet_id=wallet_id,
-            **transfer
-        )
-        if cls.get_status_from_resp(resp) in cls.gw.ALLOWED_STATUTES:
+        intent = models.TransferIntent.enqueue(
+            exchange_object, wallet_id, transfer)
+        if intent.status == intent.SUBMITTED:
             return cls.next_state.set(exchange_object)
+        if intent.status == intent.FAILED:
+            logger.error(f'{cls.__name__} transfer {intent} of exchange '
+                         f'{exchange_object.uuid} failed: '
+                         f'{intent.last_error}, needs manual review')
+            return cls.failed_state.set(exchange_object)
+        # transfer_submitter pays out and pushes exchange to advance queue
         return exchange_object.state
 
-    @classmethod
-    def get_status_from_resp(cls, response: dict):
-        return cls.gw.MODULE.ResponseStatus.Value(response['header']['status'])
-
 
 class ConfirmTransactionMixin:
 
@@ -359,8 +431,7 @@ class NewState(State,
             from_address=exchange_object.from_address,
             currency=exchange_object.from_currency
         )
-        utils.send_mail_to_user(exchange_object)
-        utils.send_email_to_owners(exchange_object)
+        mail.enqueue_new_exchange(exchange_object)
         logger.info(f'Created new exchange operation with params: \n'
                     f'{exchange_object.to_info_message}')
         return super().set(exchange_object)
@@ -427,10 +498,10 @@ class WaitingDepositState(State):
 
     @classmethod
     def validate_value(cls, trx: models.InputTransaction) -> bool:
-        slug = trx.currency.slug
-        rates = {_['slug']: _['rate'] for _ in cls.gw.get_currencies()}
-        usd_value = (Decimal(rates.get(slug)) * trx.value
-                     ).quantize(Decimal('0.001'), rounding=ROUND_HALF_UP)
+        rates = cls.gw.get_rates(max_age=settings.RATES_MAX_STALENESS)
+        usd_value = rates.to_usd(trx.value, trx.currency.slug
+                                 ).quantize(Decimal('0.001'),
+                                            rounding=ROUND_HALF_UP)
         return usd_value > settings.DEFAULT_FEE
 
 
@@ -503,6 +574,7 @@ class CreateReturnTransferState(CreateTransferMixin,
     trx_attr = 'transaction_output'
     wallet_type = 'outgoing_wallet_id'
     next_state = ReturningDepositState
+    failed_state = FailedState
     gw = trx_service_gw
 
 
@@ -631,12 +703,12 @@ class CreatingOutGoingState(CreateTransferMixin,
     trx_attr = 'transaction_output'
     wallet_type = 'outgoing_wallet_id'
     next_state = OutgoingRunningState
+    failed_state = FailedState
     gw = trx_service_gw
 
 
 def state_by_status(status: typing.Union[int, State]) -> typing.Type['State']:
-    __CLASSES__ = {c.id: c for c in utils.all_subclasses(State)}
-    return __CLASSES__[getattr(status, 'value', status)]
+    return registry.get(getattr(status, 'value', status))
 
 
 __STATES_TRANSACTIONS__ = {
@@ -647,9 +719,12 @@ __STATES_TRANSACTIONS__ = {
     DepositPaidState: [CalculatingState],
     CalculatingState: [CreateOutputTransactionState],
     InsufficientDepositState: [CreateReturnTransferState],
-    CreateReturnTransferState: [ReturningDepositState],
+    CreateReturnTransferState: [ReturningDepositState, FailedState],
     ReturningDepositState: [FailedState],
     CreateOutputTransactionState: [CreatingOutGoingState],
-    CreatingOutGoingState: [OutgoingRunningState],
+    CreatingOutGoingState: [OutgoingRunningState, FailedState],
     OutgoingRunningState: [ClosedState],
 }
+
+registry.set_transitions(__STATES_TRANSACTIONS__)
+registry.validate(UnknownState)
@@ -1,10 +1,31 @@
+import re
+import json
+import time
+import socket
+import asyncio
+import threading
+from concurrent import futures
+from datetime import datetime
 from datetime import timedelta
 from decimal import Decimal
+from unittest import skipUnless
+from unittest.mock import Mock
+from unittest.mock import PropertyMock
 from unittest.mock import patch
 from uuid import uuid4
 
+import grpc
 from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.mail import EmailMultiAlternatives
+from django import db
+from django.db import connection
+from django.template.loader import get_template
 from django.test import TestCase
+from django.test import TransactionTestCase
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from google.api import context_pb2
 from rest_framework.test import APIClient
 
@@ -13,10 +34,45 @@ from exchanger.gateway import wallets_service_gw
 from exchanger.rest_api.serializers import ExternalServicesValidatorMixin
 from exchanger.rest_api.views import bgw_service_gw
 from exchanger.rpc import exchanger_pb2
+from exchanger.rpc import exchanger_pb2_grpc
+from exchanger.rpc import blockchain_gateway_pb2
+from exchanger.rpc import wallets_pb2
+from exchanger.rpc import transactions_pb2
 from exchanger.gateway.grpc_server import ExchangerService
+from exchanger.gateway.grpc_server import serve_async
+from exchanger.gateway.pool import ChannelPool
+from exchanger import locks
+from exchanger.locks import connect_redis
+from exchanger.locks import connect_lock_redis
+from exchanger.locks import pool_stats
+from exchanger.queues import AdvanceWorker
+from exchanger.queues import LocalAdvanceQueue
+from exchanger.queues import RedisAdvanceQueue
+from exchanger.queues import advance_queue
+from exchanger.scheduler import ExchangeScheduler
+from exchanger.fanout import fan_out
+from exchanger import deadline as exchanger_deadline
+from exchanger.deadline import deadline
+from exchanger.deadline import DeadlineExceeded
+from exchanger.gateway import trx_service_gw
+from exchanger.gateway.breaker import CircuitBreaker
+from exchanger.gateway.coalescer import CoalescingCaller
+from exchanger.gateway.breaker import CircuitOpenError
+from exchanger.mail import MailOutboxSender
+from exchanger.mail import MailRenderer
+from exchanger.transfers import TransferSubmitter
+from exchanger.blockchain_gateway.cache import AddressCache
+from exchanger.currencies_gateway.cache import RatesCache
+from exchanger.currencies_gateway.rates import RateTable
+from exchanger.currencies_gateway.exceptions import \
+    CurrenciesBadResponseException
+from exchanger.rpc import currencies_pb2_grpc
 from exchanger.models import (
     Currency,
+    InputTransaction,
+    MailOutbox,
     PlatformWallet,
+    TransferIntent,
     ExchangeHistory,
     TransactionBase
 )
@@ -29,6 +85,7 @@ rates = [
     {"name": "BNB", "fullname": "Binance Coin", "slug": "binance-coin",
      "rate": "19.48540000", }
 ]
+rate_table = RateTable.from_currencies(rates)
 
 
 class TestBase(TestCase):
@@ -84,6 +141,22 @@ class TestBase(TestCase):
             external_id=2
         )
 
+    def stub_transactions(self):
+        return patch.object(type(trx_service_gw), 'client',
+                            new_callable=PropertyMock)
+
+    def transfer_response(self, status, description=''):
+        return Mock(result=Mock(
+            return_value=transactions_pb2.CreateTransferResponse(
+                header={'status': status, 'description': description})))
+
+    def submit_transfers(self, status=transactions_pb2.SUCCESS) -> int:
+        """Submit pending transfer intents as transfer_submitter does."""
+        with self.stub_transactions() as client:
+            client.return_value.CreateTransfer.future.return_value = \
+                self.transfer_response(status)
+            return TransferSubmitter().submit_batch()
+
 
 class TestSettingsApi(TestCase):
     """
@@ -304,8 +377,8 @@ class TestExchangerApi(TestBase):
 
     @patch.object(ExternalServicesValidatorMixin.b_gw, 'check_address',
                   return_value={'isinstance': True})
-    @patch.object(ExternalServicesValidatorMixin.currencies, 'get_currencies',
-                  return_value=rates)
+    @patch.object(ExternalServicesValidatorMixin.currencies, 'get_rates',
+                  return_value=rate_table)
     def test_overpayment_ingoing_amount(self, *args):
         settings.TEST_MODE = False
         error = {
@@ -353,6 +426,94 @@ class TestStates(TestBase):
             self.exchanger.request_update()
         self.exchanger.refresh_from_db()
 
+    def test_locked_exchange_is_not_waited_for(self):
+        key = ExchangeHistory.lock_name_by_id(self.exchanger.id)
+        with locks.nowait_lock(connect_lock_redis()) as holder:
+            self.assertTrue(holder.lock(key, policy=locks.BLOCKING))
+            self.assertFalse(
+                self.exchanger.request_update(policy=locks.TRY_LOCK))
+            self.assertFalse(
+                self.exchanger.request_update(policy=locks.bounded(1)))
+        self.exchanger.refresh_from_db()
+        self.assertEqual(self.exchanger.state, states.UnknownState)
+        self.assertTrue(self.exchanger.request_update(
+            stop_status=ExchangeHistory.NEW, policy=locks.TRY_LOCK))
+
+    @patch('exchanger.models.advance_queue')
+    @patch('exchanger.models.transaction.on_commit', side_effect=lambda f: f())
+    def test_locked_outer_update_is_deferred(self, _, queue):
+        key = ExchangeHistory.lock_name_by_id(self.exchanger.id)
+        with locks.nowait_lock(connect_lock_redis()) as holder:
+            self.assertTrue(holder.lock(key, policy=locks.BLOCKING))
+            self.assertFalse(self.exchanger.outer_update(policy=locks.DEFER))
+            self.assertFalse(
+                self.exchanger.outer_update(policy=locks.TRY_LOCK))
+        queue.return_value.push.assert_called_once_with(self.exchanger.id)
+
+    @patch.object(wallets_service_gw, '_base_request', return_value={})
+    def test_transition_graph_loaded_with_one_query(self, *args):
+        self.exchanger.request_update(stop_status=ExchangeHistory.WAITING_HASH)
+        for status, _ in ExchangeHistory.EXCHANGE_STATUTES:
+            if status not in states.registry:
+                # DEPOSIT_RETURNED has no state of its own
+                continue
+            ExchangeHistory.objects.filter(id=self.exchanger.id).update(
+                status=status)
+            with self.assertNumQueries(1):
+                exchange = self.exchanger.load_for_transition()
+                self.assertEqual(status, exchange.state.id)
+                self.assertIsNotNone(exchange.from_currency)
+                self.assertIsNotNone(exchange.to_currency)
+                self.assertIsNotNone(exchange.ingoing_wallet.address)
+                self.assertIsNotNone(exchange.outgoing_wallet.address)
+                self.assertIsNotNone(exchange.transaction_input.currency.slug)
+                self.assertIsNone(exchange.transaction_output)
+
+    def assertNoLazyQueries(self, queries):
+        # related rows fetched one by one, by primary key
+        lazy = [q['sql'] for q in queries
+                if re.match(r'SELECT .* FROM "exchanger_(?!exchangehistory")'
+                            r'\w+" WHERE "exchanger_\w+"\."id" = ', q['sql'])]
+        self.assertEqual([], lazy)
+
+    @patch.object(wallets_service_gw, '_base_request', return_value={})
+    @patch.object(states.WaitingDepositState, 'validate_value',
+                  return_value=True)
+    def test_transitions_make_no_lazy_queries(self, *args):
+        def confirm(trx):
+            trx.trx_hash = uuid4()
+            trx.status = TransactionBase.CONFIRMED
+            trx.save()
+
+        for status in (ExchangeHistory.NEW, ExchangeHistory.WAITING_HASH):
+            with CaptureQueriesContext(connection) as queries:
+                self.exchanger.request_update(stop_status=status)
+            self.assertNoLazyQueries(queries)
+        confirm(self.exchanger.transaction_input)
+        for status in (ExchangeHistory.WAITING_DEPOSIT,
+                       ExchangeHistory.DEPOSIT_PAID,
+                       ExchangeHistory.CALCULATING,
+                       ExchangeHistory.CREATING_OUTPUT_TRANSACTION,
+                       ExchangeHistory.CREATING_OUTGOING_TRANSFER,
+                       # transition writes transfer intent and waits
+                       ExchangeHistory.CREATING_OUTGOING_TRANSFER):
+            with CaptureQueriesContext(connection) as queries:
+                self.exchanger.request_update(stop_status=status)
+            self.assertEqual(status, self.exchanger.status)
+            self.assertNoLazyQueries(queries)
+        self.submit_transfers()
+        with CaptureQueriesContext(connection) as queries:
+            self.exchanger.request_update(
+                stop_status=ExchangeHistory.OUTGOING_RUNNING)
+        self.assertEqual(ExchangeHistory.OUTGOING_RUNNING,
+                         self.exchanger.status)
+        self.assertNoLazyQueries(queries)
+        confirm(self.exchanger.transaction_output)
+        with CaptureQueriesContext(connection) as queries:
+            self.exchanger.request_update(stop_status=ExchangeHistory.CLOSED)
+        self.assertEqual(ExchangeHistory.CLOSED, self.exchanger.status)
+        self.assertNoLazyQueries(queries)
+
     def test_unknown_state(self):
         self.assertEqual(self.exchanger.state, states.UnknownState)
         self.assertIsNone(self.exchanger.outgoing_wallet)
@@ -554,8 +715,6 @@ class TestStates(TestBase):
         self.assertEqual(trx_out.currency, self.exchanger.to_currency)
 
     @patch.object(wallets_service_gw, '_base_request', return_value={})
-    @patch.object(states.CreatingOutGoingState.gw, '_base_request',
-                  return_value={"header": {"status": 'SUCCESS'}})
     @patch.object(states.WaitingDepositState, 'validate_value',
                   return_value=True)
     def test_outgoing_running_state(self, *args):
@@ -568,13 +727,12 @@ class TestStates(TestBase):
         trx.status = TransactionBase.CONFIRMED
         trx.save()
         self.exchanger.request_update()
+        self.submit_transfers()
         self.exchanger.request_update()
         self.exchanger.refresh_from_db()
         self.assertEqual(self.exchanger.state, states.OutgoingRunningState)
 
     @patch.object(wallets_service_gw, '_base_request', return_value={})
-    @patch.object(states.CreatingOutGoingState.gw, '_base_request',
-                  return_value={"header": {"status": 'ERROR'}})
     @patch.object(states.WaitingDepositState, 'validate_value',
                   return_value=True)
     def test_failed_creating_transfer(self, *args):
@@ -589,13 +747,14 @@ class TestStates(TestBase):
         self.exchanger.request_update(
             stop_status=ExchangeHistory.CREATING_OUTGOING_TRANSFER)
         self.exchanger.refresh_from_db()
+        self.exchanger.request_update(
+            stop_status=ExchangeHistory.OUTGOING_RUNNING)
+        self.submit_transfers(transactions_pb2.ERROR)
         self.exchanger.request_update(
             stop_status=ExchangeHistory.OUTGOING_RUNNING)
         self.assertEqual(self.exchanger.state, states.CreatingOutGoingState)
 
     @patch.object(wallets_service_gw, '_base_request', return_value={})
-    @patch.object(states.CreatingOutGoingState.gw, 'create_transfer',
-                  return_value={"header": {"status": 'SUCCESS'}})
     @patch.object(states.WaitingDepositState, 'validate_value',
                   return_value=True)
     def test_closed_state(self, *args):
@@ -609,6 +768,8 @@ class TestStates(TestBase):
         trx.save()
         self.exchanger.request_update(
             stop_status=ExchangeHistory.CREATING_OUTGOING_TRANSFER)
+        self.exchanger.request_update()
+        self.submit_transfers()
         self.exchanger.refresh_from_db()
         trx_out = self.exchanger.transaction_output
         trx_out.trx_hash = uuid4()
@@ -639,8 +800,6 @@ class TestStates(TestBase):
     @patch.object(wallets_service_gw, '_base_request', return_value={})
     @patch.object(states.WaitingDepositState, 'validate_value',
                   return_value=False)
-    @patch.object(states.CreatingOutGoingState.gw, 'create_transfer',
-                  return_value={"header": {"status": 'SUCCESS'}})
     def test_returning_deposit_state(self, *args):
         self.update_obj(2)
         self.exchanger.status = ExchangeHistory.WAITING_DEPOSIT
@@ -650,6 +809,9 @@ class TestStates(TestBase):
         trx.trx_hash = uuid4()
         trx.status = TransactionBase.CONFIRMED
         trx.save()
+        self.exchanger.request_update(
+            stop_status=ExchangeHistory.RETURNING_DEPOSIT)
+        self.submit_transfers()
         self.exchanger.request_update(
             stop_status=ExchangeHistory.RETURNING_DEPOSIT)
         self.exchanger.refresh_from_db()
@@ -658,8 +820,6 @@ class TestStates(TestBase):
     @patch.object(wallets_service_gw, '_base_request', return_value={})
     @patch.object(states.WaitingDepositState, 'validate_value',
                   return_value=False)
-    @patch.object(states.CreateReturnTransferState.gw, 'create_transfer',
-                  return_value={"header": {"status": 'ERROR'}})
     def test_returning_deposit_state_failed(self, *args):
         self.update_obj(2)
         self.exchanger.status = ExchangeHistory.WAITING_DEPOSIT
@@ -669,6 +829,9 @@ class TestStates(TestBase):
         trx.trx_hash = uuid4()
         trx.status = TransactionBase.CONFIRMED
         trx.save()
+        self.exchanger.request_update(
+            stop_status=ExchangeHistory.RETURNING_DEPOSIT)
+        self.submit_transfers(transactions_pb2.ERROR)
         self.exchanger.request_update(
             stop_status=ExchangeHistory.RETURNING_DEPOSIT)
         self.exchanger.refresh_from_db()
@@ -677,8 +840,6 @@ class TestStates(TestBase):
     @patch.object(wallets_service_gw, '_base_request', return_value={})
     @patch.object(states.WaitingDepositState, 'validate_value',
                   return_value=False)
-    @patch.object(states.CreatingOutGoingState.gw, 'create_transfer',
-                  return_value={"header": {"status": 'SUCCESS'}})
     def test_failed_state(self, *args):
         self.update_obj(2)
         self.exchanger.status = ExchangeHistory.WAITING_DEPOSIT
@@ -690,6 +851,7 @@ class TestStates(TestBase):
         trx.save()
         self.exchanger.request_update(
             stop_status=ExchangeHistory.RETURNING_DEPOSIT)
+        self.submit_transfers()
         self.exchanger.refresh_from_db()
         trx_out = self.exchanger.transaction_output
         trx_out.trx_hash = uuid4()
@@ -703,8 +865,8 @@ class TestStates(TestBase):
     @patch.object(wallets_service_gw, '_base_request', return_value={})
     @patch.object(states.WaitingDepositState, 'validate_value',
                   return_value=True)
-    @patch.object(states.CalculatingState.gw, 'get_currencies',
-                  return_value=rates)
+    @patch.object(states.CalculatingState.gw, 'get_rates',
+                  return_value=rate_table)
     def test_insufficient_payment(self, *args):
         self.update_obj(2)
         self.exchanger.status = ExchangeHistory.DEPOSIT_PAID
@@ -728,8 +890,8 @@ class TestStates(TestBase):
     @patch.object(wallets_service_gw, '_base_request', return_value={})
     @patch.object(states.WaitingDepositState, 'validate_value',
                   return_value=True)
-    @patch.object(states.CalculatingState.gw, 'get_currencies',
-                  return_value=rates)
+    @patch.object(states.CalculatingState.gw, 'get_rates',
+                  return_value=rate_table)
     def test_overpayment(self, *args):
         self.update_obj(2)
         self.exchanger.status = ExchangeHistory.DEPOSIT_PAID
@@ -751,6 +913,245 @@ class TestStates(TestBase):
                                delta=0.01)
 
 
+class TestMailOutbox(TestBase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.email = 'test_email@mail.ru'
+        self.exchanger = ExchangeHistory.objects.create(
+            from_currency=self.btc_wallet.currency,
+            to_currency=self.btc_wallet.currency,
+            ingoing_amount='1',
+            outgoing_amount='0.92',
+            user_email=self.email,
+            from_address=str(uuid4()),
+            to_address=str(uuid4()),
+            fee=settings.DEFAULT_FEE,
+        )
+
+    def test_new_state_mail_is_delivered_out_of_band(self):
+        self.exchanger.request_update(stop_status=ExchangeHistory.NEW)
+        self.assertEqual(0, len(mail.outbox))
+        outbox = MailOutbox.objects.get(exchange_uuid=self.exchanger.uuid)
+        self.assertEqual(MailOutbox.PENDING, outbox.status)
+        self.assertEqual([self.email], outbox.recipient_list)
+
+        self.assertEqual(1, MailOutboxSender().send_batch())
+        outbox.refresh_from_db()
+        self.assertEqual(MailOutbox.SENT, outbox.status)
+        self.assertEqual([self.email], mail.outbox[0].to)
+        self.assertIn(str(self.exchanger.uuid),
+                      mail.outbox[0].alternatives[0][0])
+        self.assertEqual(0, MailOutboxSender().send_batch())
+
+    def test_mail_templates_compiled_once(self):
+        renderer = MailRenderer('exchanger_mail.html', 'exchanger_mail.txt')
+        context = {'protocol': 'https', 'default_host': 'host', 'uuid': 'id'}
+        with patch('exchanger.mail.get_template',
+                   wraps=get_template) as loader:
+            for _ in range(3):
+                html, text = renderer.render(context)
+        self.assertEqual(2, loader.call_count)
+        self.assertIn('https://host/exchanger/id', html)
+        self.assertIn('https://host/exchanger/id', text)
+        self.assertNotIn('<', text)
+
+    def test_outbox_deduplicates_and_retries(self):
+        MailOutbox.enqueue(self.exchanger, MailOutbox.NEW_EXCHANGE_OWNERS,
+                           ['owner@mail.com'], {'uuid': 'uuid', 'email': ''})
+        MailOutbox.enqueue(self.exchanger, MailOutbox.NEW_EXCHANGE_OWNERS,
+                           ['owner@mail.com'], {'uuid': 'uuid', 'email': ''})
+        outbox = MailOutbox.objects.get(exchange_uuid=self.exchanger.uuid)
+        with patch.object(EmailMultiAlternatives, 'send',
+                          side_effect=ConnectionError('mailgun is down')):
+            self.assertEqual(1, MailOutboxSender().send_batch())
+        outbox.refresh_from_db()
+        self.assertEqual(MailOutbox.PENDING, outbox.status)
+        self.assertEqual(1, outbox.attempts)
+        self.assertGreater(outbox.next_attempt_at, datetime.now())
+        self.assertEqual(0, MailOutboxSender().send_batch())
+
+    def test_claimed_mails_are_skipped(self):
+        MailOutbox.enqueue(self.exchanger, MailOutbox.NEW_EXCHANGE_OWNERS,
+                           ['owner@mail.com'], {'uuid': 'uuid', 'email': ''})
+        sender = MailOutboxSender()
+        self.assertEqual(1, len(sender.claim()))
+        self.assertEqual([], MailOutboxSender().claim())
+        self.assertEqual(0, len(mail.outbox))
+
+
+class TestTransferSubmitter(TestBase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.exchanger = ExchangeHistory.objects.create(
+            from_currency=self.btc_wallet.currency,
+            to_currency=self.btc_wallet.currency,
+            ingoing_amount='1',
+            outgoing_amount='0.92',
+            user_email='test_email@mail.ru',
+            from_address=str(uuid4()),
+            to_address=str(uuid4()),
+            fee=settings.DEFAULT_FEE,
+        )
+        self.addCleanup(trx_service_gw.breaker.reset)
+
+    def on_commit(self):
+        return patch('exchanger.transfers.transaction.on_commit',
+                     side_effect=lambda func: func())
+
+    def enqueue(self):
+        return TransferIntent.enqueue(
+            self.exchanger, 1,
+            {'address_from': 'from', 'address_to': 'to',
+             'currency_slug': 'bitcoin', 'value': '1.5',
+             'uuid': str(uuid4())})
+
+    def test_transfer_intents_submitted_in_batch(self):
+        transfer = {'address_from': 'from', 'address_to': 'to',
+                    'currency_slug': 'bitcoin', 'value': '1.5'}
+        uuids = [str(uuid4()) for _ in range(2)]
+        accepted, rejected = [
+            TransferIntent.enqueue(self.exchanger, 1, dict(transfer, uuid=_))
+            for _ in uuids]
+        self.assertEqual(accepted, TransferIntent.enqueue(
+            self.exchanger, 1, dict(transfer, uuid=uuids[0])))
+
+        failed = Mock()
+        failed.result.side_effect = UnavailableError
+        with self.stub_transactions() as client, self.on_commit(), \
+                patch('exchanger.transfers.advance_queue') as queue:
+            rpc = client.return_value.CreateTransfer.future
+            rpc.side_effect = [
+                self.transfer_response(transactions_pb2.SUCCESS), failed]
+            self.assertEqual(2, TransferSubmitter().submit_batch())
+        self.assertEqual(
+            [uuids[0], uuids[1]],
+            [call[0][0].transfer.uuid for call in rpc.call_args_list])
+        queue.return_value.push.assert_called_once_with(self.exchanger.id)
+
+        accepted.refresh_from_db()
+        rejected.refresh_from_db()
+        self.assertEqual(TransferIntent.SUBMITTED, accepted.status)
+        self.assertEqual(TransferIntent.PENDING, rejected.status)
+        self.assertEqual(1, rejected.attempts)
+        self.assertGreater(rejected.next_attempt_at, datetime.now())
+        self.assertEqual(0, TransferSubmitter().submit_batch())
+
+    def test_claimed_intents_are_skipped(self):
+        intent = self.enqueue()
+        submitter = TransferSubmitter()
+
+        def create_transfer(*args, **kwargs):
+            # claimed batch is hidden from other submitters while sent
+            self.assertEqual([], TransferSubmitter().claim())
+            return self.transfer_response(transactions_pb2.SUCCESS)
+
+        with self.stub_transactions() as client, self.on_commit(), \
+                patch('exchanger.transfers.advance_queue'):
+            client.return_value.CreateTransfer.future.side_effect = \
+                create_transfer
+            self.assertEqual(1, submitter.submit_batch())
+        intent.refresh_from_db()
+        self.assertEqual(TransferIntent.SUBMITTED, intent.status)
+
+    def test_failed_transfer_is_looked_up_before_resubmission(self):
+        intent = self.enqueue()
+        TransferIntent.objects.filter(id=intent.id).update(attempts=1)
+        header = {'status': transactions_pb2.SUCCESS}
+        made = transactions_pb2.Transaction(
+            to=intent.address_to, value='1.5', isOutput=True)
+        with self.stub_transactions() as client, self.on_commit(), \
+                patch('exchanger.transfers.advance_queue'):
+            lookup = client.return_value.GetOutPutTransactions
+            rpc = client.return_value.CreateTransfer.future
+            lookup.return_value = transactions_pb2.GetOutPutResponse(
+                header=header)
+            rpc.return_value = self.transfer_response(transactions_pb2.ERROR)
+            self.assertEqual(1, TransferSubmitter().submit_batch())
+            self.assertEqual(1, rpc.call_count)
+
+            TransferIntent.objects.filter(id=intent.id).update(
+                next_attempt_at=datetime.now())
+            lookup.return_value = transactions_pb2.GetOutPutResponse(
+                header=header, transactions=[made])
+            self.assertEqual(1, TransferSubmitter().submit_batch())
+            self.assertEqual(1, rpc.call_count)
+        request = lookup.call_args[0][0]
+        self.assertEqual((intent.wallet_id, intent.address_from),
+                         (request.wallet_id, request.wallet_address))
+        intent.refresh_from_db()
+        self.assertEqual(TransferIntent.SUBMITTED, intent.status)
+        self.assertEqual(3, intent.attempts)
+
+    def test_open_breaker_does_not_spend_attempts(self):
+        intent = self.enqueue()
+        breaker = trx_service_gw.breaker
+        with self.stub_transactions() as client, \
+                patch.object(breaker, 'state', CircuitBreaker.OPEN), \
+                patch.object(breaker, '_opened_at', time.monotonic()):
+            self.assertEqual(1, TransferSubmitter().submit_batch())
+            client.return_value.CreateTransfer.future.assert_not_called()
+        intent.refresh_from_db()
+        self.assertEqual(TransferIntent.PENDING, intent.status)
+        self.assertEqual(0, intent.attempts)
+        self.assertGreater(intent.next_attempt_at, datetime.now())
+
+    def walk_to_outgoing_transfer(self):
+        with patch.object(wallets_service_gw, '_base_request',
+                          return_value={}):
+            self.exchanger.request_update(
+                stop_status=ExchangeHistory.WAITING_HASH)
+        ExchangeHistory.objects.filter(id=self.exchanger.id).update(
+            status=ExchangeHistory.DEPOSIT_PAID)
+        trx = self.exchanger.transaction_input
+        trx.trx_hash = uuid4()
+        trx.status = TransactionBase.CONFIRMED
+        trx.save()
+        self.exchanger.request_update(
+            stop_status=ExchangeHistory.CREATING_OUTGOING_TRANSFER)
+        # transfer is submitted by worker, not by the transition
+        self.exchanger.request_update()
+        self.assertEqual(ExchangeHistory.CREATING_OUTGOING_TRANSFER,
+                         self.exchanger.status)
+        return TransferIntent.objects.get(exchange=self.exchanger)
+
+    def advance_by_worker(self, queue):
+        worker = AdvanceWorker(concurrency=1, source=queue)
+        with patch('exchanger.queues.db.close_old_connections'):
+            worker.advance(queue.pop(timeout=0))
+        self.exchanger.refresh_from_db()
+
+    def test_worker_pays_out_exchange(self):
+        intent = self.walk_to_outgoing_transfer()
+        queue = LocalAdvanceQueue()
+        with self.stub_transactions() as client, self.on_commit(), \
+                patch('exchanger.transfers.advance_queue',
+                      return_value=queue):
+            rpc = client.return_value.CreateTransfer.future
+            rpc.return_value = self.transfer_response(transactions_pb2.SUCCESS)
+            self.assertEqual(1, TransferSubmitter().submit_batch())
+        self.assertEqual(str(intent.uuid), rpc.call_args[0][0].transfer.uuid)
+        self.advance_by_worker(queue)
+        self.assertEqual(ExchangeHistory.OUTGOING_RUNNING,
+                         self.exchanger.status)
+
+    def test_given_up_transfer_fails_exchange(self):
+        intent = self.walk_to_outgoing_transfer()
+        queue = LocalAdvanceQueue()
+        with self.stub_transactions() as client, self.on_commit(), \
+                patch('exchanger.transfers.advance_queue',
+                      return_value=queue), \
+                self.settings(TRANSFER_MAX_ATTEMPTS=1):
+            client.return_value.CreateTransfer.future.return_value = \
+                self.transfer_response(transactions_pb2.INVALID_REQUEST)
+            self.assertEqual(1, TransferSubmitter().submit_batch())
+        intent.refresh_from_db()
+        self.assertEqual(TransferIntent.FAILED, intent.status)
+        self.advance_by_worker(queue)
+        self.assertEqual(ExchangeHistory.FAILED, self.exchanger.status)
+
+
 class TestServerGRPC(TestBase):
 
     def setUp(self) -> None:
@@ -806,3 +1207,952 @@ class TestServerGRPC(TestBase):
         trx.refresh_from_db()
         self.assertEqual(exchanger_pb2.SUCCESS, result.header.status)
         self.assertEqual(trx.value, new_value)
+
+    def test_update_input_trx_batch(self, *args):
+        trx = self.exchanger_object.transaction_input
+        trx.trx_hash = uuid4()
+        trx.save()
+        message = exchanger_pb2.UpdateRequest(
+            transactions=[
+                exchanger_pb2.TransactionData(
+                    uuid=str(trx.uuid),
+                    trx_hash=str(trx.trx_hash),
+                    value=str(trx.value)),
+                exchanger_pb2.TransactionData(
+                    uuid=str(uuid4()),
+                    trx_hash=str(uuid4()),
+                    value='1'),
+            ]
+        )
+        result = ExchangerService().UpdateInputTransaction(
+            message, context_pb2.Context)
+        trx.refresh_from_db()
+        self.assertEqual(exchanger_pb2.SUCCESS, result.header.status)
+        self.assertIn('Updated  1 ', result.header.description)
+        self.assertEqual(TransactionBase.CONFIRMED, trx.status)
+        self.assertIsNotNone(trx.confirmed_at)
+
+    def test_update_schedules_advancement(self, *args):
+        trx = self.exchanger_object.transaction_input
+        service = ExchangerService()
+        queue = LocalAdvanceQueue()
+        with patch('exchanger.gateway.grpc_server.advance_queue',
+                   return_value=queue):
+            service.update_exchanger_objects(
+                [trx, self.exchanger_object.transaction_input])
+        self.assertEqual(1, len(queue))
+        self.assertEqual(self.exchanger_object.id, queue.pop())
+
+    def test_failed_push_does_not_fail_committed_update(self, *args):
+        trx = self.exchanger_object.transaction_input
+        trx.trx_hash = uuid4()
+        trx.save()
+        message = exchanger_pb2.UpdateRequest(
+            transactions=[exchanger_pb2.TransactionData(
+                uuid=str(trx.uuid),
+                trx_hash=str(trx.trx_hash),
+                value=str(trx.value))])
+        with patch('exchanger.gateway.grpc_server.advance_queue') as queue, \
+                self.settings(TEST_MODE=False):
+            queue.return_value.push.side_effect = ConnectionError
+            result = ExchangerService().UpdateInputTransaction(
+                message, context_pb2.Context)
+        queue.return_value.push.assert_called_once_with(
+            self.exchanger_object.id)
+        self.assertEqual(exchanger_pb2.SUCCESS, result.header.status)
+        trx.refresh_from_db()
+        self.assertEqual(TransactionBase.CONFIRMED, trx.status)
+
+    def test_callback_runs_under_rpc_deadline(self):
+        budgets = []
+        context = Mock(time_remaining=Mock(return_value=3))
+
+        def execute(request, ingoing=False):
+            budgets.append(exchanger_deadline.remaining())
+            return 0
+
+        with patch.object(ExchangerService, '_execute', side_effect=execute):
+            ExchangerService().UpdateInputTransaction(
+                exchanger_pb2.UpdateRequest(), context)
+            ExchangerService().UpdateOutputTransaction(
+                exchanger_pb2.UpdateRequest(), context_pb2.Context)
+        self.assertLessEqual(budgets[0], 3)
+        self.assertGreater(budgets[0], 2)
+        self.assertGreater(budgets[1], 3)
+        self.assertIsNone(exchanger_deadline.current())
+
+
+class TestServerGRPCConcurrency(TransactionTestCase):
+    requests_count = 300
+
+    @skipUnless(connection.vendor == 'postgresql', 'concurrent writes')
+    def test_parallel_updates_get_own_responses(self):
+        currency = Currency.objects.create(name='Bitcoin', slug='bitcoin')
+        sizes = [i % 7 + 1 for i in range(self.requests_count)]
+        InputTransaction.objects.bulk_create(
+            InputTransaction(value=1, to_address='to', from_address='from',
+                             currency=currency)
+            for _ in range(sum(sizes)))
+        uuids = iter(InputTransaction.objects.values_list('uuid', flat=True))
+        requests = [
+            (size, exchanger_pb2.UpdateRequest(
+                transactions=[exchanger_pb2.TransactionData(
+                    uuid=str(next(uuids)), trx_hash=str(uuid4()), value='2')
+                    for _ in range(size)]))
+            for size in sizes]
+        service = ExchangerService()
+
+        def call(size_request):
+            size, request = size_request
+            try:
+                return size, service.UpdateInputTransaction(
+                    request, context_pb2.Context)
+            finally:
+                db.connection.close()
+
+        with futures.ThreadPoolExecutor(max_workers=20) as pool:
+            results = list(pool.map(call, requests))
+
+        self.assertEqual(self.requests_count, len(results))
+        for size, result in results:
+            self.assertEqual(exchanger_pb2.SUCCESS, result.header.status)
+            self.assertEqual(
+                f'Updated  {size} of InputTransaction objects',
+                result.header.description)
+        self.assertEqual(sum(sizes), InputTransaction.objects.filter(
+            status=TransactionBase.CONFIRMED, value=2).count())
+
+    @skipUnless(connection.vendor == 'postgresql', 'row locks')
+    def test_duplicate_callbacks_confirm_once(self):
+        currency = Currency.objects.create(name='Bitcoin', slug='bitcoin')
+        trx = InputTransaction.objects.create(
+            value=1, to_address='to', from_address='from', currency=currency)
+        request = exchanger_pb2.UpdateRequest(
+            transactions=[exchanger_pb2.TransactionData(
+                uuid=str(trx.uuid), trx_hash=str(uuid4()), value='1')])
+        service = ExchangerService()
+        barrier = threading.Barrier(2)
+
+        def call(_):
+            try:
+                barrier.wait()
+                return service.UpdateInputTransaction(
+                    request, context_pb2.Context)
+            finally:
+                db.connection.close()
+
+        with futures.ThreadPoolExecutor(max_workers=2) as pool:
+            results = list(pool.map(call, range(2)))
+
+        self.assertEqual(
+            ['Updated  0 of InputTransaction objects',
+             'Updated  1 of InputTransaction objects'],
+            sorted(result.header.description for result in results))
+
+    def test_async_server_round_trip(self):
+        currency = Currency.objects.create(name='Bitcoin', slug='bitcoin')
+        trx = InputTransaction.objects.create(
+            value=1, to_address='to', from_address='from', currency=currency)
+        request = exchanger_pb2.UpdateRequest(
+            transactions=[exchanger_pb2.TransactionData(
+                uuid=str(trx.uuid), trx_hash=str(uuid4()), value='2')])
+        with socket.socket() as sock:
+            sock.bind(('localhost', 0))
+            port = sock.getsockname()[1]
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+
+        async def call():
+            from grpc import aio
+            async with aio.insecure_channel(f'localhost:{port}') as channel:
+                await channel.channel_ready()
+                stub = exchanger_pb2_grpc.ExchangerServiceStub(channel)
+                return await stub.UpdateInputTransaction(request, timeout=5)
+
+        with override_settings(GRPC_SERVER_PORT=str(port)):
+            server = loop.create_task(serve_async(max_workers=2))
+            try:
+                result = loop.run_until_complete(
+                    asyncio.wait_for(call(), timeout=10))
+            finally:
+                server.cancel()
+                loop.run_until_complete(
+                    asyncio.gather(server, return_exceptions=True))
+                loop.close()
+                asyncio.set_event_loop(asyncio.new_event_loop())
+
+        self.assertEqual(exchanger_pb2.SUCCESS, result.header.status)
+        self.assertEqual('Updated  1 of InputTransaction objects',
+                         result.header.description)
+        trx.refresh_from_db()
+        self.assertEqual(TransactionBase.CONFIRMED, trx.status)
+
+
+class TestAdvanceQueue(TestCase):
+
+    def test_push_deduplicates_waiting_ids(self):
+        queue = LocalAdvanceQueue()
+        self.assertEqual(2, queue.push(1, 2, 1))
+        self.assertEqual(0, queue.push(2))
+        self.assertEqual(1, queue.pop(timeout=0))
+        self.assertEqual(1, queue.push(1))
+        self.assertEqual(2, len(queue))
+
+    def test_worker_advances_exchange(self):
+        queue = LocalAdvanceQueue()
+        worker = AdvanceWorker(concurrency=1, source=queue)
+        with patch.object(ExchangeHistory, 'request_update') as update, \
+                patch.object(ExchangeHistory.objects, 'filter') as query:
+            query.return_value.first.return_value = ExchangeHistory()
+            worker.advance(1)
+        update.assert_called_once()
+
+    def test_redis_queue_requeues_only_dead_workers(self):
+        name = f'test-{uuid4().hex}'
+        live = RedisAdvanceQueue(name, worker_id='live')
+        dead = RedisAdvanceQueue(name, worker_id='dead')
+        redis = connect_redis()
+        self.addCleanup(
+            redis.delete, live.key, live.pending_key, live.workers_key,
+            live.processing_key, dead.processing_key,
+            live.lease_key_of('live'), live.lease_key_of('dead'))
+
+        self.assertEqual(2, live.push(1, 2, 1))
+        live.heartbeat()
+        dead.heartbeat()
+        self.assertEqual(1, live.pop(timeout=1))
+        self.assertEqual(2, dead.pop(timeout=1))
+        self.assertEqual(0, live.requeue_processing())
+
+        redis.delete(live.lease_key_of('dead'))
+        self.assertEqual(1, live.requeue_processing())
+        # back in pending set, so it is not pushed twice
+        self.assertEqual(0, live.push(2))
+        self.assertEqual(2, live.pop(timeout=1))
+        # in flight id of live worker stays where it is
+        self.assertEqual([b'2', b'1'], redis.lrange(live.processing_key, 0, -1))
+
+    def test_local_backend_is_drained_in_process(self):
+        advanced = threading.Event()
+        with self.settings(ADVANCE_QUEUE_BACKEND='local'), \
+                patch('exchanger.queues._advance_queue', None), \
+                patch.object(AdvanceWorker, 'advance',
+                             side_effect=lambda _id: advanced.set()):
+            advance_queue().push(1)
+            self.assertTrue(advanced.wait(2))
+
+
+class TestExchangeHistoryList(TestBase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        for i in range(5):
+            ExchangeHistory.objects.create(
+                from_currency=self.btc_wallet.currency,
+                to_currency=self.eth_wallet.currency,
+                ingoing_amount=1,
+                outgoing_amount=0.92,
+                from_address=uuid4(),
+                to_address=uuid4(),
+                user_email=f'user{i % 2}@mail.com',
+                fee=settings.DEFAULT_FEE,
+            )
+        self.client.force_authenticate(User.objects.create(username='admin'))
+
+    def test_anonymous(self):
+        self.client.force_authenticate(None)
+        resp = self.client.get('/api/exchange/')
+        self.assertEqual(405, resp.status_code)
+
+    def test_cursor_pages(self):
+        seen = []
+        url = '/api/exchange/?page_size=2'
+        while url:
+            resp = self.client.get(url)
+            self.assertEqual(200, resp.status_code)
+            self.assertLessEqual(len(resp.json()['results']), 2)
+            seen.extend(row['uuid'] for row in resp.json()['results'])
+            url = resp.json()['next']
+        expected = ExchangeHistory.objects.order_by(
+            '-id').values_list('uuid', flat=True)
+        self.assertEqual([str(_uuid) for _uuid in expected], seen)
+
+    def test_filters(self):
+        resp = self.client.get('/api/exchange/',
+                               {'email': 'user0@mail.com'})
+        self.assertEqual(3, len(resp.json()['results']))
+        resp = self.client.get('/api/exchange/', {'currency': 'ethereum'})
+        self.assertEqual(5, len(resp.json()['results']))
+        resp = self.client.get('/api/exchange/', {'currency': 'holo'})
+        self.assertEqual(0, len(resp.json()['results']))
+        resp = self.client.get('/api/exchange/',
+                               {'status': ExchangeHistory.CLOSED})
+        self.assertEqual(0, len(resp.json()['results']))
+        resp = self.client.get('/api/exchange/', {'status': 100})
+        self.assertEqual(400, resp.status_code)
+
+    def test_stream(self):
+        resp = self.client.get('/api/exchange/',
+                               {'stream': True, 'email': 'user1@mail.com'})
+        self.assertEqual(200, resp.status_code)
+        data = json.loads(b''.join(resp.streaming_content))
+        self.assertEqual(2, len(data))
+
+    def test_export_csv(self):
+        resp = self.client.get('/api/export/exchanges/',
+                               {'status': ExchangeHistory.UNKNOWN})
+        self.assertEqual(200, resp.status_code)
+        lines = b''.join(resp.streaming_content).decode().splitlines()
+        self.assertEqual(6, len(lines))
+        self.assertTrue(lines[0].startswith('uuid,created_at'))
+
+    def test_export_ndjson(self):
+        resp = self.client.get('/api/export/exchanges/', {'fmt': 'ndjson'})
+        self.assertEqual(200, resp.status_code)
+        rows = [json.loads(line) for line in
+                b''.join(resp.streaming_content).decode().splitlines()]
+        self.assertEqual(5, len(rows))
+        self.assertEqual('bitcoin', rows[0]['from_currency__slug'])
+        resp = self.client.get('/api/export/input_transactions/',
+                               {'fmt': 'ndjson'})
+        self.assertEqual(200, resp.status_code)
+        self.assertEqual(b'', b''.join(resp.streaming_content))
+
+    def test_export_requires_auth(self):
+        self.client.force_authenticate(None)
+        resp = self.client.get('/api/export/exchanges/')
+        self.assertIn(resp.status_code, (401, 403))
+
+
+class TestExchangeScheduler(TestBase):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.exchange = ExchangeHistory.objects.create(
+            from_currency=self.btc_wallet.currency,
+            to_currency=self.eth_wallet.currency,
+            ingoing_amount=1,
+            outgoing_amount=0.92,
+            from_address=uuid4(),
+            to_address=uuid4(),
+            user_email='test@mail.com',
+            fee=settings.DEFAULT_FEE,
+        )
+        self.scheduler = ExchangeScheduler(concurrency=1)
+
+    def set_status(self, status, age):
+        ExchangeHistory.objects.filter(id=self.exchange.id).update(
+            status=status, updated_at=datetime.now() - timedelta(seconds=age))
+        self.exchange.refresh_from_db()
+
+    def test_due_exchanges(self):
+        self.set_status(ExchangeHistory.WAITING_DEPOSIT, 3600)
+        self.assertEqual([self.exchange], self.scheduler.due())
+        self.set_status(ExchangeHistory.WAITING_DEPOSIT, 0)
+        self.assertEqual([], self.scheduler.due())
+        self.set_status(ExchangeHistory.CLOSED, 3600)
+        self.assertEqual([], self.scheduler.due())
+        self.set_status(ExchangeHistory.UNKNOWN, 3600)
+        self.assertEqual([], self.scheduler.due())
+
+    def test_idle_exchange_is_backed_off(self):
+        self.set_status(ExchangeHistory.WAITING_DEPOSIT, 3600)
+        with patch.object(ExchangeHistory, 'request_update',
+                          return_value=True):
+            self.assertEqual('idle', self.scheduler.advance(self.exchange))
+        self.assertEqual([], self.scheduler.due())
+        # backoff is kept in DB, so restarted scheduler honours it too
+        self.assertEqual([], ExchangeScheduler(concurrency=1).due())
+        self.exchange.refresh_from_db()
+        self.assertEqual(1, self.exchange.sweep_attempts)
+        ExchangeHistory.objects.filter(id=self.exchange.id).update(
+            next_sweep_at=datetime.now())
+        self.assertEqual([self.exchange], self.scheduler.due())
+
+    def test_advanced_exchange_is_not_backed_off(self):
+        self.set_status(ExchangeHistory.WAITING_DEPOSIT, 3600)
+
+        def advance(*args, **kwargs):
+            self.exchange.status = ExchangeHistory.DEPOSIT_PAID
+            return True
+
+        with patch.object(ExchangeHistory, 'request_update',
+                          side_effect=advance):
+            self.assertEqual('advanced', self.scheduler.advance(self.exchange))
+        self.set_status(ExchangeHistory.DEPOSIT_PAID, 3600)
+        self.assertEqual([self.exchange], self.scheduler.due())
+
+
+@skipUnless(connection.vendor == 'postgresql', 'partial indexes')
+class TestPartialIndexes(TestBase):
+    """Hot queries must stay on partial indexes as history tables grow."""
+
+    def explain(self, query):
+        with connection.cursor() as cursor:
+            # tables of test database are tiny, make planner prefer indexes
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        return query.explain()
+
+    def test_final_statutes_match_index(self):
+        self.assertEqual((ExchangeHistory.CLOSED,
+                          ExchangeHistory.FAILED,
+                          ExchangeHistory.DEPOSIT_RETURNED),
+                         ExchangeHistory.FINAL_STATUTES)
+        index = next(index for index in ExchangeHistory._meta.indexes
+                     if index.name == 'exchange_active_status_idx')
+        negated = index.condition.children[1]
+        self.assertEqual(list(ExchangeHistory.FINAL_STATUTES),
+                         negated.children[0][1])
+
+    def test_scheduler_query(self):
+        query = ExchangeHistory.objects.filter(
+            status=ExchangeHistory.WAITING_DEPOSIT,
+            updated_at__lte=datetime.now(),
+        ).exclude(
+            status__in=ExchangeHistory.FINAL_STATUTES
+        ).order_by('updated_at')
+        self.assertIn('exchange_active_status_idx', self.explain(query))
+
+    def unique_index(self, model, column):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(
+                cursor, model._meta.db_table)
+        return next(name for name, c in constraints.items()
+                    if c['unique'] and c['columns'] == [column])
+
+    def test_active_transactions_query(self):
+        query = InputTransaction.objects.filter(
+            uuid__in=[uuid4(), uuid4()],
+            status__in=InputTransaction.ACTIVE_STATUTES)
+        self.assertIn(self.unique_index(InputTransaction, 'uuid'),
+                      self.explain(query))
+
+
+class TestAddressValidation(TestCase):
+
+    def setUp(self) -> None:
+        bgw_service_gw.address_cache.clear()
+
+    def tearDown(self) -> None:
+        bgw_service_gw.address_cache.clear()
+
+    def test_lru_ttl(self):
+        cache = AddressCache(maxsize=2, ttl=10)
+        cache.set(('bitcoin', 'a'), {'isinstance': True})
+        cache.set(('bitcoin', 'b'), {'isinstance': True})
+        cache.get(('bitcoin', 'a'))
+        cache.set(('bitcoin', 'c'), {'isinstance': True})
+        self.assertIsNone(cache.get(('bitcoin', 'b')))
+        self.assertIsNotNone(cache.get(('bitcoin', 'a')))
+        self.assertEqual(2, len(cache))
+        expired = AddressCache(maxsize=2, ttl=0)
+        expired.set(('bitcoin', 'a'), {'isinstance': True})
+        self.assertIsNone(expired.get(('bitcoin', 'a')))
+
+    def test_check_addresses(self):
+        def check(address, currency_slug):
+            return {'isinstance': address != 'bad'}
+
+        pairs = [('from', 'bitcoin'), ('bad', 'ethereum')]
+        with patch.object(bgw_service_gw, 'check_address',
+                          side_effect=check) as check_address:
+            result = bgw_service_gw.check_addresses(pairs)
+            self.assertEqual(2, check_address.call_count)
+            self.assertTrue(result[('from', 'bitcoin')]['isinstance'])
+            self.assertFalse(result[('bad', 'ethereum')]['isinstance'])
+
+            bgw_service_gw.check_addresses(pairs)
+            # valid address is cached, invalid is checked again
+            self.assertEqual(3, check_address.call_count)
+            check_address.assert_called_with('bad', 'ethereum')
+
+
+class TestFanOut(TestCase):
+
+    @staticmethod
+    def slow(value, delay=0.2):
+        def call():
+            time.sleep(delay)
+            return value
+        return call
+
+    def test_calls_run_concurrently(self):
+        started = time.perf_counter()
+        result = fan_out({'a': self.slow(1), 'b': self.slow(2)}, timeout=1)
+        self.assertEqual({'a': 1, 'b': 2}, result)
+        self.assertLess(time.perf_counter() - started, 0.35)
+
+    def test_first_failure_is_raised(self):
+        def fail():
+            raise ValueError('bad address')
+
+        started = time.perf_counter()
+        with self.assertRaises(ValueError):
+            fan_out({'slow': self.slow(1, delay=1), 'fail': fail}, timeout=2)
+        self.assertLess(time.perf_counter() - started, 0.5)
+
+    def test_deadline(self):
+        with self.assertRaises(TimeoutError):
+            fan_out({'slow': self.slow(1, delay=0.5)}, timeout=0.1)
+
+
+class UnavailableError(grpc.RpcError):
+
+    def code(self):
+        return grpc.StatusCode.UNAVAILABLE
+
+
+class TestGatewayDeadline(TestCase):
+
+    def tearDown(self) -> None:
+        bgw_service_gw.breaker.reset()
+        trx_service_gw.breaker.reset()
+
+    def stub(self, gateway):
+        client = Mock()
+        return patch.object(type(gateway), 'client',
+                            new_callable=PropertyMock, return_value=client)
+
+    def test_idempotent_call_is_retried(self):
+        with self.stub(bgw_service_gw) as client, \
+                self.settings(GRPC_RETRY_BACKOFF=0):
+            client.return_value.CheckAddress.side_effect = UnavailableError
+            with self.assertRaises(UnavailableError):
+                bgw_service_gw.check_address('address', 'bitcoin')
+        self.assertEqual(settings.REMOTE_OPERATION_ATTEMPT_NUMBER,
+                         client.return_value.CheckAddress.call_count)
+        _, kwargs = client.return_value.CheckAddress.call_args
+        self.assertEqual(settings.GRPC_METHOD_TIMEOUTS['CheckAddress'],
+                         kwargs['timeout'])
+
+    def test_transfer_is_not_retried(self):
+        with self.stub(trx_service_gw) as client:
+            client.return_value.CreateTransfer.side_effect = UnavailableError
+            with self.assertRaises(UnavailableError):
+                trx_service_gw.create_transfer(
+                    'from', 'to', 'bitcoin', Decimal('1'), 1, uuid4())
+        self.assertEqual(1, client.return_value.CreateTransfer.call_count)
+
+    def test_call_is_bounded_by_deadline(self):
+        with self.stub(bgw_service_gw) as client:
+            client.return_value.CheckAddress.side_effect = UnavailableError
+            with deadline(0.5), self.assertRaises(UnavailableError):
+                bgw_service_gw.check_address('address', 'bitcoin')
+            _, kwargs = client.return_value.CheckAddress.call_args
+            self.assertLessEqual(kwargs['timeout'], 0.5)
+
+            client.return_value.CheckAddress.reset_mock()
+            with deadline(0), self.assertRaises(DeadlineExceeded):
+                bgw_service_gw.check_address('address', 'bitcoin')
+            client.return_value.CheckAddress.assert_not_called()
+
+    def test_get_transaction_does_not_change_gateway(self):
+        statutes = bgw_service_gw.ALLOWED_STATUTES
+        response = blockchain_gateway_pb2.GetTransactionResponse(
+            status={'status': blockchain_gateway_pb2.PENDING},
+            transaction={'hash': 'hash', 'currencySlug': 'bitcoin'})
+        with self.stub(bgw_service_gw) as client:
+            client.return_value.GetTransaction.return_value = response
+            for _ in range(2):
+                bgw_service_gw.get_transaction('hash', 'bitcoin', 'to', None)
+        self.assertEqual(statutes, bgw_service_gw.ALLOWED_STATUTES)
+        self.assertEqual((blockchain_gateway_pb2.SUCCESS,),
+                         bgw_service_gw.policy('CheckAddress').allowed_statuses)
+
+    def test_bad_response_is_not_retried(self):
+        response = blockchain_gateway_pb2.CheckAddressResponse(
+            status={'status': blockchain_gateway_pb2.PENDING})
+        with self.stub(bgw_service_gw) as client:
+            client.return_value.CheckAddress.return_value = response
+            with self.assertRaises(bgw_service_gw.EXC_CLASS):
+                bgw_service_gw.check_address('address', 'bitcoin')
+        self.assertEqual(1, client.return_value.CheckAddress.call_count)
+
+    def test_policy(self):
+        policy = trx_service_gw.policy('CreateTransfer', attempts=5)
+        self.assertEqual(1, policy.attempts)
+        self.assertFalse(policy.should_retry(
+            1, grpc.StatusCode.UNAVAILABLE))
+        policy = bgw_service_gw.policy('CheckAddress', max_backoff=0.5)
+        self.assertTrue(policy.should_retry(1, grpc.StatusCode.UNAVAILABLE))
+        self.assertFalse(policy.should_retry(
+            1, grpc.StatusCode.INVALID_ARGUMENT))
+        self.assertLessEqual(policy.delay(10), 0.5)
+        with self.assertRaises(AttributeError):
+            policy.attempts = 10
+
+
+class TestCoalescingCaller(TestCase):
+
+    def test_calls_are_sent_together_and_resolved_separately(self):
+        success = wallets_pb2.InputTransactionResponse(
+            header={'status': wallets_pb2.SUCCESS})
+        failed = Mock()
+        failed.result.side_effect = UnavailableError
+        caller = CoalescingCaller(wallets_service_gw, 'AddInputTransaction',
+                                  max_batch=3, max_delay=1)
+        self.addCleanup(wallets_service_gw.breaker.reset)
+        with patch.object(type(wallets_service_gw), 'client',
+                          new_callable=PropertyMock) as client:
+            rpc = client.return_value.AddInputTransaction.future
+            rpc.side_effect = [Mock(result=Mock(return_value=success)),
+                               failed,
+                               Mock(result=Mock(return_value=success))]
+            futures = [caller.submit(wallets_pb2.InputTransactionRequest(
+                uuid=str(i))) for i in range(3)]
+            self.assertEqual({'header': {'status': 'SUCCESS'}},
+                             futures[0].result(timeout=1))
+            with self.assertRaises(UnavailableError):
+                futures[1].result(timeout=1)
+            self.assertEqual({'header': {'status': 'SUCCESS'}},
+                             futures[2].result(timeout=1))
+        # max_batch reached long before max_delay
+        self.assertEqual(3, rpc.call_count)
+
+    def stub(self):
+        self.addCleanup(wallets_service_gw.breaker.reset)
+        return patch.object(type(wallets_service_gw), 'client',
+                            new_callable=PropertyMock)
+
+    def test_idempotent_calls_are_retried(self):
+        success = wallets_pb2.PlatformWLTMonitoringResponse(
+            header={'status': wallets_pb2.SUCCESS})
+        failed = Mock()
+        failed.result.side_effect = UnavailableError
+        caller = CoalescingCaller(wallets_service_gw,
+                                  'StartMonitoringPlatformWallet',
+                                  max_batch=2, max_delay=0)
+        with self.stub() as client, self.settings(GRPC_RETRY_BACKOFF=0):
+            rpc = client.return_value.StartMonitoringPlatformWallet.future
+            rpc.side_effect = [failed,
+                               Mock(result=Mock(return_value=success)),
+                               Mock(result=Mock(return_value=success))]
+            futures = caller.call_many(
+                wallets_pb2.PlatformWLTMonitoringRequest(uuid=str(i))
+                for i in range(2))
+        self.assertEqual([{'header': {'status': 'SUCCESS'}}] * 2,
+                         [future.result() for future in futures])
+        self.assertEqual('0', rpc.call_args[0][0].uuid)
+
+    def test_calls_are_bounded_by_caller_deadline(self):
+        caller = CoalescingCaller(wallets_service_gw, 'AddInputTransaction',
+                                  max_batch=1, max_delay=0)
+        with self.stub() as client:
+            rpc = client.return_value.AddInputTransaction.future
+            with deadline(0.5):
+                caller.call_many([wallets_pb2.InputTransactionRequest()])
+            self.assertLessEqual(rpc.call_args[1]['timeout'], 0.5)
+            with deadline(0):
+                future, = caller.call_many(
+                    [wallets_pb2.InputTransactionRequest()])
+            self.assertEqual(1, rpc.call_count)
+        with self.assertRaises(DeadlineExceeded):
+            future.result()
+
+        with patch.object(caller, 'send',
+                          side_effect=lambda batch: time.sleep(0.5)):
+            with deadline(0.05), self.assertRaises(DeadlineExceeded):
+                caller.call(wallets_pb2.InputTransactionRequest())
+
+    def test_slow_batch_does_not_hold_others(self):
+        success = wallets_pb2.InputTransactionResponse(
+            header={'status': wallets_pb2.SUCCESS})
+        released = threading.Event()
+        slow = Mock()
+        slow.result.side_effect = lambda: released.wait(1) and success
+        caller = CoalescingCaller(wallets_service_gw, 'AddInputTransaction',
+                                  max_batch=1, max_delay=0, senders=2)
+        with self.stub() as client:
+            rpc = client.return_value.AddInputTransaction.future
+            rpc.side_effect = lambda request, timeout: (
+                slow if request.uuid == 'slow'
+                else Mock(result=Mock(return_value=success)))
+            first, second = [caller.submit(
+                wallets_pb2.InputTransactionRequest(uuid=uuid))
+                for uuid in ('slow', 'fast')]
+            self.assertEqual({'header': {'status': 'SUCCESS'}},
+                             second.result(timeout=1))
+            self.assertFalse(first.done())
+            released.set()
+            self.assertEqual({'header': {'status': 'SUCCESS'}},
+                             first.result(timeout=1))
+
+    def test_half_open_breaker_lets_one_call_of_batch(self):
+        failed = Mock()
+        failed.result.side_effect = UnavailableError
+        caller = CoalescingCaller(wallets_service_gw, 'AddInputTransaction',
+                                  max_batch=3, max_delay=0)
+        with self.stub() as client, \
+                patch.object(wallets_service_gw.breaker, 'state',
+                             CircuitBreaker.HALF_OPEN):
+            rpc = client.return_value.AddInputTransaction.future
+            rpc.return_value = failed
+            futures = caller.call_many(
+                wallets_pb2.InputTransactionRequest() for _ in range(3))
+        self.assertEqual(1, rpc.call_count)
+        with self.assertRaises(UnavailableError):
+            futures[0].result()
+        for future in futures[1:]:
+            with self.assertRaises(CircuitOpenError):
+                future.result()
+
+
+class TestCircuitBreaker(TestCase):
+
+    def setUp(self) -> None:
+        self.breaker = CircuitBreaker(
+            'test', window=30, min_calls=4, failure_rate=0.5,
+            slow_call_seconds=1, open_seconds=0.2)
+
+    def test_opens_on_failure_rate(self):
+        for success in (True, False, True):
+            self.breaker.before_call()
+            self.breaker.record(success, 0.01)
+        self.assertEqual(CircuitBreaker.CLOSED, self.breaker.state)
+        self.breaker.record(False, 0.01)
+        self.assertEqual(CircuitBreaker.OPEN, self.breaker.state)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+    def test_slow_calls_count_as_failed(self):
+        for _ in range(4):
+            self.breaker.record(True, 2)
+        self.assertEqual(CircuitBreaker.OPEN, self.breaker.state)
+
+    def test_half_open_probe(self):
+        for _ in range(4):
+            self.breaker.record(False, 0.01)
+        time.sleep(0.2)
+        self.breaker.before_call()
+        self.assertEqual(CircuitBreaker.HALF_OPEN, self.breaker.state)
+        # only one probe at a time
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+        self.breaker.record(False, 0.01)
+        self.assertEqual(CircuitBreaker.OPEN, self.breaker.state)
+
+        time.sleep(0.2)
+        self.breaker.before_call()
+        self.breaker.record(True, 0.01)
+        self.assertEqual(CircuitBreaker.CLOSED, self.breaker.state)
+        self.breaker.before_call()
+
+    def test_open_breaker_fails_fast(self):
+        breaker = bgw_service_gw.breaker
+        self.addCleanup(breaker.reset)
+        with patch.object(type(bgw_service_gw), 'client',
+                          new_callable=PropertyMock) as client, \
+                patch.object(breaker, 'state', CircuitBreaker.OPEN), \
+                patch.object(breaker, '_opened_at', time.monotonic()):
+            with self.assertRaises(CircuitOpenError):
+                bgw_service_gw.check_address('address', 'bitcoin')
+            client.return_value.CheckAddress.assert_not_called()
+
+
+class TestChannelPool(TestCase):
+
+    address = 'localhost:50051'
+
+    def setUp(self) -> None:
+        self.pool = ChannelPool()
+
+    def tearDown(self) -> None:
+        self.pool.close()
+
+    def test_stub_is_reused(self):
+        stub = self.pool.get_stub(self.address,
+                                  currencies_pb2_grpc.CurrenciesServiceStub)
+        self.assertIs(stub, self.pool.get_stub(
+            self.address, currencies_pb2_grpc.CurrenciesServiceStub))
+        self.assertEqual(1, self.pool.stats()[self.address]['stubs'])
+
+    def test_channels_recreated_after_fork(self):
+        channel = self.pool.get_channel(self.address)
+        with patch('exchanger.gateway.pool.os.getpid', return_value=-1):
+            self.assertIsNot(channel, self.pool.get_channel(self.address))
+
+    def test_reset(self):
+        channel = self.pool.get_channel(self.address)
+        self.pool.reset(self.address)
+        self.assertNotIn(self.address, self.pool.stats())
+        self.assertIsNot(channel, self.pool.get_channel(self.address))
+
+    def test_not_ready_channel_is_closed_after_grace(self):
+        pool = ChannelPool(health_check_timeout=0.01,
+                           health_check_interval=0, close_grace=0.2)
+        self.addCleanup(pool.close)
+        channel = pool.get_channel(self.address)
+        with patch.object(channel, 'close', wraps=channel.close) as close:
+            self.assertFalse(pool.health_check(self.address))
+            self.assertIsNot(channel, pool.get_channel(self.address))
+            close.assert_not_called()
+            time.sleep(0.4)
+        close.assert_called_once_with()
+
+    def test_channels_checked_periodically(self):
+        pool = ChannelPool(health_check_timeout=0.01,
+                           health_check_interval=0.05)
+        self.addCleanup(pool.close)
+        with patch.object(pool, 'check_all', wraps=pool.check_all) as check:
+            pool.get_channel(self.address)
+            time.sleep(0.3)
+        self.assertGreater(check.call_count, 1)
+        self.assertTrue(pool._checker.is_alive())
+
+
+@patch.object(RatesCache, '_shared_set')
+@patch.object(RatesCache, '_shared_get', return_value=None)
+class TestRatesCache(TestCase):
+
+    def setUp(self) -> None:
+        self.calls = 0
+        self.cache = RatesCache('test', self.fetch, ttl=10, stale_ttl=50)
+
+    def fetch(self):
+        self.calls += 1
+        return rates
+
+    def make_old(self, seconds):
+        self.cache._local.fetched_at -= seconds
+
+    def test_fresh_value_is_not_refetched(self, *args):
+        self.assertEqual(rates, self.cache.get())
+        self.assertEqual(rates, self.cache.get())
+        self.assertEqual(1, self.calls)
+
+    def test_stale_value_is_served_and_revalidated(self, *args):
+        self.cache.get()
+        self.make_old(20)
+        with patch.object(RatesCache, '_refresh_async') as refresh:
+            self.assertEqual(rates, self.cache.get())
+        refresh.assert_called_once()
+        self.assertEqual(1, self.calls)
+
+    def test_expired_value_is_refetched(self, *args):
+        self.cache.get()
+        self.make_old(61)
+        self.cache.get()
+        self.assertEqual(2, self.calls)
+
+    def test_max_age_bounds_staleness(self, *args):
+        self.cache.get()
+        self.make_old(20)
+        self.cache.get(max_age=15)
+        self.assertEqual(2, self.calls)
+
+
+class TestRateTable(TestCase):
+
+    def test_rates_are_parsed_once(self):
+        self.assertEqual(Decimal('9183.84000000'), rate_table['bitcoin'])
+        self.assertIn('ethereum', rate_table)
+        self.assertEqual(len(rates), len(rate_table))
+
+    def test_convert(self):
+        self.assertEqual(
+            Decimal('2') * Decimal('9183.84') / Decimal('240.36'),
+            rate_table.convert(Decimal('2'), 'bitcoin', 'ethereum'))
+        self.assertEqual(Decimal('240.36'),
+                         rate_table.to_usd(Decimal('1'), 'ethereum'))
+
+    def test_immutable(self):
+        with self.assertRaises(AttributeError):
+            rate_table.version = 'changed'
+        with self.assertRaises(TypeError):
+            rate_table.currencies[0]['rate'] = '0'
+
+    def test_version_depends_on_rates(self):
+        self.assertEqual(rate_table.version,
+                         RateTable.from_currencies(rates).version)
+        changed = [dict(rates[0], rate='1')] + rates[1:]
+        self.assertNotEqual(rate_table.version,
+                            RateTable.from_currencies(changed).version)
+
+    def test_built_from_raw_response(self):
+        response = currencies_pb2_grpc.currencies__pb2.CurrenciesResponse(
+            header={'status': currencies_pb2_grpc.currencies__pb2.SUCCESS})
+        response.currencies.add(id=1, slug='bitcoin', rate='9183.84')
+        response.currencies[0].coefficients.add(
+            days=30, collateral_coefficient='1.5')
+        gw = states.CalculatingState.gw
+        with patch.object(gw, '_base_request',
+                          return_value=response) as request:
+            currencies = gw._fetch_currencies()
+        self.assertTrue(request.call_args[1]['raw'])
+        self.assertEqual(Decimal('9183.84'),
+                         RateTable.from_currencies(currencies)['bitcoin'])
+        self.assertEqual(1.5,
+                         currencies[0]['coefficients'][0]['collateral_coefficient'])
+        json.dumps(currencies)
+
+        response.currencies.add(id=2, slug='ethereum')
+        with patch.object(gw, '_base_request', return_value=response), \
+                self.assertRaises(CurrenciesBadResponseException):
+            gw._fetch_currencies()
+
+
+class TestStateRegistry(TestCase):
+
+    def test_lookup_by_status(self):
+        self.assertEqual(states.WaitingDepositState, states.state_by_status(
+            ExchangeHistory.WAITING_DEPOSIT))
+        self.assertEqual(
+            frozenset([states.DepositPaidState,
+                       states.InsufficientDepositState]),
+            states.registry.allowed(states.WaitingDepositState))
+
+    def test_duplicate_id(self):
+        registry = states.StateRegistry()
+        registry.register(states.NewState)
+        with self.assertRaises(ValueError):
+            registry.register(type('Duplicate', (), {'id': 1}))
+
+    def test_unreachable_state(self):
+        registry = states.StateRegistry()
+        registry.register(states.UnknownState)
+        registry.register(states.NewState)
+        registry.register(states.ClosedState)
+        registry.set_transitions({states.UnknownState: [states.NewState]})
+        with self.assertRaises(ValueError):
+            registry.validate(states.UnknownState)
+
+
+class TestRedisPool(TestCase):
+
+    def test_client_is_shared(self):
+        client = connect_redis()
+        self.assertIs(client, connect_redis())
+        self.assertIs(client.connection_pool,
+                      connect_redis().connection_pool)
+
+    @override_settings(REDIS_SOCKET_TIMEOUT=0.5)
+    @patch.object(locks, '_lock_client', None)
+    @patch.object(locks, '_client', None)
+    def test_blocking_lock_outlives_socket_timeout(self):
+        key = 'contended'
+        released = threading.Event()
+
+        def hold():
+            with locks.nowait_lock(connect_lock_redis()) as holder:
+                holder.lock(key, policy=locks.BLOCKING)
+                released.wait(1.5)
+
+        holder = threading.Thread(target=hold)
+        holder.start()
+        time.sleep(0.2)
+        try:
+            started = time.monotonic()
+            with locks.nowait_lock(connect_lock_redis()) as waiter:
+                self.assertTrue(waiter.lock(key, policy=locks.BLOCKING))
+            self.assertGreater(time.monotonic() - started, 1)
+        finally:
+            released.set()
+            holder.join()
+
+    def test_pool_stats(self):
+        client = connect_redis()
+        client.ping()
+        stats = pool_stats(client.connection_pool)
+        self.assertEqual(settings.REDIS_MAX_CONNECTIONS, stats['max'])
+        self.assertGreaterEqual(stats['created'], 1)
+        self.assertEqual(stats['created'], stats['idle'] + stats['in_use'])
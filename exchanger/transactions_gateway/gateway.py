@@ -1,5 +1,5 @@
-import grpc
 import typing
+from datetime import datetime
 from decimal import Decimal
 from django.conf import settings
 from exchanger.gateway.base import BaseGateway
@@ -19,6 +19,7 @@ class TransactionsServiceGateway(BaseGateway):
     ALLOWED_STATUTES = (transactions_pb2.SUCCESS,)
     EXC_CLASS = TransactionsBadResponseException
     BAD_RESPONSE_MSG = 'Bad response from transactions gateway.'
+    IDEMPOTENT_METHODS = frozenset({'GetOutPutTransactions'})
 
     def create_transfer(
             self,
@@ -35,11 +36,29 @@ class TransactionsServiceGateway(BaseGateway):
         :param currency_slug: currency slug of transfer
         :param value: transfer amount
         :param wallet_id: internal id of wallet
-        :param uuid: unique identifier of transaction
+        :param uuid: unique identifier of transaction, transactions service
+        accepts transfer with the same uuid once
         :return: response dict
         """
 
-        request_message = self.MODULE.CreateTransferRequest(
+        request_message = self.transfer_request(
+            address_from, address_to, currency_slug, value, wallet_id, uuid)
+        resp = self._base_request(
+            request_message,
+            'CreateTransfer',
+        )
+        return resp
+
+    def transfer_request(
+            self,
+            address_from: str,
+            address_to: str,
+            currency_slug: str,
+            value: typing.Union[str, Decimal],
+            wallet_id: int,
+            uuid: str
+    ):
+        return self.MODULE.CreateTransferRequest(
             transfer=transactions_pb2.Transfer(
                 address_from=address_from,
                 address_to=address_to,
@@ -49,11 +68,37 @@ class TransactionsServiceGateway(BaseGateway):
                 uuid=str(uuid)),
         )
 
-        with grpc.insecure_channel(self.GW_ADDRESS) as channel:
-            client = self.ServiceStub(channel)
+    def transfer_exists(
+            self,
+            address_from: str,
+            address_to: str,
+            currency_slug: str,
+            value: typing.Union[str, Decimal],
+            wallet_id: int,
+            since: datetime
+    ) -> bool:
+        """
+        Check whether service made output transaction of transfer.
+        Service neither looks transfers up by uuid nor has own status for
+        uuid it accepted before, so output transactions of paying wallet
+        made since the first submission are matched by recipient and value.
 
-            resp = self._base_request(
-                request_message,
-                client.CreateTransfer,
-            )
-        return resp
+        :param since: time of the first submission of transfer
+        :return: True if transfer is made
+        """
+        request_message = self.MODULE.GetOutPutRequest(
+            wallet_id=wallet_id,
+            wallet_address=address_from,
+            currencySlug=currency_slug,
+            time_from=int(since.timestamp()),
+            time_to=int(datetime.now().timestamp()),
+        )
+        response = self._base_request(
+            request_message,
+            'GetOutPutTransactions',
+            raw=True,
+        )
+        value = Decimal(value)
+        return any(trx.isOutput and trx.to == address_to and trx.value
+                   and Decimal(trx.value) == value
+                   for trx in response.transactions)
@@ -0,0 +1,184 @@
+import random
+import typing
+import logging
+import threading
+from datetime import datetime
+from datetime import timedelta
+
+from django import db
+from django.conf import settings
+from django.db import transaction
+from prometheus_client import Counter
+
+from .gateway import trx_service_gw
+from .gateway.breaker import CircuitOpenError
+from .gateway.coalescer import CoalescingCaller
+from .models import TransferIntent
+from .queues import advance_queue
+
+logger = logging.getLogger('exchanger')
+
+TRANSFERS_SUBMITTED = Counter(
+    'exchanger_transfer_submissions_total',
+    'Submission attempts of outgoing transfers by result',
+    ['result'])
+
+
+class TransferSubmitter:
+    """
+    Submit pending transfer intents to transactions service in batches.
+
+    Batch is claimed in short transaction: rows are selected with SKIP
+    LOCKED and postponed by TRANSFER_CLAIM_TIMEOUT, so several submitters
+    can run together. Requests of a batch are pipelined over one channel
+    outside of transaction and results are saved in another short one.
+    Intent whose earlier attempt failed may have been paid out anyway,
+    e.g. after a timeout, so before it is sent again its output
+    transaction is looked up and found one counts as accepted transfer.
+    Failed submission is retried with jittered exponential backoff and
+    marked FAILED after TRANSFER_MAX_ATTEMPTS, submission rejected by open
+    circuit breaker is postponed without spending an attempt. Exchanges of
+    accepted and failed transfers are pushed to advance queue, their states
+    move on there.
+    """
+
+    RECONCILED_FIELDS = ['status', 'attempts', 'next_attempt_at',
+                         'submitted_at', 'last_error', 'updated_at']
+
+    def __init__(self, batch_size: typing.Optional[int] = None, gw=None):
+        self.batch_size = batch_size or settings.TRANSFER_BATCH_SIZE
+        self.gw = gw or trx_service_gw
+        self.caller = CoalescingCaller(
+            self.gw, 'CreateTransfer',
+            max_batch=self.batch_size,
+            max_delay=0)
+        self._stop = threading.Event()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__} class'
+
+    def stop(self) -> typing.NoReturn:
+        self._stop.set()
+
+    def due(self):
+        return TransferIntent.objects.filter(
+            status=TransferIntent.PENDING,
+            next_attempt_at__lte=datetime.now(),
+        ).order_by('next_attempt_at')
+
+    def claim(self) -> typing.List[TransferIntent]:
+        """
+        Take batch of due intents, other submitters skip it until claim
+        expires.
+        """
+        with transaction.atomic():
+            batch = list(self.due().select_for_update(
+                skip_locked=True)[:self.batch_size])
+            if batch:
+                TransferIntent.objects.filter(
+                    id__in=[intent.id for intent in batch],
+                ).update(next_attempt_at=datetime.now() + timedelta(
+                    seconds=settings.TRANSFER_CLAIM_TIMEOUT))
+        return batch
+
+    def submit_batch(self) -> int:
+        """Submit one batch, return number of processed intents."""
+        batch = self.claim()
+        if not batch:
+            return 0
+        self.record(batch, self.send(batch))
+        return len(batch)
+
+    def send(self, batch: typing.List[TransferIntent]) -> \
+            typing.List[typing.Optional[BaseException]]:
+        """
+        Submit claimed intents, return error of every one, None if its
+        transfer is made.
+        """
+        errors = {}
+        unsent = []
+        for intent in batch:
+            try:
+                if intent.attempts and self.made(intent):
+                    errors[intent.id] = None
+                else:
+                    unsent.append(intent)
+            except Exception as e:
+                errors[intent.id] = e
+        futures = self.caller.call_many(
+            self.gw.transfer_request(**intent.transfer_dict())
+            for intent in unsent)
+        for intent, future in zip(unsent, futures):
+            errors[intent.id] = future.exception()
+        return [errors[intent.id] for intent in batch]
+
+    def made(self, intent: TransferIntent) -> bool:
+        """True if service made output transaction of intent already."""
+        return self.gw.transfer_exists(
+            address_from=intent.address_from,
+            address_to=intent.address_to,
+            currency_slug=intent.currency_slug,
+            value=intent.value,
+            wallet_id=intent.wallet_id,
+            since=intent.created_at,
+        )
+
+    def record(self,
+               batch: typing.List[TransferIntent],
+               errors: typing.List[typing.Optional[BaseException]]) -> \
+            typing.NoReturn:
+        """Save outcomes of batch, push exchanges of finished intents."""
+        with transaction.atomic():
+            for intent, error in zip(batch, errors):
+                self.reconcile(intent, error)
+            done = [intent.exchange_id for intent in batch
+                    if intent.status != TransferIntent.PENDING]
+            if done:
+                transaction.on_commit(lambda: advance_queue().push(*done))
+
+    def reconcile(self,
+                  intent: TransferIntent,
+                  error: typing.Optional[BaseException]) -> bool:
+        """Save outcome of submission attempt to intent."""
+        now = datetime.now()
+        if isinstance(error, CircuitOpenError):
+            # transfer was not sent, attempt is not spent
+            intent.last_error = f'{error}'
+            intent.next_attempt_at = now + timedelta(
+                seconds=self.gw.breaker.open_seconds * random.uniform(1, 1.2))
+            intent.save(update_fields=self.RECONCILED_FIELDS)
+            TRANSFERS_SUBMITTED.labels('rejected').inc()
+            return False
+        intent.attempts += 1
+        if error is None:
+            intent.status = TransferIntent.SUBMITTED
+            intent.submitted_at = now
+            result = 'submitted'
+        else:
+            intent.last_error = f'{error}'
+            if intent.attempts >= settings.TRANSFER_MAX_ATTEMPTS:
+                intent.status = TransferIntent.FAILED
+                logger.error(f'{self.__class__.__name__} gave up {intent} '
+                             f'of exchange {intent.exchange_id}: {error}')
+            else:
+                delay = min(
+                    settings.TRANSFER_BACKOFF * 2 ** (intent.attempts - 1),
+                    settings.TRANSFER_MAX_BACKOFF)
+                intent.next_attempt_at = now + timedelta(
+                    seconds=delay * random.uniform(1, 1.2))
+            result = 'error'
+        intent.save(update_fields=self.RECONCILED_FIELDS)
+        TRANSFERS_SUBMITTED.labels(result).inc()
+        return result == 'submitted'
+
+    def run(self) -> typing.NoReturn:
+        while not self._stop.is_set():
+            try:
+                processed = self.submit_batch()
+            except Exception as e:
+                logger.error(f'{self.__class__.__name__} batch failed {e}')
+                processed = 0
+            finally:
+                db.close_old_connections()
+            if processed < self.batch_size:
+                self._stop.wait(settings.TRANSFER_POLL_INTERVAL)
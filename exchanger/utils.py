@@ -1,15 +1,15 @@
 import sys
 import warnings
-import logging
 import typing
 from functools import wraps
 
-from django.core.mail import send_mail
 from django.db import transaction
 from decimal import Decimal
 from decimal import ROUND_HALF_UP
 from django.conf import settings
-from django.template.loader import render_to_string
+
+if typing.TYPE_CHECKING:
+    from exchanger.currencies_gateway.rates import RateTable
 
 
 def nested_commit_on_success(func):
@@ -20,13 +20,8 @@ def nested_commit_on_success(func):
     return _nested_commit_on_success
 
 
-def all_subclasses(cls):
-    return cls.__subclasses__() + [g for s in cls.__subclasses__()
-                                   for g in all_subclasses(s)]
-
-
-def calculate_fee(amount: Decimal, rates: dict, slug: str) -> Decimal:
-    amount_in_usd = amount * Decimal(rates[slug])
+def calculate_fee(amount: Decimal, rates: 'RateTable', slug: str) -> Decimal:
+    amount_in_usd = rates.to_usd(amount, slug)
     return Decimal(settings.TRX_FEE_DICT[amount_in_usd >
                                          settings.MIN_FEE_LIMIT])
 
@@ -68,42 +63,3 @@ def all_kwargs_required(func):
                                  f'function "{func.__name__}" is required')
         return func(*args, **kwargs)
     return _wrapper
-
-
-def send_mail_to_user(exchanger):
-
-    use_https = settings.DEFAULT_HOST == 'app.bonumchain.com'
-    send_to = exchanger.user_email
-    context = {
-        'default_host': settings.DEFAULT_HOST,
-        'uuid': exchanger.uuid,
-        'protocol': 'https' if use_https else 'http',
-        'email': send_to
-    }
-
-    try:
-        send_mail(
-            'New exchange operation is created',
-            '',
-            settings.DEFAULT_FROM_EMAIL,
-            [send_to],
-            html_message=render_to_string(
-                'exchanger_mail.html', context),
-        )
-    except Exception as e:
-        logger = logging.getLogger('exchanger')
-        logger.error(f'send email to {send_to} failed {e}')
-
-
-def send_email_to_owners(exchanger):
-    if settings.SEND_MAIL_TO_OWNERS:
-        try:
-            send_mail(
-                'New exchange operation is created',
-                f'New exchange operation is created '
-                f':{exchanger.uuid} and user {exchanger.user_email}',
-                settings.DEFAULT_FROM_EMAIL,
-                settings.RECIPIENTS)
-        except Exception as e:
-            logger = logging.getLogger('exchanger')
-            logger.error(f'send email to {settings.RECIPIENTS} failed {e}')
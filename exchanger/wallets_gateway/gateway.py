@@ -1,9 +1,10 @@
-import grpc
 import typing
 from decimal import Decimal
 from django.conf import settings
 from exchanger.utils import all_kwargs_required
 from exchanger.gateway.base import BaseGateway
+from exchanger.gateway.coalescer import CoalescingCaller
+from exchanger.gateway.pool import ChannelPool
 from exchanger.rpc.wallets_pb2_grpc import wallets__pb2 as wallets_pb2
 from exchanger.rpc import wallets_pb2_grpc
 from .exceptions import WalletsBadResponseException
@@ -18,7 +19,30 @@ class WalletsServiceGateway(BaseGateway):
     ServiceStub = wallets_pb2_grpc.WalletsStub
     ALLOWED_STATUTES = (wallets_pb2.SUCCESS,)
     EXC_CLASS = WalletsBadResponseException
+    IDEMPOTENT_METHODS = frozenset({'StartMonitoringPlatformWallet'})
     BAD_RESPONSE_MSG = 'Bad response from wallets gateway.'
+    COALESCED_METHODS = ('StartMonitoringPlatformWallet', 'AddInputTransaction')
+
+    def __init__(self, pool: typing.Optional[ChannelPool] = None):
+        super().__init__(pool)
+        self.coalescers = {
+            method: CoalescingCaller(
+                self, method,
+                max_batch=settings.WALLETS_COALESCE_MAX_BATCH,
+                max_delay=settings.WALLETS_COALESCE_DELAY,
+                senders=settings.WALLETS_COALESCE_SENDERS)
+            for method in self.COALESCED_METHODS
+        }
+
+    def _coalesced_request(self, request_message, method: str) -> \
+            typing.Dict[str, typing.Any]:
+        """
+        Send request together with concurrent calls of the same method and
+        wait for own response. Plain request when coalescing is off.
+        """
+        if not settings.WALLETS_COALESCE or settings.TEST_MODE:
+            return self._base_request(request_message, method)
+        return self.coalescers[method].call(request_message)
 
     @all_kwargs_required
     def put_on_monitoring(
@@ -51,14 +75,10 @@ class WalletsServiceGateway(BaseGateway):
             expected_amount=str(expected_amount),
             uuid=str(uuid),
         )
-
-        with grpc.insecure_channel(self.GW_ADDRESS) as channel:
-            client = self.ServiceStub(channel)
-
-            resp = self._base_request(
-                request_message,
-                client.StartMonitoringPlatformWallet,
-            )
+        resp = self._coalesced_request(
+            request_message,
+            'StartMonitoringPlatformWallet',
+        )
         return resp
 
     @all_kwargs_required
@@ -90,12 +110,8 @@ class WalletsServiceGateway(BaseGateway):
             value=str(amount),
             uuid=str(uuid),
         )
-
-        with grpc.insecure_channel(self.GW_ADDRESS) as channel:
-            client = self.ServiceStub(channel)
-
-            resp = self._base_request(
-                request_message,
-                client.AddInputTransaction,
-            )
+        resp = self._coalesced_request(
+            request_message,
+            'AddInputTransaction',
+        )
         return resp
@@ -1,3 +1,7 @@
+from django.conf import settings
+from exchanger.deadline import deadline
+
+
 class HeadersMiddleware:
 
     def __init__(self, get_response):
@@ -14,3 +18,14 @@ class HeadersMiddleware:
         if 'Cache-Control' not in response:
             response['Cache-Control'] = 'max-age=0 no-cache s-maxage=0'
         return response
+
+
+class DeadlineMiddleware:
+    """Give every request REQUEST_DEADLINE seconds for remote calls."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with deadline(settings.REQUEST_DEADLINE):
+            return self.get_response(request)
@@ -55,6 +55,7 @@ MIDDLEWARE = [
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'exchanger_service.middleware.HeadersMiddleware',
+    'exchanger_service.middleware.DeadlineMiddleware',
     'django_prometheus.middleware.PrometheusAfterMiddleware',
 ]
 
@@ -137,8 +138,41 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 GRPC_SERVER_PORT = '50054'
+GRPC_SERVER_MAX_WORKERS = 10
+GRPC_SERVER_MAX_CONCURRENT_RPCS = None  # no limit
 GRPC_TIMEOUT = 10  # default timeout for grpc requests
-REMOTE_OPERATION_ATTEMPT_NUMBER = 3
+REMOTE_OPERATION_ATTEMPT_NUMBER = 3  # attempts of idempotent grpc requests
+GRPC_RETRY_BACKOFF = 0.1  # seconds before first retry, doubled every attempt
+GRPC_RETRY_MAX_BACKOFF = 2
+GRPC_METHOD_TIMEOUTS = {  # per method overrides of GRPC_TIMEOUT
+    'CheckAddress': 2,
+    'GetTransaction': 5,
+    'Get': 3,
+    'StartMonitoringPlatformWallet': 5,
+    'AddInputTransaction': 5,
+    'CreateTransfer': 15,
+}
+REQUEST_DEADLINE = 20  # seconds of remote calls budget of one http request
+CIRCUIT_BREAKER = {  # defaults of per service circuit breakers
+    'window': 30,  # seconds of call outcomes taken into account
+    'min_calls': 10,  # outcomes in window needed to open
+    'failure_rate': 0.5,  # share of failed or slow calls that opens
+    'slow_call_seconds': 5,  # slower successful calls count as failed
+    'open_seconds': 15,  # time calls fail fast before a probe is let through
+    'shared': True,  # publish opening to all workers via redis
+}
+CIRCUIT_BREAKERS = {}  # overrides of CIRCUIT_BREAKER by gateway NAME
+WALLETS_COALESCE = True  # send concurrent wallets monitoring calls together
+WALLETS_COALESCE_DELAY = 0.005  # seconds first call waits for others
+WALLETS_COALESCE_MAX_BATCH = 64  # calls sent together at most
+WALLETS_COALESCE_SENDERS = 4  # batches sent at the same time
+GRPC_KEEPALIVE_TIME_MS = 30 * 1000
+GRPC_KEEPALIVE_TIMEOUT_MS = 10 * 1000
+GRPC_INITIAL_RECONNECT_BACKOFF_MS = 500
+GRPC_MAX_RECONNECT_BACKOFF_MS = 5 * 1000
+GRPC_HEALTH_CHECK_TIMEOUT = 2  # seconds to wait pooled channel is ready
+GRPC_HEALTH_CHECK_INTERVAL = 30  # seconds between checks of pooled channels
+GRPC_CHANNEL_CLOSE_GRACE = 30  # seconds replaced channel serves started calls
 ONE_DAY_IN_SECONDS = 60 * 60 * 24
 
 # gateway addresses
@@ -147,6 +181,11 @@ WALLETS_GW_ADDRESS = 'localhost:50051'
 TRANSACTIONS_GW_ADDRESS = 'localhost:50051'
 CURRENCY_GW_ADDRESS = 'localhost:50051'
 BLOCKCHAIN_GW_ADDRESS = 'localhost:50051'
+BGW_CHECK_ADDRESS_WORKERS = 8  # concurrent address checks per process
+BGW_ADDRESS_CACHE_SIZE = 10000  # validated addresses kept per process
+BGW_ADDRESS_CACHE_TTL = 60 * 60  # seconds
+FAN_OUT_WORKERS = 16  # threads running independent remote calls together
+EXTERNAL_VALIDATION_TIMEOUT = 5  # seconds for all remote checks of new exchange
 MIN_FEE_LIMIT = 100  # in usd
 DEFAULT_FEE = 5
 DELTA = 5
@@ -175,10 +214,52 @@ SEND_MAIL_TO_OWNERS = False
 
 RECIPIENTS = ['healfy92@gmail.ru', 'pavel.jahont@gmail.com',
               'marina.306.minsk@gmail.com']
+MAIL_OUTBOX_BATCH_SIZE = 50  # mails delivered over one backend connection
+MAIL_OUTBOX_POLL_INTERVAL = 2  # seconds mail_outbox waits when outbox is empty
+MAIL_OUTBOX_BACKOFF = 30  # seconds before first retry, doubled every attempt
+MAIL_OUTBOX_MAX_BACKOFF = 3600
+MAIL_OUTBOX_MAX_ATTEMPTS = 10
+MAIL_OUTBOX_CLAIM_TIMEOUT = 300  # seconds claimed mails are hidden from other senders
+TRANSFER_BATCH_SIZE = 50  # transfers submitted together by transfer_submitter
+TRANSFER_POLL_INTERVAL = 1  # seconds transfer_submitter waits when idle
+TRANSFER_CLAIM_TIMEOUT = 300  # seconds claimed transfers are hidden from other submitters
+TRANSFER_BACKOFF = 5  # seconds before first resubmission, doubled every attempt
+TRANSFER_MAX_BACKOFF = 600
+TRANSFER_MAX_ATTEMPTS = 20
 
 REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
 REDIS_PASSWORD = os.environ.get('REDIS_PASSWORD', '')
 REDIS_NAMESPACE = 'exchanger'
+REDIS_MAX_CONNECTIONS = 50  # per process
+REDIS_POOL_TIMEOUT = 5  # seconds to wait for free connection in pool
+REDIS_SOCKET_TIMEOUT = 5
+REDIS_LOCK_SOCKET_TIMEOUT = 130  # lock connections, over ManualLockGateway.max_timeout of blocking wait
+REDIS_SOCKET_CONNECT_TIMEOUT = 2
+REDIS_HEALTH_CHECK_INTERVAL = 30  # seconds between pings of shared pool
+ADVANCE_QUEUE_BACKEND = 'redis'  # redis or local (drained in process, for development)
+ADVANCE_QUEUE_POP_TIMEOUT = 1  # seconds
+ADVANCE_QUEUE_LEASE = 60  # seconds processing list of silent worker is kept
+ADVANCE_WORKERS = 10  # exchanges advanced concurrently by advance_exchanges
+ADVANCE_LOCK_TIMEOUT = 5  # seconds worker waits for locked exchange, below REDIS_LOCK_SOCKET_TIMEOUT
+SCHEDULER_INTERVAL = 5  # seconds between exchange_scheduler sweeps
+SCHEDULER_BATCH_SIZE = 100  # exchanges of one status advanced per sweep
+SCHEDULER_WORKERS = 10  # exchanges advanced concurrently by exchange_scheduler
+SCHEDULER_DEFAULT_BACKOFF = 10  # seconds since last update before sweep
+SCHEDULER_BACKOFF = {  # per status overrides of SCHEDULER_DEFAULT_BACKOFF
+    'WAITING_HASH': 300,
+    'WAITING_DEPOSIT': 30,
+    'OUTGOING_RUNNING': 30,
+    'RETURNING_DEPOSIT': 30,
+}
+SCHEDULER_MAX_BACKOFF = 900  # cap of backoff of exchange that does not move
+SCHEDULER_JITTER = 0.2  # relative random spread of all scheduler intervals
+EXCHANGE_LIST_PAGE_SIZE = 50
+EXCHANGE_LIST_MAX_PAGE_SIZE = 500
+EXCHANGE_STREAM_CHUNK_SIZE = 1000  # rows fetched per round trip when streaming
+EXPORT_CHUNK_SIZE = 2000  # rows fetched per round trip by exports
+RATES_CACHE_TTL = 10  # seconds rates are served without revalidation
+RATES_CACHE_STALE_TTL = 50  # seconds stale rates are served while refreshing
+RATES_MAX_STALENESS = 30  # max rates age for fee and amount calculation
 TRANSACTION_DELTA = 30  # minutes
 # Internationalization
 # https://docs.djangoproject.com/en/2.2/topics/i18n/
@@ -55,6 +55,7 @@ urlpatterns = [
     path('api/', include('rest_framework.urls', namespace='rest_framework')),
     path('api/currency/', views.CurrencyServiceView.as_view()),
     path('api/settings/', views.SettingsView.as_view()),
+    path('api/export/<str:name>/', views.ExportView.as_view()),
     url('', include('django_prometheus.urls')),
 
 ]